@@ -2,6 +2,7 @@ from spikectl.model.notifications import MotorSensorData, SensorNotification
 from typing import List, Tuple
 import spikectl
 import spikectl.model
+import os
 import time
 
 def calculate_gear_ratio(first: int, axes: List[Tuple[int, int]], last: int) -> float:
@@ -16,6 +17,10 @@ def calculate_gear_ratio(first: int, axes: List[Tuple[int, int]], last: int) ->
 
 def main():
     spike_hub = spikectl.find_hub('mp8')    
+    # SPIKECTL_TRACE=moves.json records a timeline to open in Perfetto
+    trace_path = os.environ.get('SPIKECTL_TRACE')
+    if trace_path:
+        spike_hub.enable_tracing()
     
     wrist_angle_motor = spike_hub.motor('D')    
     wrist_angle_ratio = calculate_gear_ratio(8, [(24, 16), (16, 12), (12, 12)], 60)    
@@ -43,38 +48,42 @@ def main():
             hand_motor.rotate(-100, 360)
         )
 
-        spike_hub.wait(
-            hand_motor.rotate((-100/wrist_angle_ratio) * 1.666666, 150),
+        # Coordinated moves go out in a single write so the motors start together
+        with spike_hub.batch() as moves:
+            hand_motor.rotate((-100/wrist_angle_ratio) * 1.666666, 150)
             wrist_angle_motor.rotate(100, 90 * wrist_angle_ratio)
-        )
+        spike_hub.wait(*moves)
 
-        spike_hub.wait(
-            hand_motor.rotate((100/wrist_angle_ratio) * 1.666666, 150),
+        with spike_hub.batch() as moves:
+            hand_motor.rotate((100/wrist_angle_ratio) * 1.666666, 150)
             wrist_angle_motor.rotate(-100, 90 * wrist_angle_ratio)
-        )
+        spike_hub.wait(*moves)
         
-        spike_hub.wait(
-            wrist_angle_motor.rotate(100 * (angle_vs_rotation_ratio / wrist_rotation_ratio), angle * angle_vs_rotation_ratio * 0.5),
-            wrist_rotation_motor.rotate(100, angle * wrist_rotation_ratio * 0.5),
+        with spike_hub.batch() as moves:
+            wrist_angle_motor.rotate(100 * (angle_vs_rotation_ratio / wrist_rotation_ratio), angle * angle_vs_rotation_ratio * 0.5)
+            wrist_rotation_motor.rotate(100, angle * wrist_rotation_ratio * 0.5)
             hand_motor.rotate(-100 * (1 / wrist_rotation_ratio), angle* 0.5)
-        )
+        spike_hub.wait(*moves)
         
-        spike_hub.wait(
-            wrist_angle_motor.rotate(-100 * float(angle_vs_rotation_ratio / wrist_rotation_ratio), angle * angle_vs_rotation_ratio),
-            wrist_rotation_motor.rotate(-100, angle * wrist_rotation_ratio),
-            hand_motor.rotate(100 * (1 / wrist_rotation_ratio), angle)            
-        )
+        with spike_hub.batch() as moves:
+            wrist_angle_motor.rotate(-100 * float(angle_vs_rotation_ratio / wrist_rotation_ratio), angle * angle_vs_rotation_ratio)
+            wrist_rotation_motor.rotate(-100, angle * wrist_rotation_ratio)
+            hand_motor.rotate(100 * (1 / wrist_rotation_ratio), angle)
+        spike_hub.wait(*moves)
 
-        spike_hub.wait(
-            wrist_angle_motor.rotate(100 * (angle_vs_rotation_ratio / wrist_rotation_ratio), angle * angle_vs_rotation_ratio * 0.5),
-            wrist_rotation_motor.rotate(100, angle * wrist_rotation_ratio * 0.5),
+        with spike_hub.batch() as moves:
+            wrist_angle_motor.rotate(100 * (angle_vs_rotation_ratio / wrist_rotation_ratio), angle * angle_vs_rotation_ratio * 0.5)
+            wrist_rotation_motor.rotate(100, angle * wrist_rotation_ratio * 0.5)
             hand_motor.rotate(-100 * (1 / wrist_rotation_ratio), angle* 0.5)
-        )        
+        spike_hub.wait(*moves)
         
     except KeyboardInterrupt as err:
         print(err)
 
     spike_hub.wait(*[ task.stop() for task in motors])
+
+    if trace_path:
+        spike_hub.tracer.export(trace_path)
     
     spike_hub.close()
 
@@ -0,0 +1,9 @@
+from .stream import *
+from .timing import *
+
+__all__ = [
+    'RecordedSerial',
+    'sample_stream',
+    'Measurement',
+    'measure'
+]
\ No newline at end of file
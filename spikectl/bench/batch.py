@@ -0,0 +1,115 @@
+"""
+Start skew of requests meant to run together, one write each versus a single batched write.
+
+A separate process reads the other end of a pseudo-terminal and times when each request arrives; the
+skew of a group is the time between its first and last request.
+
+    python -m spikectl.bench.batch --motors 3 --trials 500
+"""
+from argparse import ArgumentParser
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+import os
+import pty
+from time import monotonic_ns, sleep
+import tty
+from typing import Dict, List
+
+from serial import Serial
+
+from spikectl.hub import SpikeHub
+
+# Ends a group of requests
+_MARKER = b'#\r'
+
+
+def _receive(master: int, results: Connection):
+    """
+    Receiver process body: reports the skew of each group, in nanoseconds, once the writer closes.
+    """
+    skews = []
+    first = last = None
+    partial = b''
+    while True:
+        try:
+            chunk = os.read(master, 65536)
+        except OSError:
+            break
+        now = monotonic_ns()
+        *frames, partial = (partial + chunk).split(b'\r')
+        for frame in frames:
+            if frame == b'#':
+                if first is not None:
+                    skews.append(last - first)
+                first = last = None
+            elif frame:
+                if first is None:
+                    first = now
+                last = now
+        if b'#end' in chunk:
+            break
+    results.send(skews)
+
+
+def _percentile(ordered: List[int], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1000 if ordered else float('nan')
+
+
+def run(motors: int = 3, trials: int = 500, batched: bool = True) -> Dict[str, float]:
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    os.write(master, b'\r')
+    hub = SpikeHub(Serial(os.ttyname(slave), timeout=1))
+    parent, child = Pipe()
+    receiver = Process(target=_receive, args=(master, child), daemon=True)
+    receiver.start()
+
+    ports = 'ABCDEF'[:motors]
+    send_times = []
+    try:
+        for _ in range(trials):
+            start = monotonic_ns()
+            if batched:
+                with hub.batch():
+                    for port in ports:
+                        hub.motor(port).rotate(100, 90)
+            else:
+                for port in ports:
+                    hub.motor(port).rotate(100, 90)
+            send_times.append(monotonic_ns() - start)
+            hub.connection.write(_MARKER)
+            sleep(0.002)
+        hub.connection.write(b'#end\r')
+        skews = sorted(parent.recv())
+    finally:
+        receiver.join(timeout=2)
+        receiver.terminate()
+        hub.pending.cancel_all()
+        hub.close()
+        os.close(master)
+        os.close(slave)
+
+    send_times.sort()
+    return {
+        'skew_p50_us': _percentile(skews, 0.5),
+        'skew_p99_us': _percentile(skews, 0.99),
+        'send_p50_us': _percentile(send_times, 0.5),
+        'send_p99_us': _percentile(send_times, 0.99)
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Batched write skew benchmark')
+    parser.add_argument('--motors', type=int, default=3)
+    parser.add_argument('--trials', type=int, default=500)
+    args = parser.parse_args()
+
+    for name, batched in (('one write per request', False), ('batched', True)):
+        r = run(args.motors, args.trials, batched)
+        print(f'{name}: arrival skew p50 {r["skew_p50_us"]:.1f} us, p99 {r["skew_p99_us"]:.1f} us; '
+              f'send p50 {r["send_p50_us"]:.1f} us, p99 {r["send_p99_us"]:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Listener calls and cost per sensor frame of decoding every frame versus `SensorDeadband`, on a robot that is
+mostly idle: motors on A and B, a force sensor on E, motor A turning for `--moving` of the frames and the
+accelerometer jittering by a couple of units.
+
+    python -m spikectl.bench.deadband --frames 20000 --moving 0.1
+"""
+from argparse import ArgumentParser
+import json
+import random
+from typing import List
+
+from spikectl import ujsonrpc
+from spikectl.hub import SensorDeadband
+from spikectl.model import decode_notification
+
+from .timing import Measurement, measure
+
+
+def idle_frames(frames: int = 20000, moving: float = 0.1, seed: int = 0) -> List[ujsonrpc.RPCNotification]:
+    rnd = random.Random(seed)
+    position = 0
+    messages = []
+    for n in range(frames):
+        speed = 50 if n % 1000 < moving * 1000 else 0
+        position += speed // 10
+        frame = [
+            [48, [speed, position, position % 360 - 180, speed]],
+            [48, [0, 90, 90, 0]],
+            [0, []],
+            [0, []],
+            [63, [0, 0, 0]],
+            [0, []],
+            [rnd.randint(-2, 2), rnd.randint(-2, 2), 986 + rnd.randint(-2, 2)],
+            [0, 0, 0],
+            [0, 0, 0],
+            '0000099999000009999900000',
+            n * 20
+        ]
+        messages.append(ujsonrpc.decode(json.loads(json.dumps({'m': 0, 'p': frame}))))
+    return messages
+
+
+def run(frames: int = 20000, moving: float = 0.1, repeat: int = 5) -> List[Measurement]:
+    messages = idle_frames(frames, moving)
+    calls = {}
+
+    def decode_all() -> int:
+        count = 0
+
+        def listener(_):
+            nonlocal count
+            count += 1
+
+        for msg in messages:
+            listener(decode_notification(msg))
+        calls['decode_notification'] = count
+        return len(messages)
+
+    def deadband_all() -> int:
+        count = 0
+
+        def listener(_):
+            nonlocal count
+            count += 1
+
+        deadband = SensorDeadband(motor_position=2, motor_speed=1, accelerometer=5, force_force=1)
+        for msg in messages:
+            deadband.feed(msg.parameters, 0.0, listener)
+        calls['SensorDeadband'] = count
+        return len(messages)
+
+    results = [
+        measure('decode_notification', decode_all, repeat),
+        measure('SensorDeadband', deadband_all, repeat)
+    ]
+    for m in results:
+        m.name = f'{m.name}: {calls[m.name] / frames:.3f} listener calls per frame'
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='Deadband filtering benchmark')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--moving', type=float, default=0.1, help='share of frames with motor A turning')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for m in run(args.frames, args.moving, args.repeat):
+        print(f'{m.name}, {m.wall / m.count * 1e9:,.0f} ns per frame')
+
+
+if __name__ == '__main__':
+    main()
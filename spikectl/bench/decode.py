@@ -0,0 +1,59 @@
+"""
+Tracks the cost of `decode_notification` per call on a recorded stream.
+
+    python -m spikectl.bench.decode --frames 20000
+    python -m spikectl.bench.decode --capture session.cap
+"""
+from argparse import ArgumentParser
+import json
+from typing import List, Optional
+
+from spikectl import ujsonrpc
+from spikectl.hub.capture import CaptureReader
+from spikectl.model import decode_notification
+
+from .stream import sample_stream
+from .timing import Measurement, measure
+
+
+def recorded_notifications(frames: int = 20000, capture: Optional[str] = None) -> List[ujsonrpc.RPCNotification]:
+    stream = CaptureReader(capture).stream() if capture else sample_stream(frames)
+    messages = []
+    for frame in stream.split(b'\r'):
+        try:
+            messages.append(ujsonrpc.decode(json.loads(frame)))
+        except ValueError:
+            continue
+    return [msg for msg in messages if msg is not None and msg.is_notification()]
+
+
+def run(frames: int = 20000, repeat: int = 5, capture: Optional[str] = None) -> List[Measurement]:
+    notifications = recorded_notifications(frames, capture)
+    sensor = [n for n in notifications if n.method == 0]
+
+    def decode_all(batch):
+        def run_once() -> int:
+            for n in batch:
+                decode_notification(n)
+            return len(batch)
+        return run_once
+
+    return [
+        measure('decode_notification', decode_all(notifications), repeat),
+        measure('decode_notification (sensor frames)', decode_all(sensor), repeat)
+    ]
+
+
+def main():
+    parser = ArgumentParser(description='Notification decoding micro-benchmark')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--capture', help='decode a recorded session instead of a synthetic stream')
+    args = parser.parse_args()
+
+    for m in run(args.frames, args.repeat, args.capture):
+        print(f'{m.name}: {m.wall / m.count * 1e9:,.0f} ns/call ({m.count} calls)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Fleet rollouts against local stand-in hubs: a first deployment, the same one again (with the slot tables
+cached and read afresh), and one that reorders slots and changes a single program.
+
+    python -m spikectl.bench.deploy --hubs 30 --programs 4 --size 8192
+"""
+from argparse import ArgumentParser
+import random
+from time import monotonic
+from typing import Dict, List
+
+from spikectl.hub import HubFleet, Program, deploy_to_fleet
+from spikectl.model import StorageInformationNotification
+
+from .emulator import HubEmulator
+
+
+def _rollout(fleet: HubFleet, programs: Dict[int, Program], stand_ins: List[HubEmulator],
+             cached: bool = True) -> Dict[str, float]:
+    if not cached:
+        for hub in fleet.hubs.values():
+            if hub.state is not None:
+                hub.state.discard(StorageInformationNotification)
+    start = monotonic()
+    deployments = deploy_to_fleet(fleet, programs, window=4)
+    elapsed = monotonic() - start
+    for deployment in deployments.values():
+        deployment.result()
+    for stand_in in stand_ins:
+        for slot, program in programs.items():
+            assert stand_in.slots.get(slot) == program.data, f'{stand_in.name} holds a wrong slot {slot}'
+
+    plans = [deployment.plan for deployment in deployments.values()]
+    return {
+        'seconds': elapsed,
+        'kept': sum(len(plan.kept) for plan in plans),
+        'moved': sum(len(plan.moves) for plan in plans),
+        'uploaded': sum(len(plan.uploads) for plan in plans),
+        'uploaded_kb': sum(plan.upload_size for plan in plans) / 1024
+    }
+
+
+def run(hubs: int = 30, programs: int = 4, size: int = 8192, latency: float = 0.005,
+        service: float = 0.001) -> Dict[str, Dict[str, float]]:
+    rnd = random.Random(2)
+    initial = {slot: Program(f'program-{slot}', bytes(rnd.getrandbits(8) for _ in range(size)))
+               for slot in range(programs)}
+    # Every program shifts one slot up and the last one changes
+    changed = dict(initial)
+    changed[programs - 1] = Program(f'program-{programs - 1}', initial[programs - 1].data + b'# changed\n')
+    reordered = {(slot + 1) % programs: program for slot, program in changed.items()}
+
+    stand_ins = [HubEmulator(f'hub-{n}', sensor_rate=0, status_interval=None, latency=latency, service=service, seed=n)
+                 for n in range(hubs)]
+    fleet = HubFleet()
+    for stand_in in stand_ins:
+        fleet.add(stand_in.connect())
+    try:
+        return {
+            'first deployment': _rollout(fleet, initial, stand_ins),
+            'unchanged': _rollout(fleet, initial, stand_ins),
+            'unchanged, slots not cached': _rollout(fleet, initial, stand_ins, cached=False),
+            'reordered, one changed': _rollout(fleet, reordered, stand_ins)
+        }
+    finally:
+        fleet.close()
+        for stand_in in stand_ins:
+            stand_in.close()
+
+
+def main():
+    parser = ArgumentParser(description='Fleet deployment benchmark')
+    parser.add_argument('--hubs', type=int, default=30)
+    parser.add_argument('--programs', type=int, default=4)
+    parser.add_argument('--size', type=int, default=8192, help='program size in bytes')
+    parser.add_argument('--latency', type=float, default=5.0, help='link round trip in ms')
+    parser.add_argument('--service', type=float, default=1.0, help='hub time per request in ms')
+    args = parser.parse_args()
+
+    for name, r in run(args.hubs, args.programs, args.size, args.latency / 1000, args.service / 1000).items():
+        print(f'{name}: {r["seconds"]:.2f}s, {r["kept"]} kept, {r["moved"]} moved, '
+              f'{r["uploaded"]} uploaded ({r["uploaded_kb"]:,.0f} KB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+"""
+A SPIKE hub in software, on a pseudo-terminal, so `SpikeHub` and `find_hub` connect to it unmodified.
+
+The emulator reports sensor frames at `--sensor-rate` per second, as far above the real hub's 20 or so as the
+machine keeps up with, and the hub name, battery and storage every `--status-interval` seconds and on
+`trigger_current_state`. Motors on the ports in `--motors` turn at a speed proportional to the one asked for,
+their positions show in the sensor frames, and motion requests are answered once the motion ends. Other
+`scratch.motor_*` and `scratch.display_*` requests are answered after `--latency` ms, give or take
+`--jitter` ms. Programs can be written, moved and listed as on a hub.
+
+    python -m spikectl.bench.emulator --name mp8 --sensor-rate 1000
+
+prints the device to connect to; with its path in `SPIKECTL_PORTS` `find_hub('mp8')` finds the emulator.
+"""
+from argparse import ArgumentParser
+from base64 import b64decode, b64encode
+from heapq import heappop, heappush
+import json
+import multiprocessing
+import os
+import pty
+import random
+from threading import Condition, Thread
+from time import monotonic, sleep
+import tty
+from typing import Dict, List, Optional, Tuple
+
+from serial import Serial
+
+from spikectl.hub import SpikeHub
+
+
+_PORTS = 'ABCDEF'
+
+# Medium angular motor, reporting speed, relative position, absolute position and power
+_MOTOR_TYPE = 48
+
+# Motion requests the hub answers when the motion ends rather than when it starts
+_MOTIONS = frozenset([
+    'scratch.motor_run_for_degrees',
+    'scratch.motor_run_timed',
+    'scratch.motor_go_to_relative_position',
+    'scratch.motor_go_direction_to_position'
+])
+
+_BLANK_DISPLAY = '0' * 25
+
+# Sensor frames a late emitter still catches up on, in seconds
+_MAX_SENSOR_LAG = 0.1
+
+
+class EmulatedMotor(object):
+    """
+    A motor turning at a constant velocity, in degrees per second, since `since` and until `until` when set.
+    """
+
+    __slots__ = ['angle', 'zero', 'velocity', 'since', 'until', 'generation', 'waiting']
+
+    def __init__(self):
+        self.angle = 0.0
+        # What `angle` reads as relative position 0
+        self.zero = 0.0
+        self.velocity = 0.0
+        self.since = 0.0
+        self.until: Optional[float] = None
+        # Bumped when a motion is interrupted, so its scheduled answer is dropped
+        self.generation = 0
+        # Id of the motion request answered when the motion ends
+        self.waiting: Optional[str] = None
+
+    def angle_at(self, now: float) -> float:
+        end = now if self.until is None else min(now, self.until)
+        return self.angle + self.velocity * max(0.0, end - self.since)
+
+    def move(self, now: float, velocity: float, duration: Optional[float] = None):
+        self.angle = self.angle_at(now)
+        self.since = now
+        self.velocity = velocity
+        self.until = now + duration if duration is not None else None
+
+    def values(self, now: float, max_speed: float) -> List[int]:
+        angle = self.angle_at(now)
+        moving = self.until is None or now < self.until
+        speed = round(self.velocity * 100 / max_speed) if moving else 0
+        absolute = round(angle + 180) % 360 - 180
+        return [speed, round(angle - self.zero), absolute, speed]
+
+
+class HubEmulator(object):
+    """
+    Pseudo-terminal answering like a SPIKE hub; see the module documentation.
+
+    `latency` and `jitter` are in seconds, and `service` is the time the hub spends on each request before
+    taking the next one. `failure_rate` is the share of program packages answered with an error. With
+    `process` set the emulator runs in a child process, away from the host's interpreter lock; its slots
+    and counters then change in the child only. With `sequence_time` set the time field of sensor frames holds
+    their sequence number instead of milliseconds, so a reader can tell which frames it missed.
+    """
+
+    def __init__(self, name: str = 'emulated', sensor_rate: float = 20.0, status_interval: Optional[float] = 5.0,
+                 latency: float = 0.005, jitter: float = 0.0, service: float = 0.0, motors: str = 'ABEF',
+                 max_speed: float = 1000.0, block_size: int = 512, failure_rate: float = 0.0, seed: int = 0,
+                 sequence_time: bool = False, process: bool = False):
+        assert sensor_rate >= 0, 'sensor_rate must not be negative'
+        self.name = name
+        self.sensor_rate = sensor_rate
+        self.status_interval = status_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.service = service
+        self.max_speed = max_speed
+        self.block_size = block_size
+        self.failure_rate = failure_rate
+        self.sequence_time = sequence_time
+        self.motors: Dict[str, EmulatedMotor] = {port: EmulatedMotor() for port in motors}
+        self.display = _BLANK_DISPLAY
+        self.slots: Dict[int, bytes] = {}
+        self.meta: Dict[int, dict] = {}
+        # Requests read, and sensor frames and answers written
+        self.requests = 0
+        self.sensor_frames = 0
+        self.answers = 0
+        self._random = random.Random(seed)
+        self._transfers: Dict[str, Tuple[int, dict, bytearray]] = {}
+        self._master, slave = pty.openpty()
+        tty.setraw(slave)
+        tty.setraw(self._master)
+        self.device = os.ttyname(slave)
+        self._slave = slave
+        self._started = monotonic()
+        # Frames to write: due time, order, frame, and the motor and generation of a motion's answer
+        self._outbox: List[Tuple[float, int, bytes, Optional[EmulatedMotor], int]] = []
+        self._sequence = 0
+        self._condition = Condition()
+        self._closed = False
+        self._process: Optional[multiprocessing.Process] = None
+        # RawSerialHub discards the first frame it reads
+        os.write(self._master, b'\r')
+        if process:
+            self._process = multiprocessing.get_context('fork').Process(target=self._run, daemon=True)
+            self._process.start()
+        else:
+            self._start_threads()
+
+    def connect(self, **options) -> SpikeHub:
+        """
+        Opens a hub on the emulator, with `name` set without asking for it.
+        """
+        hub = SpikeHub(Serial(self.device, timeout=1), **options)
+        hub.name = self.name
+        return hub
+
+    def _start_threads(self):
+        Thread(target=self._serve, name='emulator-serve', daemon=True).start()
+        Thread(target=self._emit, name='emulator-emit', daemon=True).start()
+
+    def _run(self):
+        self._start_threads()
+        while True:
+            sleep(3600)
+
+    def _schedule(self, due: float, frame: bytes, motor: Optional[EmulatedMotor] = None, generation: int = 0):
+        with self._condition:
+            heappush(self._outbox, (due, self._sequence, frame, motor, generation))
+            self._sequence += 1
+            self._condition.notify()
+
+    def _delay(self) -> float:
+        jitter = self.jitter
+        delay = self.latency + (self._random.uniform(-jitter, jitter) if jitter else 0.0)
+        return max(0.0, delay)
+
+    def _serve(self):
+        buffer = bytearray()
+        busy_until = 0.0
+        while not self._closed:
+            try:
+                chunk = os.read(self._master, 65536)
+            except OSError:
+                return
+            buffer += chunk
+            *lines, rest = buffer.split(b'\r')
+            buffer = bytearray(rest)
+            for line in lines:
+                if not line:
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    continue
+                self.requests += 1
+                busy_until = max(monotonic(), busy_until) + self.service
+                # Motors, slots and the display are shared with the thread writing frames
+                with self._condition:
+                    self._handle(request, busy_until)
+
+    def _answer(self, idx: str, result: any = None) -> bytes:
+        return json.dumps({'i': idx, 'r': result}, separators=(',', ':')).encode('utf-8') + b'\r'
+
+    def _error(self, idx: Optional[str], message: str) -> bytes:
+        error = b64encode(message.encode('utf-8')).decode('ascii')
+        return json.dumps({'i': idx, 'e': error}, separators=(',', ':')).encode('utf-8') + b'\r'
+
+    def _handle(self, request: any, now: float):
+        idx = request.get('i') if isinstance(request, dict) else None
+        due = now + self._delay()
+        if not isinstance(request, dict) or not isinstance(idx, str) or not isinstance(request.get('m'), str) \
+                or not isinstance(request.get('p') or {}, dict):
+            self._schedule(due, self._error(idx, f'malformed request: {request!r:.80}'))
+            return
+        try:
+            self._dispatch(idx, request['m'], request.get('p') or {}, now, due)
+        except (KeyError, TypeError, ValueError, AttributeError) as err:
+            # Missing or mistyped parameters; the serving thread must outlive them
+            self._schedule(due, self._error(idx, f'{request["m"]} failed: {err!r}'))
+
+    def _dispatch(self, idx: str, method: str, parameters: dict, now: float, due: float):
+        if method.startswith('scratch.motor_'):
+            motor = self.motors.get(parameters.get('port'))
+            if motor is not None:
+                duration = self._drive(motor, method, parameters, now)
+                if method in _MOTIONS and duration is not None:
+                    motor.waiting = idx
+                    self._schedule(now + duration + self._delay(), self._answer(idx), motor, motor.generation)
+                    return
+        elif method.startswith('scratch.display_'):
+            self._draw(method, parameters)
+        elif method == 'trigger_current_state':
+            for frame in self._status():
+                self._schedule(due, frame)
+        elif method in ('start_write_program', 'write_package', 'move_project'):
+            self._store(idx, method, parameters, due)
+            return
+        self._schedule(due, self._answer(idx))
+
+    def _drive(self, motor: EmulatedMotor, method: str, parameters: dict, now: float) -> Optional[float]:
+        """
+        Starts what `method` asks of `motor`; returns how long a motion lasts, `None` for one that ends at once.
+        """
+        if motor.waiting is not None:
+            # The hub answers an interrupted motion right away
+            motor.generation += 1
+            self._schedule(now + self._delay(), self._answer(motor.waiting))
+            motor.waiting = None
+
+        max_speed = self.max_speed
+        speed = parameters.get('speed', 0) * max_speed / 100
+        if method == 'scratch.motor_start':
+            motor.move(now, speed)
+        elif method == 'scratch.motor_pwm':
+            motor.move(now, parameters.get('power', 0) * max_speed / 100)
+        elif method == 'scratch.motor_stop':
+            motor.move(now, 0.0)
+        elif method == 'scratch.motor_set_position':
+            motor.zero = motor.angle_at(now) - parameters.get('offset', 0)
+        elif method == 'scratch.motor_run_timed':
+            duration = parameters.get('time', 0) / 1000
+            motor.move(now, speed, duration)
+            return duration
+        elif method in _MOTIONS:
+            angle = motor.angle_at(now)
+            if method == 'scratch.motor_run_for_degrees':
+                degrees = parameters.get('degrees', 0) * (1 if speed >= 0 else -1)
+            elif method == 'scratch.motor_go_to_relative_position':
+                degrees = parameters.get('position', 0) - (angle - motor.zero)
+            else:
+                degrees = (parameters.get('position', 0) - angle) % 360
+                direction = parameters.get('direction', 'shortest')
+                if direction == 'anticlockwise' or (direction == 'shortest' and degrees > 180):
+                    degrees -= 360
+            if speed == 0 or degrees == 0:
+                motor.move(now, 0.0)
+                return None
+            duration = abs(degrees / speed)
+            motor.move(now, abs(speed) if degrees > 0 else -abs(speed), duration)
+            return duration
+        return None
+
+    def _draw(self, method: str, parameters: dict):
+        if method == 'scratch.display_clear':
+            self.display = _BLANK_DISPLAY
+        elif method in ('scratch.display_image', 'scratch.display_image_for'):
+            image = parameters.get('image', '').replace('\n', '').replace(':', '')
+            if len(image) == 25:
+                self.display = image
+        elif method == 'scratch.display_set_pixel':
+            x, y = parameters.get('x', 0), parameters.get('y', 0)
+            if 0 <= x <= 4 and 0 <= y <= 4:
+                level = str(round(parameters.get('brightness', 100) * 9 / 100))
+                offset = y * 5 + x
+                self.display = self.display[:offset] + level + self.display[offset + 1:]
+
+    def _store(self, idx: str, method: str, parameters: dict, due: float):
+        result = None
+        if method == 'start_write_program':
+            transfer_id = str(self._random.randrange(10 ** 6))
+            self._transfers[transfer_id] = (parameters['slotid'], parameters, bytearray())
+            result = {'transferid': transfer_id, 'blocksize': self.block_size}
+        elif method == 'write_package':
+            transfer = self._transfers.get(parameters['transferid'])
+            if transfer is None or self._random.random() < self.failure_rate:
+                self._schedule(due, self._error(idx, 'package rejected'))
+                return
+            slot, start, data = transfer
+            data += b64decode(parameters['data'])
+            if len(data) >= start['size']:
+                self.slots[slot] = bytes(data)
+                self.meta[slot] = dict(start['meta'])
+                del self._transfers[parameters['transferid']]
+                self._schedule(due, self._storage())
+        else:
+            old, new = parameters['old_slotid'], parameters['new_slotid']
+            if old in self.slots:
+                self.slots[new] = self.slots.pop(old)
+                self.meta[new] = self.meta.pop(old)
+            self._schedule(due, self._storage())
+        self._schedule(due, self._answer(idx, result))
+
+    def _storage(self) -> bytes:
+        used = sum(len(data) for data in self.slots.values()) // 1024
+        slots = {str(slot): dict(meta, id=slot, size=len(self.slots[slot])) for slot, meta in self.meta.items()}
+        storage = {'storage': {'total': 31744, 'available': 31744 - used, 'pct': used / 317.44, 'unit': 'kb'},
+                   'slots': slots}
+        return json.dumps({'m': 1, 'p': storage}).encode('utf-8') + b'\r'
+
+    def _status(self) -> List[bytes]:
+        name = b64encode(self.name.encode('utf-8')).decode('ascii')
+        return [
+            json.dumps({'m': 9, 'p': [name]}).encode('utf-8') + b'\r',
+            b'{"m":2,"p":[8.3,100]}\r',
+            self._storage()
+        ]
+
+    def _sensor_frame(self, now: float) -> bytes:
+        max_speed = self.max_speed
+        ports = []
+        for port in _PORTS:
+            motor = self.motors.get(port)
+            ports.append([_MOTOR_TYPE, motor.values(now, max_speed)] if motor is not None else [0, []])
+        hub_time = self.sensor_frames if self.sequence_time else round((now - self._started) * 1000)
+        frame = ports + [[0, 0, 986], [0, 0, 0], [0, 0, 0], self.display, hub_time]
+        return json.dumps({'m': 0, 'p': frame}, separators=(',', ':')).encode('utf-8') + b'\r'
+
+    def _emit(self):
+        outbox = self._outbox
+        condition = self._condition
+        sensor_interval = 1.0 / self.sensor_rate if self.sensor_rate else None
+        status_interval = self.status_interval
+        now = monotonic()
+        next_sensor = now if sensor_interval is not None else float('inf')
+        next_status = now + status_interval if status_interval is not None else float('inf')
+        while not self._closed:
+            frames = []
+            with condition:
+                now = monotonic()
+                wake = min(next_sensor, next_status, outbox[0][0] if outbox else float('inf'))
+                if wake > now:
+                    condition.wait(min(wake - now, 1.0))
+                    continue
+                while outbox and outbox[0][0] <= now:
+                    _, _, frame, motor, generation = heappop(outbox)
+                    if motor is not None:
+                        if motor.generation != generation:
+                            continue
+                        motor.waiting = None
+                    frames.append(frame)
+                    self.answers += 1
+
+                if next_sensor < now - _MAX_SENSOR_LAG:
+                    # Too far behind, e.g. the host stopped reading: frames for the gap are never sent
+                    next_sensor = now
+                while next_sensor <= now:
+                    frames.append(self._sensor_frame(now))
+                    self.sensor_frames += 1
+                    next_sensor += sensor_interval
+                if next_status <= now:
+                    frames.extend(self._status())
+                    next_status = now + status_interval
+            try:
+                os.write(self._master, b''.join(frames))
+            except OSError:
+                return
+
+    def close(self):
+        self._closed = True
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+        with self._condition:
+            self._condition.notify_all()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def main():
+    parser = ArgumentParser(description='SPIKE hub emulator on a pseudo-terminal')
+    parser.add_argument('--name', default='emulated')
+    parser.add_argument('--sensor-rate', type=float, default=20.0, help='sensor frames per second')
+    parser.add_argument('--status-interval', type=float, default=5.0, help='seconds between status frames')
+    parser.add_argument('--latency', type=float, default=5.0, help='ms before a request is answered')
+    parser.add_argument('--jitter', type=float, default=0.0, help='ms the latency varies by, either way')
+    parser.add_argument('--motors', default='ABEF', help='ports with a motor')
+    args = parser.parse_args()
+
+    emulator = HubEmulator(args.name, args.sensor_rate, args.status_interval, args.latency / 1000,
+                           args.jitter / 1000, motors=args.motors)
+    print(emulator.device, flush=True)
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.close()
+
+
+if __name__ == '__main__':
+    main()
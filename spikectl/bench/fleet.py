@@ -0,0 +1,160 @@
+"""
+Aggregate throughput and dispatch latency of `HubFleet` against one listening thread per hub.
+
+Each hub is a pseudo-terminal fed by a separate writer process. Sensor frames carry the writer's
+monotonic clock in their timer field, so the listener can tell how long each frame took to reach it.
+
+    python -m spikectl.bench.fleet --hubs 1 2 4 8 --seconds 2 --rate 200
+"""
+from argparse import ArgumentParser
+from multiprocessing import Process
+import os
+import pty
+from threading import Thread
+from time import monotonic, monotonic_ns, sleep
+import tty
+from typing import Dict, List, Tuple
+
+from serial import Serial
+
+from spikectl.hub import HubFleet, SpikeHub
+from spikectl.model import SensorNotification
+
+
+_SENSOR_FRAME = b'{"m":0,"p":[[75,[0,120,-45,0]],[48,[10,-300,90,0]],[61,[5,3]],[62,[87]],[63,[2,0,0]],[0,[]],' \
+                b'[12,-4,986],[0,1,-2],[90,0,-1],"0000099999000009999900000",%d]}\r'
+
+# Frames written per hub and system call when writing as fast as possible
+_BURST = 32
+
+
+def _write_frames(masters: List[int], seconds: float, rate: float):
+    """
+    Writer process body: feeds every pty `rate` frames per second each, or as fast as it can when `rate` is 0.
+    """
+    end = monotonic() + seconds
+    if rate:
+        interval = 1.0 / rate
+        tick = monotonic()
+        while tick < end:
+            frame = _SENSOR_FRAME % (monotonic_ns() // 1000)
+            for master in masters:
+                os.write(master, frame)
+            tick += interval
+            delay = tick - monotonic()
+            if delay > 0:
+                sleep(delay)
+    else:
+        while monotonic() < end:
+            for master in masters:
+                os.write(master, b''.join(_SENSOR_FRAME % (monotonic_ns() // 1000) for _ in range(_BURST)))
+
+
+def _open_hubs(count: int) -> Tuple[List[int], List[SpikeHub]]:
+    masters, hubs = [], []
+    for n in range(count):
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        # RawSerialHub discards the first frame it reads
+        os.write(master, b'\r')
+        hub = SpikeHub(Serial(os.ttyname(slave), timeout=1))
+        hub.name = f'hub-{n}'
+        os.close(slave)
+        masters.append(master)
+        hubs.append(hub)
+    return masters, hubs
+
+
+def _listen_fleet(hubs: List[SpikeHub], seconds: float, latencies: List[int]) -> None:
+    fleet = HubFleet()
+    for hub in hubs:
+        fleet.add(hub)
+
+    def listener(_: str, notification: SensorNotification) -> bool:
+        latencies.append(monotonic_ns() // 1000 - notification.time)
+        return True
+
+    fleet.listen(listener, SensorNotification, seconds)
+
+
+def _listen_threads(hubs: List[SpikeHub], seconds: float, latencies: List[int]) -> None:
+    per_hub: List[List[int]] = [[] for _ in hubs]
+
+    def listen(hub: SpikeHub, received: List[int]):
+        def listener(notification: SensorNotification) -> bool:
+            received.append(monotonic_ns() // 1000 - notification.time)
+            return True
+        hub.listen_notifications(listener, SensorNotification, seconds)
+
+    threads = [Thread(target=listen, args=(hub, received)) for hub, received in zip(hubs, per_hub)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for received in per_hub:
+        latencies.extend(received)
+
+
+_MODES = {
+    'fleet': _listen_fleet,
+    'threads': _listen_threads
+}
+
+
+def _percentile(ordered: List[int], fraction: float) -> float:
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1000
+
+
+def run(mode: str, hubs: int, seconds: float = 2.0, rate: float = 0.0) -> Dict[str, float]:
+    """
+    Listens to `hubs` ptys for `seconds` in `mode` and returns the message rate and latency percentiles (ms).
+    """
+    masters, connected = _open_hubs(hubs)
+    # The writer outlives the listeners so none of them ends blocked on a silent port
+    writer = Process(target=_write_frames, args=(masters, seconds + 1.0, rate), daemon=True)
+    latencies: List[int] = []
+    try:
+        writer.start()
+        start = monotonic()
+        _MODES[mode](connected, seconds, latencies)
+        elapsed = monotonic() - start
+    finally:
+        writer.terminate()
+        writer.join()
+        for hub in connected:
+            hub.close()
+        for master in masters:
+            os.close(master)
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'hubs': hubs,
+        'messages': len(latencies),
+        'rate': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 0.5),
+        'p99_ms': _percentile(latencies, 0.99)
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Multi-hub dispatch benchmark')
+    parser.add_argument('--hubs', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--rate', type=float, default=200.0, help='frames/s per hub for the latency runs')
+    parser.add_argument('--modes', nargs='+', choices=list(_MODES), default=list(_MODES))
+    args = parser.parse_args()
+
+    for title, rate in (('saturated', 0.0), (f'{args.rate:,.0f} frames/s per hub', args.rate)):
+        print(title)
+        for hubs in args.hubs:
+            for mode in args.modes:
+                r = run(mode, hubs, args.seconds, rate)
+                print(f'  {mode:>7} x{hubs}: {r["rate"]:>9,.0f} msg/s, '
+                      f'p50 {r["p50_ms"]:.2f} ms, p99 {r["p99_ms"]:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
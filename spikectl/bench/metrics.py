@@ -0,0 +1,116 @@
+"""
+Cost of request metrics, and the latencies they report, against a hub that answers at once.
+
+A separate process answers every request on the far end of a pseudo-terminal after `--delay` seconds, and
+sends a notification of an unknown method and a line that is not JSON every 100 answers. Requests go out in
+rounds of `--round` and each round is waited for.
+
+    python -m spikectl.bench.metrics --requests 5000 --prometheus /tmp/spikectl.prom
+"""
+from argparse import ArgumentParser
+import json
+from multiprocessing import Process
+import os
+import pty
+from time import monotonic, sleep
+import tty
+from typing import Dict, Optional
+
+from serial import Serial
+
+from spikectl.hub import EmptyBuffer, SpikeHub
+
+
+def _answer(master: int, delay: float):
+    """
+    Hub process body: answers each request until the host writes `#end`.
+    """
+    partial = b''
+    answered = 0
+    while True:
+        try:
+            chunk = os.read(master, 65536)
+        except OSError:
+            return
+        *frames, partial = (partial + chunk).split(b'\r')
+        out = []
+        for frame in frames:
+            if frame == b'#end':
+                return
+            if not frame:
+                continue
+            out.append(b'{"i":"%s","r":null}\r' % json.loads(frame)['i'].encode())
+            answered += 1
+            if answered % 100 == 0:
+                out.append(b'{"m":"hub.unknown","p":[]}\r' b'not json\r')
+        if delay:
+            sleep(delay)
+        os.write(master, b''.join(out))
+
+
+def run(metrics: bool, requests: int = 5000, round_size: int = 10, delay: float = 0.0,
+        prometheus: Optional[str] = None) -> Dict[str, any]:
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    os.write(master, b'\r')
+    hub = SpikeHub(Serial(os.ttyname(slave), timeout=1))
+    process = Process(target=_answer, args=(master, delay), daemon=True)
+    process.start()
+    if metrics:
+        hub.enable_metrics()
+
+    try:
+        start = monotonic()
+        for n in range(0, requests, round_size):
+            tasks = []
+            for i in range(n, min(requests, n + round_size)):
+                if i % 2:
+                    tasks.append(hub.display.set_pixel(i % 5, i // 5 % 5, 100))
+                else:
+                    tasks.append(hub.motor('A').start(50))
+            hub.wait(*tasks)
+        elapsed = monotonic() - start
+        # Reads what is left, e.g. the last notification and line, so they are counted
+        try:
+            hub.listen(lambda _: True)
+        except EmptyBuffer:
+            pass
+        hub.connection.write(b'#end\r')
+        snapshot = hub.metrics.snapshot() if metrics else None
+        if prometheus and metrics:
+            hub.metrics.write_prometheus(prometheus)
+    finally:
+        process.join(timeout=2)
+        process.terminate()
+        hub.close()
+        os.close(master)
+        os.close(slave)
+
+    return {'requests_per_second': requests / elapsed, 'snapshot': snapshot}
+
+
+def main():
+    parser = ArgumentParser(description='Request metrics benchmark')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--round', type=int, default=10, help='requests waited for together')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds the hub waits before answering')
+    parser.add_argument('--prometheus', help='file to write the metrics to, in the Prometheus text format')
+    args = parser.parse_args()
+
+    plain = run(False, args.requests, args.round, args.delay)
+    measured = run(True, args.requests, args.round, args.delay, args.prometheus)
+    print(f'without metrics: {plain["requests_per_second"]:.0f} requests/s')
+    print(f'with metrics: {measured["requests_per_second"]:.0f} requests/s')
+    snapshot = measured['snapshot']
+    for method, metrics in snapshot['methods'].items():
+        latency = metrics['latency']
+        print(f'  {method}: {metrics["sent"]} sent, p50 {latency["p50_s"] * 1000:.2f} ms, '
+              f'p99 {latency["p99_s"] * 1000:.2f} ms, max {latency["max_s"] * 1000:.2f} ms')
+    print(f'  {snapshot["read_frames"]} frames ({snapshot["frames_per_second"]:.0f}/s), '
+          f'{snapshot["written_bytes"]} bytes out, {snapshot["read_bytes"]} in, '
+          f'{snapshot["decode_failures"]} decode failures, {snapshot["unknown_notifications"]} unknown notifications')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares the byte-by-byte `read_until` loop with `FrameReader` on a recorded stream.
+
+    python -m spikectl.bench.reader --frames 20000 --burst 512
+    python -m spikectl.bench.reader --capture session.cap
+"""
+from argparse import ArgumentParser
+import json
+from typing import Optional, Tuple
+
+from serial.serialutil import CR
+
+from spikectl import ujsonrpc
+from spikectl.hub.capture import CaptureReader
+from spikectl.hub.framing import FrameReader
+
+from .stream import RecordedSerial, sample_stream
+from .timing import Measurement, measure
+
+
+def read_until_loop(connection: RecordedSerial) -> int:
+    count = 0
+    while True:
+        buffer = connection.read_until(expected=CR)
+        if not buffer:
+            return count
+        json_str = str(buffer, 'utf-8')
+        try:
+            json_obj = json.loads(json_str)
+        except json.decoder.JSONDecodeError:
+            continue
+        ujsonrpc.decode(json_obj)
+        count += 1
+
+
+def frame_reader_loop(connection: RecordedSerial) -> int:
+    reader = FrameReader(connection)
+    count = 0
+    while True:
+        buffer = reader.read_frame()
+        if not buffer:
+            return count
+        try:
+            json_obj = json.loads(buffer)
+        except ValueError:
+            continue
+        ujsonrpc.decode(json_obj)
+        count += 1
+
+
+def run(frames: int = 20000, burst: int = 512, repeat: int = 3,
+        capture: Optional[str] = None) -> Tuple[Measurement, Measurement]:
+    data = CaptureReader(capture).stream() if capture else sample_stream(frames)
+    connection = RecordedSerial(data, burst)
+
+    def replay(loop):
+        def run_once() -> int:
+            connection.rewind()
+            return loop(connection)
+        return run_once
+
+    before = measure('read_until', replay(read_until_loop), repeat)
+    after = measure('FrameReader', replay(frame_reader_loop), repeat)
+    return before, after
+
+
+def main():
+    parser = ArgumentParser(description='Serial frame reader benchmark')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--burst', type=int, default=512, help='bytes visible per in_waiting poll')
+    parser.add_argument('--rate', type=float, default=1000.0, help='frame rate used to report CPU%%')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--capture', help='replay a recorded session instead of a synthetic stream')
+    args = parser.parse_args()
+
+    before, after = run(args.frames, args.burst, args.repeat, args.capture)
+    for m in (before, after):
+        print(f'{m}, {m.cpu_percent_at(args.rate):.1f}% cpu at {args.rate:,.0f} frames/s')
+    print(f'speedup: {after.rate / before.rate:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Stop latency while display requests flood a slow link, with and without priorities in the send queue.
+
+The far end of a pseudo-terminal is drained at `--rate` bytes per second by a separate process, which
+notes when each stop request arrives. A burst of `display_set_pixel` requests is sent every half second
+while another thread sends a stop every 50 ms. The writer is paced at the link speed.
+
+    python -m spikectl.bench.sendqueue --rate 11520 --seconds 3
+"""
+from argparse import ArgumentParser
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+import json
+import os
+import pty
+from threading import Event, Thread
+from time import monotonic_ns, sleep
+import tty
+from typing import Dict, List
+
+from serial import Serial
+
+from spikectl.hub import Priority, SpikeHub
+from spikectl.model import MotorStopRequest, ScratchDisplaySetPixelRequest
+
+_READ_SIZE = 64
+
+
+def _drain(master: int, rate: float, results: Connection):
+    """
+    Receiver process body: reads at `rate` bytes per second and reports when each stop arrived.
+    """
+    arrivals = {}
+    partial = b''
+    while True:
+        try:
+            chunk = os.read(master, _READ_SIZE)
+        except OSError:
+            break
+        now = monotonic_ns()
+        *frames, partial = (partial + chunk).split(b'\r')
+        done = False
+        for frame in frames:
+            if frame == b'#end':
+                done = True
+            elif b'motor_stop' in frame:
+                arrivals[json.loads(frame)['i']] = now
+        if done:
+            break
+        sleep(len(chunk) / rate)
+    results.send(arrivals)
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float('nan')
+
+
+def run(prioritised: bool, rate: float = 11520, seconds: float = 3.0, burst: int = 100) -> Dict[str, float]:
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    os.write(master, b'\r')
+    hub = SpikeHub(Serial(os.ttyname(slave), timeout=1))
+    # Pacing the writer at the link speed keeps the backlog in the send queue
+    hub.start_writer(max_rate=rate)
+    parent, child = Pipe()
+    receiver = Process(target=_drain, args=(master, rate, child), daemon=True)
+    receiver.start()
+
+    # Without priorities everything is written in the order it was sent
+    stop_priority = Priority.Urgent if prioritised else Priority.Normal
+    display_priority = Priority.Background if prioritised else Priority.Normal
+    finished = Event()
+    sent: Dict[str, int] = {}
+
+    def flood():
+        while not finished.is_set():
+            for n in range(burst):
+                hub.send(ScratchDisplaySetPixelRequest(n % 5, n // 5 % 5, 100), display_priority)
+            finished.wait(0.5)
+
+    def stops():
+        while not finished.is_set():
+            request = MotorStopRequest('A', 1)
+            sent[request.id] = monotonic_ns()
+            hub.send(request, stop_priority)
+            finished.wait(0.05)
+
+    threads = [Thread(target=flood), Thread(target=stops)]
+    try:
+        for thread in threads:
+            thread.start()
+        sleep(seconds)
+        finished.set()
+        for thread in threads:
+            thread.join()
+        queue = hub.send_queue
+        high_watermark = queue.high_watermark
+        stats = {priority: queue.stats[priority] for priority in Priority}
+        hub.stop_writer()
+        hub.connection.write(b'#end\r')
+        arrivals = parent.recv()
+    finally:
+        receiver.join(timeout=60)
+        receiver.terminate()
+        hub.close()
+        os.close(master)
+        os.close(slave)
+
+    latencies = sorted((arrivals[idx] - sent[idx]) / 1e6 for idx in sent if idx in arrivals)
+    return {
+        'stops': len(latencies),
+        'latency_p50_ms': _percentile(latencies, 0.5),
+        'latency_max_ms': latencies[-1] if latencies else float('nan'),
+        'queue_high_watermark': high_watermark,
+        'stop_queue_max_ms': stats[stop_priority].max * 1000,
+        'display_queue_max_ms': stats[display_priority].max * 1000
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Send queue stop latency benchmark')
+    parser.add_argument('--rate', type=float, default=11520, help='link speed in bytes/s')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--burst', type=int, default=100, help='display requests sent every half second')
+    args = parser.parse_args()
+
+    for name, prioritised in (('FIFO', False), ('prioritised', True)):
+        r = run(prioritised, args.rate, args.seconds, args.burst)
+        print(f'{name}: stop latency p50 {r["latency_p50_ms"]:.1f} ms, max {r["latency_max_ms"]:.1f} ms '
+              f'({r["stops"]} stops); stop time in queue max {r["stop_queue_max_ms"]:.1f} ms, '
+              f'display max {r["display_queue_max_ms"]:.1f} ms, queue depth max {r["queue_high_watermark"]}')
+
+
+if __name__ == '__main__':
+    main()
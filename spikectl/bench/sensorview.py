@@ -0,0 +1,90 @@
+"""
+Memory allocated and time per sensor frame of `decode_notification` versus writing the frame into a reused
+`SensorRecord`, with a listener reading motor B's position either way.
+
+Allocation is measured with `tracemalloc`, frame by frame: the peak of traced memory while a frame is
+decoded and read, above what was traced before it. That counts objects freed again right after, which is
+what makes work for the allocator and the garbage collector, and not only those kept.
+
+    python -m spikectl.bench.sensorview --frames 20000
+    python -m spikectl.bench.sensorview --capture session.cap
+"""
+from argparse import ArgumentParser
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from spikectl import ujsonrpc
+from spikectl.hub import SensorRecord, SensorView
+from spikectl.hub.telemetry import MOTOR_POSITION
+from spikectl.model import decode_notification
+
+from .decode import recorded_notifications
+from .timing import Measurement, measure
+
+
+def _allocated_per_frame(messages: List[ujsonrpc.RPCNotification],
+                         handle: Callable[[ujsonrpc.RPCNotification], None]) -> float:
+    """
+    Mean bytes allocated at the peak of handling one frame.
+    """
+    # The first frames warm up caches, e.g. of the port decoders
+    for msg in messages[:100]:
+        handle(msg)
+    total = 0
+    tracemalloc.start()
+    try:
+        for msg in messages:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            handle(msg)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+    finally:
+        tracemalloc.stop()
+    return total / len(messages)
+
+
+def run(frames: int = 20000, repeat: int = 5, capture: Optional[str] = None) -> Dict[str, Tuple[Measurement, float]]:
+    sensor = [n for n in recorded_notifications(frames, capture) if n.method == 0]
+    record = SensorRecord()
+    view = SensorView(record)
+
+    def decode(msg: ujsonrpc.RPCNotification):
+        notification = decode_notification(msg)
+        _ = getattr(notification.B.data, 'position', None) if notification.B is not None else None
+
+    def write(msg: ujsonrpc.RPCNotification):
+        record.write(msg.parameters, 0.0)
+        _ = view.port_value('B', MOTOR_POSITION)
+
+    def decode_all() -> int:
+        for msg in sensor:
+            decode(msg)
+        return len(sensor)
+
+    def write_all() -> int:
+        for msg in sensor:
+            write(msg)
+        return len(sensor)
+
+    return {
+        'decode_notification': (measure('decode_notification', decode_all, repeat),
+                                _allocated_per_frame(sensor, decode)),
+        'SensorRecord': (measure('SensorRecord', write_all, repeat), _allocated_per_frame(sensor, write))
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Sensor frame decoding into a reused record')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--capture', help='decode a recorded session instead of a synthetic stream')
+    args = parser.parse_args()
+
+    for name, (m, allocated) in run(args.frames, args.repeat, args.capture).items():
+        print(f'{name}: {m.wall / m.count * 1e9:,.0f} ns per frame, {allocated:,.0f} bytes allocated per frame '
+              f'at peak ({m.count} frames)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Control lag of a joystick loop over a slow link, one request per setpoint versus last-write-wins channels.
+
+A thread sets the speed of `--motors` motors `--hz` times per second while a separate process drains the
+far end of a pseudo-terminal at `--rate` bytes per second. The lag of a setpoint is the time between the
+loop setting it and its request reaching the far end; merged setpoints never arrive.
+
+    python -m spikectl.bench.setpoints --rate 2400 --hz 100 --seconds 3
+"""
+from argparse import ArgumentParser
+from math import sin
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+import json
+import os
+import pty
+from time import monotonic, monotonic_ns, sleep
+import tty
+from typing import Dict, List
+
+from serial import Serial
+
+from spikectl.hub import Setpoints, SpikeHub
+
+_READ_SIZE = 64
+
+
+def _drain(master: int, rate: float, results: Connection):
+    """
+    Receiver process body: reads at `rate` bytes per second and reports when each request arrived.
+    """
+    arrivals = {}
+    partial = b''
+    while True:
+        try:
+            chunk = os.read(master, _READ_SIZE)
+        except OSError:
+            break
+        now = monotonic_ns()
+        *frames, partial = (partial + chunk).split(b'\r')
+        done = False
+        for frame in frames:
+            if frame == b'#end':
+                done = True
+            elif b'motor_start' in frame:
+                arrivals[json.loads(frame)['i']] = now
+        if done:
+            break
+        sleep(len(chunk) / rate)
+    results.send(arrivals)
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float('nan')
+
+
+def run(coalesced: bool, rate: float = 2400, hz: float = 100, motors: int = 2, seconds: float = 3.0,
+        max_rate: float = 10.0) -> Dict[str, float]:
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    os.write(master, b'\r')
+    hub = SpikeHub(Serial(os.ttyname(slave), timeout=1))
+    parent, child = Pipe()
+    receiver = Process(target=_drain, args=(master, rate, child), daemon=True)
+    receiver.start()
+
+    ports = 'ABCDEF'[:motors]
+    setpoints = Setpoints(hub, max_rate) if coalesced else None
+    sent: Dict[str, int] = {}
+    try:
+        start = monotonic()
+        tick = 0
+        while monotonic() - start < seconds:
+            speed = round(100 * sin(tick / hz * 3))
+            for port in ports:
+                if setpoints is not None:
+                    request = setpoints.motor(port).start(speed)
+                    sent[request.id] = monotonic_ns()
+                else:
+                    sent[hub.motor(port).start(speed).id] = monotonic_ns()
+            tick += 1
+            sleep(max(0.0, start + tick / hz - monotonic()))
+        loop_hz = tick / (monotonic() - start)
+        if setpoints is not None:
+            setpoints.close()
+            merged = setpoints.merged
+        else:
+            merged = 0
+        hub.connection.write(b'#end\r')
+        arrivals = parent.recv()
+    finally:
+        receiver.join(timeout=60)
+        receiver.terminate()
+        hub.pending.cancel_all()
+        hub.close()
+        os.close(master)
+        os.close(slave)
+
+    lags = sorted((arrivals[idx] - sent[idx]) / 1e6 for idx in sent if idx in arrivals)
+    return {
+        'loop_hz': loop_hz,
+        'setpoints': len(sent),
+        'arrived': len(lags),
+        'merged': merged,
+        'lag_p50_ms': _percentile(lags, 0.5),
+        'lag_max_ms': lags[-1] if lags else float('nan')
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Setpoint channel control lag benchmark')
+    parser.add_argument('--rate', type=float, default=2400, help='link speed in bytes/s')
+    parser.add_argument('--hz', type=float, default=100, help='control loop rate')
+    parser.add_argument('--motors', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--max-rate', type=float, default=10.0, help='setpoints per second and port')
+    args = parser.parse_args()
+
+    for name, coalesced in (('one request per setpoint', False), ('setpoint channels', True)):
+        r = run(coalesced, args.rate, args.hz, args.motors, args.seconds, args.max_rate)
+        print(f'{name}: loop {r["loop_hz"]:.0f} Hz, {r["arrived"]} of {r["setpoints"]} setpoints sent, '
+              f'{r["merged"]} merged; lag p50 {r["lag_p50_ms"]:.1f} ms, max {r["lag_max_ms"]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Soak test against the hub emulator: ramps the inbound sensor frame rate, then the outbound request rate,
+and records at each step what got through, how fast, and what was lost.
+
+Inbound steps read sensor frames through the background reader, `listen` and `decode_notification`; the
+emulator numbers its frames, so missing numbers are frames lost, and a rate below the offered one means the
+host did not drain the port fast enough. Outbound steps send requests at a fixed rate from one thread while
+another reads the answers; requests not answered within `--timeout` seconds are lost.
+
+    python -m spikectl.bench --frame-rates 1000 5000 20000 --request-rates 500 2000 --report soak.json
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+import json
+import platform
+from threading import Event, Thread
+from time import monotonic, sleep
+from typing import Dict, List, Optional
+
+from spikectl.hub import EmptyBuffer
+from spikectl.model import NotificationType, SensorNotification
+
+from .emulator import HubEmulator
+
+DEFAULT_FRAME_RATES = (100, 1000, 5000, 10000, 20000)
+DEFAULT_REQUEST_RATES = (100, 500, 1000, 2000, 4000)
+
+# Share of the offered rate a step must reach, without losses, to count as sustained
+_SUSTAINED = 0.95
+
+
+def inbound_step(rate: float, seconds: float = 2.0, capacity: int = 256) -> Dict[str, float]:
+    emulator = HubEmulator('soak', sensor_rate=rate, status_interval=None, sequence_time=True, process=True)
+    hub = emulator.connect()
+    hub.start_reader(capacity)
+    received = 0
+    first = last = None
+
+    def listener(notification: SensorNotification) -> bool:
+        nonlocal received, first, last
+        received += 1
+        if first is None:
+            first = notification.time
+        last = notification.time
+        return monotonic() < deadline
+
+    try:
+        # Lets the emulator settle before counting
+        hub.listen_notification(SensorNotification, 1.0)
+        start = monotonic()
+        deadline = start + seconds
+        try:
+            hub.listen_notifications(listener, SensorNotification, seconds + 1.0)
+        except EmptyBuffer:
+            pass
+        elapsed = monotonic() - start
+        dropped = hub.dropped_frames
+        decode_failures = hub.decode_failures
+    finally:
+        hub.close()
+        emulator.close()
+
+    sent = last - first + 1 if first is not None else 0
+    return {
+        'offered_per_s': rate,
+        'received': received,
+        'received_per_s': received / elapsed,
+        'lost': sent - received,
+        'ring_dropped': dropped,
+        'decode_failures': decode_failures
+    }
+
+
+def outbound_step(rate: float, seconds: float = 2.0, latency: float = 0.002, timeout: float = 1.0,
+                  sensor_rate: float = 20.0) -> Dict[str, float]:
+    emulator = HubEmulator('soak', sensor_rate=sensor_rate, status_interval=None, latency=latency, process=True)
+    hub = emulator.connect(request_timeout=timeout)
+    hub.start_reader(4096)
+    metrics = hub.enable_metrics()
+    sending = Event()
+    tasks = []
+
+    def send():
+        interval = 1.0 / rate
+        start = monotonic()
+        n = 0
+        while monotonic() - start < seconds:
+            if n % 2:
+                tasks.append(hub.display.set_pixel(n % 5, n // 5 % 5, 100))
+            else:
+                tasks.append(hub.motor('A').start(n % 100))
+            n += 1
+            delay = start + n * interval - monotonic()
+            if delay > 0:
+                sleep(delay)
+        sending.set()
+
+    sender = Thread(target=send, name='soak-sender')
+    try:
+        start = monotonic()
+        sender.start()
+        try:
+            # Sensor frames wake the listener up once the last answer is in
+            hub.listen(lambda _: not sending.is_set() or len(hub.pending) > 0, timeout=seconds + timeout + 1.0,
+                       methods=(NotificationType.Sensor.value,))
+        except EmptyBuffer:
+            pass
+        sender.join()
+        elapsed = monotonic() - start
+        snapshot = metrics.snapshot()
+        decode_failures = hub.decode_failures
+    finally:
+        hub.close()
+        emulator.close()
+
+    answered = sum(1 for task in tasks if task.error is None)
+    latencies = [method['latency'] for method in snapshot['methods'].values()]
+    count = sum(latency['count'] for latency in latencies)
+    return {
+        'offered_per_s': rate,
+        'sent': len(tasks),
+        'sent_per_s': len(tasks) / seconds,
+        'answered': answered,
+        'answered_per_s': answered / elapsed,
+        'lost': len(tasks) - answered,
+        # The slower method's percentiles, the one to watch
+        'latency_p50_ms': max((latency['p50_s'] or 0) for latency in latencies) * 1000 if count else None,
+        'latency_p99_ms': max((latency['p99_s'] or 0) for latency in latencies) * 1000 if count else None,
+        'decode_failures': decode_failures
+    }
+
+
+def _sustained(steps: List[Dict[str, float]], rate_key: str) -> Optional[float]:
+    """
+    Highest offered rate reached, within `_SUSTAINED`, without losses.
+    """
+    best = None
+    for step in steps:
+        if step['lost'] == 0 and step[rate_key] >= step['offered_per_s'] * _SUSTAINED:
+            best = step['offered_per_s']
+    return best
+
+
+def run(frame_rates=DEFAULT_FRAME_RATES, request_rates=DEFAULT_REQUEST_RATES, seconds: float = 2.0,
+        latency: float = 0.002, timeout: float = 1.0, verbose: bool = True) -> dict:
+    inbound = []
+    for rate in frame_rates:
+        step = inbound_step(rate, seconds)
+        inbound.append(step)
+        if verbose:
+            print(f'inbound {rate:,.0f} frames/s: {step["received_per_s"]:,.0f}/s received, {step["lost"]} lost '
+                  f'({step["ring_dropped"]} dropped by the ring), {step["decode_failures"]} decode failures')
+
+    outbound = []
+    for rate in request_rates:
+        step = outbound_step(rate, seconds, latency, timeout)
+        outbound.append(step)
+        if verbose:
+            p50, p99 = step['latency_p50_ms'], step['latency_p99_ms']
+            print(f'outbound {rate:,.0f} requests/s: {step["sent_per_s"]:,.0f}/s sent, '
+                  f'{step["answered_per_s"]:,.0f}/s answered, {step["lost"]} lost, '
+                  f'p50 {p50 if p50 is not None else float("nan"):.2f} ms, '
+                  f'p99 {p99 if p99 is not None else float("nan"):.2f} ms')
+
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'step_seconds': seconds,
+        'latency_s': latency,
+        'inbound': inbound,
+        'outbound': outbound,
+        'sustained_frames_per_s': _sustained(inbound, 'received_per_s'),
+        'sustained_requests_per_s': _sustained(outbound, 'answered_per_s')
+    }
+
+
+def main():
+    parser = ArgumentParser(prog='python -m spikectl.bench', description='Soak test against the hub emulator')
+    parser.add_argument('--frame-rates', type=float, nargs='*', default=list(DEFAULT_FRAME_RATES),
+                        help='sensor frames per second at each inbound step')
+    parser.add_argument('--request-rates', type=float, nargs='*', default=list(DEFAULT_REQUEST_RATES),
+                        help='requests per second at each outbound step')
+    parser.add_argument('--seconds', type=float, default=2.0, help='length of each step')
+    parser.add_argument('--latency', type=float, default=2.0, help='ms the emulator takes to answer')
+    parser.add_argument('--timeout', type=float, default=1.0, help='seconds before a request counts as lost')
+    parser.add_argument('--report', help='file to write the JSON report to')
+    args = parser.parse_args()
+
+    report = run(args.frame_rates, args.request_rates, args.seconds, args.latency / 1000, args.timeout)
+    frames, requests = report['sustained_frames_per_s'], report['sustained_requests_per_s']
+    print(f'sustained: {f"{frames:,.0f}" if frames else "no"} frames/s, '
+          f'{f"{requests:,.0f}" if requests else "no"} requests/s')
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
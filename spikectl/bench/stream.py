@@ -0,0 +1,92 @@
+import random
+from typing import Optional
+
+from serial.serialutil import SerialBase
+
+
+_SENSOR_FRAME = '{{"m":0,"p":[[75,[{a0},{a1},{a2},0]],[48,[{b0},{b1},{b2},0]],[61,[{c0},3]],[62,[{d0}]],' \
+                '[63,[{e0},0,0]],[0,[]],[{ax},{ay},{az}],[{gx},{gy},{gz}],[{yaw},{pitch},{roll}],' \
+                '"0000099999000009999900000",{time}]}}\r'
+_BATTERY_FRAME = '{{"m":2,"p":[8.{voltage},{percentage}]}}\r'
+_RESPONSE_FRAME = '{{"i":"{idx}","r":null}}\r'
+_PRINT_FRAME = '{{"m":"userProgram.print","p":{{"value":"dGljawo="}}}}\r'
+
+
+def sample_stream(frames: int = 10000, seed: int = 0) -> bytes:
+    """
+    Builds a deterministic stream shaped like a live session: mostly 11-element sensor frames with the
+    occasional battery status, user program print and request response.
+    """
+    rnd = random.Random(seed)
+    parts = []
+    for n in range(frames):
+        kind = rnd.random()
+        if kind < 0.9:
+            parts.append(_SENSOR_FRAME.format(
+                a0=rnd.randint(-100, 100), a1=rnd.randint(-10000, 10000), a2=rnd.randint(-180, 180),
+                b0=rnd.randint(-100, 100), b1=rnd.randint(-10000, 10000), b2=rnd.randint(-180, 180),
+                c0=rnd.randint(-1, 10), d0=rnd.randint(0, 200), e0=rnd.randint(0, 10),
+                ax=rnd.randint(-1024, 1024), ay=rnd.randint(-1024, 1024), az=rnd.randint(-1024, 1024),
+                gx=rnd.randint(-500, 500), gy=rnd.randint(-500, 500), gz=rnd.randint(-500, 500),
+                yaw=rnd.randint(-180, 180), pitch=rnd.randint(-90, 90), roll=rnd.randint(-180, 180),
+                time=n * 20
+            ))
+        elif kind < 0.93:
+            parts.append(_BATTERY_FRAME.format(voltage=rnd.randint(0, 9), percentage=rnd.randint(0, 100)))
+        elif kind < 0.95:
+            parts.append(_PRINT_FRAME.format())
+        else:
+            parts.append(_RESPONSE_FRAME.format(idx=''.join(rnd.choices('abcdefghijklmnop', k=4))))
+    return ''.join(parts).encode('utf-8')
+
+
+class RecordedSerial(object):
+    """
+    Serial port stand-in that plays back a byte stream.
+
+    `in_waiting` reports at most `burst` bytes at a time to mimic data arriving in USB packets, and
+    `read_until` is pyserial's own byte-by-byte implementation so comparisons against it are fair.
+    """
+
+    read_until = SerialBase.read_until
+
+    def __init__(self, data: bytes, burst: int = 512):
+        self._data = data
+        self._position = 0
+        self._burst = burst
+        self._timeout = None
+        self.timeout: Optional[float] = None
+        self.port = 'recorded'
+        self.written = 0
+
+    @property
+    def in_waiting(self) -> int:
+        return min(len(self._data) - self._position, self._burst)
+
+    def read(self, size: int = 1) -> bytes:
+        start = self._position
+        end = min(start + size, len(self._data))
+        self._position = end
+        return self._data[start:end]
+
+    def write(self, data: bytes) -> int:
+        self.written += len(data)
+        return len(data)
+
+    def rewind(self):
+        self._position = 0
+
+    def flushInput(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+__all__ = [
+    'RecordedSerial',
+    'sample_stream'
+]
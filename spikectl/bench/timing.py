@@ -0,0 +1,62 @@
+from time import perf_counter, process_time
+from typing import Callable
+
+
+class Measurement(object):
+
+    __slots__ = ['name', 'count', 'wall', 'cpu']
+
+    def __init__(self, name: str, count: int, wall: float, cpu: float):
+        self.name = name
+        self.count = count
+        self.wall = wall
+        self.cpu = cpu
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.wall if self.wall > 0 else float('inf')
+
+    @property
+    def cpu_per_item(self) -> float:
+        return self.cpu / self.count if self.count else 0.0
+
+    def cpu_percent_at(self, rate: float) -> float:
+        """
+        CPU share needed to keep up with `rate` items per second on one core.
+        """
+        return self.cpu_per_item * rate * 100
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'count': self.count,
+            'wall_s': self.wall,
+            'cpu_s': self.cpu,
+            'rate': self.rate,
+            'cpu_per_item_us': self.cpu_per_item * 1e6
+        }
+
+    def __str__(self):
+        return f'{self.name}: {self.rate:,.0f}/s, {self.cpu_per_item * 1e6:.2f} us cpu each ({self.count} in {self.wall:.3f}s)'
+
+
+def measure(name: str, run: Callable[[], int], repeat: int = 3) -> Measurement:
+    """
+    Runs `run` (which returns how many items it processed) `repeat` times and keeps the fastest run.
+    """
+    best = None
+    for _ in range(repeat):
+        wall_start = perf_counter()
+        cpu_start = process_time()
+        count = run()
+        cpu = process_time() - cpu_start
+        wall = perf_counter() - wall_start
+        if best is None or wall < best.wall:
+            best = Measurement(name, count, wall, cpu)
+    return best
+
+
+__all__ = [
+    'Measurement',
+    'measure'
+]
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Cost of tracing per request round trip, disabled and enabled, and a sample trace to open in Perfetto.
+
+A separate process answers every request on the far end of a pseudo-terminal and sends a sensor-like
+notification with every answer. Requests go out in batches of three, the way coordinated moves do, and each
+batch is waited for.
+
+    python -m spikectl.bench.trace --rounds 2000 --out /tmp/spikectl-trace.json
+"""
+from argparse import ArgumentParser
+import json
+from multiprocessing import Process
+import os
+import pty
+from time import perf_counter
+import tty
+from typing import Dict, Optional
+
+from serial import Serial
+
+from spikectl.hub import SpikeHub
+
+
+def _answer(master: int):
+    """
+    Hub process body: answers each request until the host writes `#end`.
+    """
+    partial = b''
+    while True:
+        try:
+            chunk = os.read(master, 65536)
+        except OSError:
+            return
+        *frames, partial = (partial + chunk).split(b'\r')
+        out = []
+        for frame in frames:
+            if frame == b'#end':
+                return
+            if frame:
+                out.append(b'{"i":"%s","r":null}\r{"m":0,"p":[]}\r' % json.loads(frame)['i'].encode())
+        os.write(master, b''.join(out))
+
+
+def run(traced: bool, rounds: int = 2000, out: Optional[str] = None) -> Dict[str, float]:
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    os.write(master, b'\r')
+    hub = SpikeHub(Serial(os.ttyname(slave), timeout=1))
+    process = Process(target=_answer, args=(master,), daemon=True)
+    process.start()
+    tracer = hub.enable_tracing(capacity=rounds * 16) if traced else None
+
+    motors = [hub.motor(port) for port in 'ABD']
+    try:
+        start = perf_counter()
+        for _ in range(rounds):
+            with hub.batch() as moves:
+                for motor in motors:
+                    motor.rotate(100, 90)
+            hub.wait(*moves)
+        elapsed = perf_counter() - start
+        hub.connection.write(b'#end\r')
+        if out and tracer is not None:
+            tracer.export(out)
+    finally:
+        process.join(timeout=2)
+        process.terminate()
+        hub.close()
+        os.close(master)
+        os.close(slave)
+
+    result = {'us_per_round': elapsed / rounds * 1e6}
+    if tracer is not None:
+        result['events'] = len(tracer.events())
+        result['dropped'] = tracer.dropped
+    return result
+
+
+def main():
+    parser = ArgumentParser(description='Tracing overhead benchmark')
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--out', help='file to write the Chrome trace of the traced run to')
+    args = parser.parse_args()
+
+    plain = run(False, args.rounds)
+    traced = run(True, args.rounds, args.out)
+    print(f'tracing disabled: {plain["us_per_round"]:.1f} us per round')
+    print(f'tracing enabled: {traced["us_per_round"]:.1f} us per round, {traced["events"]} events, '
+          f'{traced["dropped"]} dropped')
+
+
+if __name__ == '__main__':
+    main()
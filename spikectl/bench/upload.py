@@ -0,0 +1,83 @@
+"""
+Program upload throughput against local stand-in hubs, stop-and-wait versus pipelined windows.
+
+The stand-ins are hub emulators: each handles one request at a time, taking `--service` ms per package,
+and its answers arrive `--latency` ms later, the round trip of the link.
+
+    python -m spikectl.bench.upload --size 32768 --windows 1 2 4 8 --hubs 4
+"""
+from argparse import ArgumentParser
+import random
+from time import monotonic
+from typing import Dict, List, Tuple
+
+from spikectl.hub import HubFleet, upload_program, upload_to_fleet
+
+from .emulator import HubEmulator
+
+
+def _stand_in(name: str, latency: float, service: float, failure_rate: float, seed: int = 0) -> HubEmulator:
+    # Sensor and status frames would only compete with the transfer
+    return HubEmulator(name, sensor_rate=0, status_interval=None, latency=latency, service=service,
+                       failure_rate=failure_rate, seed=seed)
+
+
+def run(size: int = 32768, windows: Tuple[int, ...] = (1, 2, 4, 8), hubs: int = 4, latency: float = 0.005,
+        service: float = 0.001, failure_rate: float = 0.0) -> List[Dict[str, float]]:
+    program = bytes(random.Random(1).getrandbits(8) for _ in range(size))
+    results = []
+
+    def check(stand_ins: List[HubEmulator]):
+        for stand_in in stand_ins:
+            assert stand_in.slots.get(0) == program, f'{stand_in.name} holds a corrupt program'
+
+    for window in windows:
+        stand_in = _stand_in('single', latency, service, failure_rate)
+        hub = stand_in.connect()
+        try:
+            upload = upload_program(hub, 0, program, 'bench', window=window, retries=20)
+        finally:
+            hub.close()
+            stand_in.close()
+        check([stand_in])
+        results.append({'hubs': 1, 'window': window, 'kb_s': upload.rate / 1024, 'seconds': upload.elapsed,
+                        'attempts': upload.attempts})
+
+        stand_ins = [_stand_in(f'hub-{n}', latency, service, failure_rate, seed=n) for n in range(hubs)]
+        fleet = HubFleet()
+        for stand_in in stand_ins:
+            fleet.add(stand_in.connect())
+        try:
+            start = monotonic()
+            uploads = upload_to_fleet(fleet, 0, program, 'bench', window=window, retries=20)
+            elapsed = monotonic() - start
+        finally:
+            fleet.close()
+            for stand_in in stand_ins:
+                stand_in.close()
+        for upload in uploads.values():
+            upload.result()
+        check(stand_ins)
+        results.append({'hubs': hubs, 'window': window, 'kb_s': size * hubs / elapsed / 1024, 'seconds': elapsed,
+                        'attempts': sum(upload.attempts for upload in uploads.values())})
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='Program upload benchmark')
+    parser.add_argument('--size', type=int, default=32768, help='program size in bytes')
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--hubs', type=int, default=4, help='hubs in the fleet runs')
+    parser.add_argument('--latency', type=float, default=5.0, help='link round trip in ms')
+    parser.add_argument('--service', type=float, default=1.0, help='hub time per package in ms')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of packages the hub rejects')
+    args = parser.parse_args()
+
+    for r in run(args.size, tuple(args.windows), args.hubs, args.latency / 1000, args.service / 1000,
+                 args.failure_rate):
+        print(f'{r["hubs"]} hub(s), window {r["window"]}: {r["kb_s"]:,.1f} KB/s '
+              f'({r["seconds"]:.2f}s, {r["attempts"]} transfers)')
+
+
+if __name__ == '__main__':
+    main()
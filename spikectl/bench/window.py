@@ -0,0 +1,122 @@
+"""
+Losses and completion time of a burst of requests, without a window, with a fixed one and an adaptive one.
+
+A separate process plays a hub that answers one request every `--service` seconds from an input buffer of
+`--input` bytes, silently dropping requests that arrive when the buffer is full, and sends a notification
+every 50 ms like a hub's sensor reports. The host sends `--requests` display requests at once and reads
+answers until each one is answered or timed out.
+
+    python -m spikectl.bench.window --requests 300 --service 0.002 --input 1024
+"""
+from argparse import ArgumentParser
+from collections import deque
+import json
+from multiprocessing import Process
+import os
+import pty
+from select import select
+from time import monotonic
+import tty
+from typing import Dict, Optional
+
+from serial import Serial
+
+from spikectl.hub import RequestWindow, SpikeHub
+
+_NOTIFICATION = b'{"m":0,"p":[]}\r'
+_NOTIFICATION_INTERVAL = 0.05
+
+
+def _serve(master: int, service: float, capacity: int):
+    """
+    Hub process body: answers requests from a bounded input buffer until the host writes `#end`.
+    """
+    inbox = deque()
+    used = 0
+    partial = b''
+    next_answer = next_notification = monotonic()
+    while True:
+        wake = min(next_notification, next_answer) if inbox else next_notification
+        readable, _, _ = select([master], [], [], max(0.0, wake - monotonic()))
+        if readable:
+            try:
+                chunk = os.read(master, 4096)
+            except OSError:
+                return
+            *frames, partial = (partial + chunk).split(b'\r')
+            for frame in frames:
+                if frame == b'#end':
+                    return
+                size = len(frame) + 1
+                if frame and used + size <= capacity:
+                    inbox.append((json.loads(frame)['i'], size))
+                    used += size
+        now = monotonic()
+        if inbox and now >= next_answer:
+            idx, size = inbox.popleft()
+            used -= size
+            os.write(master, b'{"i":"%s","r":null}\r' % idx.encode())
+            next_answer = now + service
+        if now >= next_notification:
+            os.write(master, _NOTIFICATION)
+            next_notification = now + _NOTIFICATION_INTERVAL
+
+
+def run(window: Optional[RequestWindow], requests: int = 300, service: float = 0.002, capacity: int = 1024,
+        timeout: float = 1.0) -> Dict[str, float]:
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    os.write(master, b'\r')
+    hub = SpikeHub(Serial(os.ttyname(slave), timeout=1), request_timeout=timeout, window=window)
+    process = Process(target=_serve, args=(master, service, capacity), daemon=True)
+    process.start()
+
+    try:
+        start = monotonic()
+        tasks = [hub.display.set_pixel(n % 5, n // 5 % 5, 100) for n in range(requests)]
+        hub.wait(*tasks)
+        elapsed = monotonic() - start
+        hub.connection.write(b'#end\r')
+    finally:
+        process.join(timeout=2)
+        process.terminate()
+        hub.close()
+        os.close(master)
+        os.close(slave)
+
+    answered = sum(1 for task in tasks if task.error is None)
+    result = {
+        'answered': answered,
+        'lost': requests - answered,
+        'elapsed_s': elapsed
+    }
+    if window is not None:
+        result.update(window.as_dict())
+    return result
+
+
+def main():
+    parser = ArgumentParser(description='In-flight request window benchmark')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--service', type=float, default=0.002, help='seconds the hub takes per request')
+    parser.add_argument('--input', type=int, default=1024, help='hub input buffer in bytes')
+    parser.add_argument('--timeout', type=float, default=1.0, help='request timeout in seconds')
+    args = parser.parse_args()
+
+    windows = (
+        ('no window', lambda: None),
+        ('window of 12', lambda: RequestWindow(12)),
+        ('adaptive window', lambda: RequestWindow(4, adaptive=True))
+    )
+    for name, make_window in windows:
+        r = run(make_window(), args.requests, args.service, args.input, args.timeout)
+        line = f'{name}: {r["answered"]} answered, {r["lost"]} lost in {r["elapsed_s"]:.2f} s'
+        if 'size' in r:
+            line += (f'; final size {r["size"]}, {r["stalls"]} stalls, '
+                     f'stall max {r["stall_max_s"] * 1000:.0f} ms, rtt {(r["rtt_s"] or 0) * 1000:.1f} ms')
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
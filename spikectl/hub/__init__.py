@@ -1,10 +1,85 @@
+from .buffer import *
+from .sendqueue import *
+from .trace import *
+from .framing import *
 from .serial import *
+from .pending import *
+from .metrics import *
+from .state import *
+from .deadband import *
+from .window import *
+from .stream import *
+from .telemetry import *
+from .sensorview import *
+from .capture import *
 from .spike import *
+from .discovery import *
+from .fleet import *
+from .upload import *
+from .deploy import *
+from .framebuffer import *
+from .setpoints import *
+from .aio import *
 
 __all__ = [
     'RawSerialHub',
     'EmptyBuffer',
     'SerialException',
+    'WriteBatch',
+    'OverflowPolicy',
+    'FrameRing',
+    'Priority',
+    'ports_of',
+    'priority_of',
+    'QueueStats',
+    'SendQueue',
+    'Tracer',
+    'FrameReader',
+    'HubCache',
     'find_hub',
-    'SpikeHub'
+    'discover_hubs',
+    'HubFleet',
+    'UploadError',
+    'ProgramUpload',
+    'upload_program',
+    'upload_to_fleet',
+    'DeployError',
+    'content_id',
+    'Program',
+    'DeployAction',
+    'DeployStep',
+    'DeployPlan',
+    'plan_deploy',
+    'Deployment',
+    'deploy',
+    'deploy_to_fleet',
+    'FrameBuffer',
+    'SetpointChannel',
+    'Setpoints',
+    'SpikeHub',
+    'SpikeHubException',
+    'RequestError',
+    'RequestTimeout',
+    'RequestCancelled',
+    'PendingRequest',
+    'PendingRequests',
+    'PROMETHEUS_BUCKETS',
+    'LatencyHistogram',
+    'MethodMetrics',
+    'HubMetrics',
+    'Snapshot',
+    'HubState',
+    'SensorChange',
+    'SensorDeadband',
+    'DEFAULT_WINDOW_SIZE',
+    'RequestWindow',
+    'NotificationStream',
+    'TelemetryWindow',
+    'TelemetryRecorder',
+    'SensorRecord',
+    'SensorView',
+    'CaptureWriter',
+    'CaptureReader',
+    'ReplaySerial',
+    'AsyncSpikeHub'
 ]
\ No newline at end of file
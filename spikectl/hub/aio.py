@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import asyncio
+import errno
+from functools import partial
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
+
+from serial import Serial
+
+from spikectl import ujsonrpc
+from spikectl.model import *
+
+from .framing import FrameReader
+from .pending import RequestError
+from .serial import SerialException
+from .spike import Display, Motor, _DEFAULT_BAUDRATE
+from .state import DEFAULT_STATE_TYPES, HubState
+from .stream import NotificationStream
+
+
+_READ_CHUNK_SIZE = 4096
+
+_log = logging.getLogger(__name__)
+
+NotificationListener = Callable[[BaseNotification], None]
+
+
+class _NotificationQueue(object):
+    """
+    Async iterator over the notifications a listener puts in a bounded queue; when the queue is full the
+    oldest one is dropped and counted, since the event loop must not wait for the consumer.
+    """
+
+    __slots__ = ['dropped', '_queue', '_deadline', '_remove_listener']
+
+    def __init__(self, hub: AsyncSpikeHub, types: Union[Type, tuple], timeout: Optional[float], capacity: int):
+        self.dropped = 0
+        self._queue = asyncio.Queue(capacity)
+        self._deadline = hub._loop.time() + timeout if timeout is not None else None
+        self._remove_listener = hub.listen(self._put, types)
+
+    def _put(self, notification: BaseNotification):
+        queue = self._queue
+        if queue.full():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(notification)
+
+    def __aiter__(self) -> _NotificationQueue:
+        return self
+
+    async def __anext__(self) -> BaseNotification:
+        if self._deadline is None:
+            return await self._queue.get()
+        remaining = self._deadline - asyncio.get_running_loop().time()
+        try:
+            if remaining <= 0:
+                return self._queue.get_nowait()
+            return await asyncio.wait_for(self._queue.get(), remaining)
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            self.close()
+            raise StopAsyncIteration
+
+    def close(self):
+        self._remove_listener()
+
+
+class AsyncSpikeHub(object):
+    """
+    SPIKE hub driven by an asyncio event loop instead of a blocking `listen` loop.
+
+    The serial file descriptor is registered with the loop, so several hubs can share a single thread.
+    Requests return futures resolved by the matching `RPCResponse` (or failed with `RequestError` on
+    `RPCError`), which means `asyncio.gather` takes the place of `SpikeHub.wait`. An exception raised by a
+    listener is logged, and the other listeners and frames are still served.
+
+    `loop` defaults to the running loop, and must be given when the hub is created outside of one.
+    """
+
+    def __init__(self, connection: Serial, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.connection = connection
+        self.name: Optional[str] = None
+        # Raises RuntimeError outside a running loop
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        self._fd = connection.fileno()
+        self._reader = FrameReader()
+        self._outgoing = bytearray()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._listeners: List[Tuple[NotificationListener, Type]] = []
+        self.state: Optional[HubState] = None
+        self._closed = False
+        # A message cut short when the port was opened fails to parse and is skipped by `_on_frame`
+        connection.reset_input_buffer()
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    @classmethod
+    async def open(cls, device: str, baudrate: int = _DEFAULT_BAUDRATE) -> AsyncSpikeHub:
+        hub = cls(Serial(device, baudrate=baudrate, timeout=0), asyncio.get_running_loop())
+        await hub._init()
+        return hub
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, _READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self._lost(err)
+            return
+        if not data:
+            # End of file: the port hung up, e.g. the hub was unplugged
+            self._lost(SerialException('serial port hung up'))
+            return
+
+        reader = self._reader
+        if reader.feed(data):
+            frame = reader.pop()
+            while frame is not None:
+                self._on_frame(frame)
+                frame = reader.pop()
+
+    def _on_frame(self, frame: bytes):
+        try:
+            msg = ujsonrpc.decode(json.loads(frame))
+        except (ValueError, TypeError):
+            return
+        if msg is None:
+            return
+        if msg.is_notification():
+            self._on_notification(msg)
+        elif msg.is_response() or msg.is_error():
+            future = self._pending.pop(msg.id, None)
+            if future is None or future.done():
+                return
+            if msg.is_error():
+                future.set_exception(RequestError(msg))
+            else:
+                future.set_result(msg.result)
+
+    def _on_notification(self, msg: ujsonrpc.RPCNotification):
+        state = self.state
+        if not self._listeners and state is None:
+            return
+        try:
+            notification = decode_notification(msg)
+        except (ValueError, TypeError, KeyError, IndexError):
+            # A malformed notification is skipped
+            return
+        if state is not None:
+            state.update(notification)
+        for listener, notification_type in tuple(self._listeners):
+            if isinstance(notification, notification_type):
+                try:
+                    listener(notification)
+                except Exception:
+                    # Listeners run in the loop's reader callback, which must go on with the other frames
+                    _log.exception('listener %r failed on %s', listener, self.connection.port)
+
+    def _on_writable(self):
+        try:
+            written = os.write(self._fd, self._outgoing)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            self._loop.remove_writer(self._fd)
+            self._fail_pending(err)
+            return
+        del self._outgoing[:written]
+        if not self._outgoing:
+            self._loop.remove_writer(self._fd)
+
+    def _write(self, data: bytes):
+        if self._outgoing:
+            self._outgoing.extend(data)
+            return
+        try:
+            written = os.write(self._fd, data)
+        except BlockingIOError:
+            written = 0
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+            written = 0
+        if written < len(data):
+            self._outgoing.extend(memoryview(data)[written:])
+            self._loop.add_writer(self._fd, self._on_writable)
+
+    def _lost(self, err: Exception):
+        """
+        Stops watching a port that can no longer be read, which would otherwise be reported readable forever.
+        """
+        self._loop.remove_reader(self._fd)
+        self._fail_pending(err)
+
+    def _fail_pending(self, err: Exception):
+        pending = self._pending
+        self._pending = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(err)
+
+    def send(self, message: ujsonrpc.RPCRequest):
+        json_str = ujsonrpc.encode(message)
+        self._write(json_str.encode('utf-8'))
+
+    def _invoke(self, request: ujsonrpc.RPCRequest) -> asyncio.Future:
+        pending = self._pending
+        while request.id in pending:
+            request.id = ujsonrpc.gen_idx()
+        # Registered once written, so a failed write leaves nothing pending; no answer is read before then
+        self.send(request)
+        future = self._loop.create_future()
+        pending[request.id] = future
+        future.add_done_callback(partial(self._forget, request.id))
+        return future
+
+    def _forget(self, idx: str, future: asyncio.Future):
+        # The id may have been given to a newer request since this one was answered
+        if self._pending.get(idx) is future:
+            del self._pending[idx]
+
+    def track_state(self, types: tuple = DEFAULT_STATE_TYPES) -> HubState:
+        """
+        Keeps `state` up to date with every notification of `types` the hub sends.
+        """
+        self.state = HubState(types)
+        return self.state
+
+    def listen(self, listener: NotificationListener, notification_type: Type = BaseNotification) -> Callable[[], None]:
+        entry = (listener, notification_type)
+        self._listeners.append(entry)
+
+        def remove_listener():
+            if entry in self._listeners:
+                self._listeners.remove(entry)
+
+        return remove_listener
+
+    async def listen_notification(self, notification_type: Type = BaseNotification,
+                                  timeout: Optional[float] = None) -> BaseNotification:
+        future = self._loop.create_future()
+
+        def notification_listener(notification: BaseNotification):
+            if not future.done():
+                future.set_result(notification)
+
+        remove_listener = self.listen(notification_listener, notification_type)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            remove_listener()
+
+    def stream(self, types: Union[Type, tuple] = BaseNotification, timeout: Optional[float] = None,
+               capacity: int = 256) -> NotificationStream:
+        """
+        Notifications of `types` received over the next `timeout` seconds, for `async for`:
+
+            async for batch in hub.stream(SensorNotification, timeout=10).port('A').batch(0.5):
+                print(len(batch))
+
+        Up to `capacity` notifications wait for the consumer; past that the oldest are dropped and counted in
+        the stream's `dropped`. Close the stream when leaving it early so its listener is removed.
+        """
+        assert capacity > 0, 'capacity must be positive'
+        return NotificationStream(_NotificationQueue(self, types, timeout, capacity))
+
+    def trigger_current_state(self):
+        request = TriggerCurrentStateRequest()
+        self.send(request)
+
+    async def _init(self):
+        future = self._loop.create_future()
+        remove_listener = self.listen(lambda n: future.done() or future.set_result(n), InfoStatusNotification)
+        try:
+            self.trigger_current_state()
+            n = await future
+        finally:
+            remove_listener()
+        self.name = n.name
+
+    @property
+    def display(self) -> Display:
+        return Display(self)
+
+    def motor(self, port: str) -> Motor:
+        assert port in ['A', 'B', 'C', 'D', 'E', 'F'], 'port must be a letter between A and F'
+        return Motor(self, port)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.remove_reader(self._fd)
+        if self._outgoing:
+            self._loop.remove_writer(self._fd)
+        for future in list(self._pending.values()):
+            future.cancel()
+        self.connection.close()
+
+
+__all__ = [
+    'AsyncSpikeHub'
+]
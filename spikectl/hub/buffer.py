@@ -0,0 +1,112 @@
+from enum import Enum
+from threading import Condition
+from typing import List, Optional
+from time import monotonic
+
+
+class OverflowPolicy(Enum):
+    DropOldest = 'drop_oldest'
+    Block = 'block'
+
+
+class FrameRing(object):
+    """
+    Bounded FIFO of raw frames shared between a reader thread and a consumer.
+
+    Slots are allocated once; when the ring is full the overflow policy decides whether the
+    oldest frame is overwritten or the producer waits for the consumer to catch up.
+    """
+
+    __slots__ = ['_slots', '_capacity', '_head', '_size', '_overflow', '_condition', '_closed', '_stopped',
+                 'received', 'dropped', 'high_watermark']
+
+    def __init__(self, capacity: int = 256, overflow: OverflowPolicy = OverflowPolicy.DropOldest):
+        assert capacity > 0, 'capacity must be a positive number of frames'
+        self._slots: List[Optional[bytes]] = [None] * capacity
+        self._capacity = capacity
+        self._head = 0
+        self._size = 0
+        self._overflow = overflow
+        self._condition = Condition()
+        self._closed = False
+        # Set once the producer must give up, e.g. while blocked on a full ring
+        self._stopped = False
+        self.received = 0
+        self.dropped = 0
+        self.high_watermark = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return self._size
+
+    def put(self, frame: bytes) -> bool:
+        with self._condition:
+            if self._stopped:
+                return False
+            if self._size == self._capacity:
+                if self._overflow is OverflowPolicy.Block:
+                    while self._size == self._capacity and not self._closed and not self._stopped:
+                        self._condition.wait()
+                    if self._closed or self._stopped:
+                        return False
+                else:
+                    self._slots[self._head] = None
+                    self._head = (self._head + 1) % self._capacity
+                    self._size -= 1
+                    self.dropped += 1
+
+            self._slots[(self._head + self._size) % self._capacity] = frame
+            self._size += 1
+            self.received += 1
+            if self._size > self.high_watermark:
+                self.high_watermark = self._size
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        deadline = monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while self._size == 0:
+                if self._closed:
+                    return None
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+            frame = self._slots[self._head]
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self._capacity
+            self._size -= 1
+            self._condition.notify_all()
+            return frame
+
+    def stop(self):
+        """
+        Makes `put` return `False` from now on, waking a producer waiting for room; frames already in the
+        ring can still be taken.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __str__(self):
+        return f'FrameRing [capacity: {self._capacity}, size: {self._size}, received: {self.received}, ' \
+               f'dropped: {self.dropped}]'
+
+
+__all__ = [
+    'OverflowPolicy',
+    'FrameRing'
+]
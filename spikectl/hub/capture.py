@@ -0,0 +1,285 @@
+"""
+Binary captures of the frames a hub sends, and a serial transport that replays them.
+
+A capture starts with an 8 byte magic followed by one record per frame: a 12 byte little-endian header
+(nanoseconds since the capture started as uint64, frame length as uint32) and the frame without its CR.
+
+Record a session with:
+
+    python -m spikectl.hub.capture my-hub session.cap --seconds 60
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser
+import mmap
+import struct
+from threading import Condition
+from time import monotonic, monotonic_ns
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple, Union
+
+from serial.serialutil import SerialBase
+
+
+MAGIC = b'SPKCAP01'
+
+_RECORD = struct.Struct('<QI')
+_CR = b'\r'
+
+
+class CaptureFormatError(Exception): pass
+
+
+class CaptureWriter(object):
+
+    __slots__ = ['_file', '_owns_file', '_start', '_pack', 'frames']
+
+    def __init__(self, target: Union[str, BinaryIO]):
+        if isinstance(target, str):
+            self._file = open(target, 'wb')
+            self._owns_file = True
+        else:
+            self._file = target
+            self._owns_file = False
+        self._file.write(MAGIC)
+        self._start = monotonic_ns()
+        self._pack = _RECORD.pack
+        self.frames = 0
+
+    def write(self, frame: bytes, timestamp_ns: Optional[int] = None):
+        if timestamp_ns is None:
+            timestamp_ns = monotonic_ns()
+        self._file.write(self._pack(timestamp_ns - self._start, len(frame)))
+        self._file.write(frame)
+        self.frames += 1
+
+    def attach(self, hub) -> Callable[[], None]:
+        """
+        Captures every frame `hub` reads from now on. Returns a function that stops capturing.
+        """
+        return hub.add_frame_hook(self.write)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self) -> CaptureWriter:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class CaptureReader(object):
+    """
+    Reads a capture through a memory map; frames come out as slices of it without being copied.
+    """
+
+    __slots__ = ['_file', '_map', '_view', 'frames', 'duration']
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._file.close()
+            raise CaptureFormatError(f'{path} is not a capture')
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise CaptureFormatError(f'{path} is not a capture')
+        self._view = memoryview(self._map)
+        self.frames = 0
+        self.duration = 0.0
+        for timestamp, _ in self:
+            self.frames += 1
+            self.duration = timestamp
+
+    def __iter__(self) -> Iterator[Tuple[float, memoryview]]:
+        """
+        Yields `(seconds since the capture started, frame)` pairs.
+        """
+        view = self._view
+        unpack_from = _RECORD.unpack_from
+        header_size = _RECORD.size
+        position = len(MAGIC)
+        end = len(view)
+        while position + header_size <= end:
+            timestamp_ns, length = unpack_from(view, position)
+            position += header_size
+            if position + length > end:
+                # Truncated by a capture that did not close cleanly
+                return
+            yield timestamp_ns / 1e9, view[position:position + length]
+            position += length
+
+    def __len__(self) -> int:
+        return self.frames
+
+    def stream(self) -> bytes:
+        """
+        All frames as the hub sent them, CR-terminated.
+        """
+        return b''.join(bytes(frame) + _CR for _, frame in self)
+
+    def close(self):
+        try:
+            if getattr(self, '_view', None) is not None:
+                self._view.release()
+                self._view = None
+            self._map.close()
+        except BufferError:
+            # Frames handed out are still referenced; the map goes away with the last of them
+            pass
+        self._file.close()
+
+
+class ReplaySerial(object):
+    """
+    Serial port stand-in that plays a capture back, for `RawSerialHub` and `SpikeHub` to read.
+
+    Frames become readable at their original pace scaled by `speed` (2.0 replays twice as fast), or all at
+    once when `speed` is `None`. Writes are accepted and discarded.
+    """
+
+    read_until = SerialBase.read_until
+
+    def __init__(self, capture: Union[str, CaptureReader], speed: Optional[float] = 1.0, timeout: Optional[float] = 1,
+                 loop: bool = False):
+        self.capture = capture if isinstance(capture, CaptureReader) else CaptureReader(capture)
+        self.speed = speed
+        self.timeout = timeout
+        self._timeout = timeout
+        self.port = f'replay:{capture}' if isinstance(capture, str) else 'replay'
+        self.loop = loop
+        self.is_open = True
+        self.written = 0
+        self._records = iter(self.capture)
+        self._next: Optional[Tuple[float, memoryview]] = None
+        self._buffer = bytearray()
+        self._start = monotonic()
+        self._condition = Condition()
+        self._cancelled = False
+
+    def _release(self) -> Optional[float]:
+        """
+        Moves due frames into the read buffer; returns the delay until the next one, or `None` at the end.
+        """
+        elapsed = (monotonic() - self._start) * self.speed if self.speed else float('inf')
+        buffer = self._buffer
+        while True:
+            if self._next is None:
+                self._next = next(self._records, None)
+                if self._next is None:
+                    if not self.loop or not self.capture.frames:
+                        return None
+                    self._records = iter(self.capture)
+                    self._start = monotonic()
+                    elapsed = 0.0
+                    continue
+            timestamp, frame = self._next
+            if timestamp > elapsed:
+                return (timestamp - elapsed) / self.speed
+            buffer += frame
+            buffer += _CR
+            self._next = None
+            if self.speed is None and len(buffer) >= 1 << 16:
+                return 0.0
+
+    @property
+    def in_waiting(self) -> int:
+        if not self._buffer:
+            self._release()
+        return len(self._buffer)
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = monotonic() + self.timeout if self.timeout is not None else None
+        buffer = self._buffer
+        while len(buffer) < size:
+            delay = self._release()
+            if len(buffer) >= size or delay is None or delay == 0.0:
+                break
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                delay = min(delay, remaining)
+            with self._condition:
+                if self._condition.wait_for(lambda: self._cancelled, delay):
+                    self._cancelled = False
+                    break
+        data = bytes(buffer[:size])
+        del buffer[:size]
+        return data
+
+    def cancel_read(self):
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    def write(self, data: bytes) -> int:
+        self.written += len(data)
+        return len(data)
+
+    def flushInput(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self.cancel_read()
+
+
+def record(hub, path: str, seconds: float) -> int:
+    """
+    Captures `seconds` of traffic from `hub` into `path`, returning the number of frames captured.
+    """
+    from .serial import EmptyBuffer
+
+    with CaptureWriter(path) as writer:
+        remove_hook = writer.attach(hub)
+        try:
+            hub.listen(lambda _: True, seconds)
+        except EmptyBuffer:
+            pass
+        finally:
+            remove_hook()
+        return writer.frames
+
+
+def main():
+    from .discovery import find_hub
+
+    parser = ArgumentParser(description='Capture the frames sent by a SPIKE hub')
+    parser.add_argument('name', help='hub name')
+    parser.add_argument('path', help='capture file to write')
+    parser.add_argument('--seconds', type=float, default=60.0)
+    args = parser.parse_args()
+
+    hub = find_hub(args.name)
+    if hub is None:
+        parser.error(f'hub {args.name} not found')
+    try:
+        frames = record(hub, args.path, args.seconds)
+    finally:
+        hub.close()
+    print(f'{frames} frames captured in {args.path}')
+
+
+__all__ = [
+    'CaptureFormatError',
+    'CaptureWriter',
+    'CaptureReader',
+    'ReplaySerial',
+    'record'
+]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from spikectl.model import SensorType, decode_external_sensor
+
+
+_PORTS = ('A', 'B', 'C', 'D', 'E', 'F')
+
+# Hub fields of a sensor frame, by position in its parameters
+_HUB_FIELDS = ((6, 'accelerometer'), (7, 'gyroscope'), (8, 'position'))
+
+# Device type id to the name its ports' deadband can be given under
+_DEVICE_KINDS: Dict[int, str] = {
+    SensorType.LPF2_FLIPPER_MOTOR_SMALL.value: 'motor',
+    SensorType.LPF2_FLIPPER_MOTOR_MEDIUM.value: 'motor',
+    SensorType.LPF2_FLIPPER_MOTOR_LARGE.value: 'motor',
+    SensorType.LPF2_STONE_GREY_MOTOR_MEDIUM.value: 'motor',
+    SensorType.LPF2_STONE_GREY_MOTOR_LARGE.value: 'motor',
+    SensorType.LPF2_FLIPPER_COLOR.value: 'color',
+    SensorType.LPF2_FLIPPER_DISTANCE.value: 'distance',
+    SensorType.LPF2_FLIPPER_FORCE.value: 'force'
+}
+
+# Names of the raw values each device kind reports, in order; `motor_position` names a motor's position
+_DEVICE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    'motor': ('speed', 'position', 'absolute_position', 'power'),
+    'color': ('reflection', 'color'),
+    'distance': ('distance',),
+    'force': ('force', 'pressed', 'raw')
+}
+
+# Raw values compared per port; devices never report more
+_MAX_VALUES = 4
+
+_FIELDS = frozenset([field for _, field in _HUB_FIELDS] + list(_PORTS) + list(_DEVICE_FIELDS) +
+                    [f'{kind}_{name}' for kind, names in _DEVICE_FIELDS.items() for name in names])
+
+
+class SensorChange(object):
+    """
+    A field of a sensor frame that moved past its deadband: a port letter with its decoded
+    `ExternalSensorData` (`None` once nothing is connected), or `accelerometer`, `gyroscope` or `position`
+    with the raw values.
+    """
+
+    __slots__ = ['field', 'value', 'time', 'timestamp']
+
+    def __init__(self, field: str, value: any, time: int, timestamp: float):
+        self.field = field
+        self.value = value
+        # Hub clock of the frame, and monotonic host time it was read at
+        self.time = time
+        self.timestamp = timestamp
+
+    def __str__(self):
+        return f'SensorChange [field: {self.field}, value: {self.value}, time: {self.time}]'
+
+
+def _moved(last: list, values: list, thresholds: Optional[Tuple[float, ...]]) -> bool:
+    """
+    Whether any of `values` is further than its threshold from the one before it; the lists are known to
+    differ, and `thresholds` is `None` when every change counts.
+    """
+    if thresholds is None or len(last) != len(values):
+        return True
+    try:
+        for before, now, threshold in zip(last, values, thresholds):
+            if abs(now - before) > threshold:
+                return True
+        return False
+    except TypeError:
+        pass
+    # Some value is not a number, e.g. the distance sensor seeing nothing
+    for before, now, threshold in zip(last, values, thresholds):
+        if isinstance(now, (int, float)) and isinstance(before, (int, float)):
+            if abs(now - before) > threshold:
+                return True
+        elif now != before:
+            return True
+    return False
+
+
+def _thresholds(*values: float) -> Optional[Tuple[float, ...]]:
+    return values if any(values) else None
+
+
+class SensorDeadband(object):
+    """
+    Compares raw sensor frames with the values last emitted and emits a `SensorChange` for each field that
+    moved by more than its threshold, so idle ports cost neither a decode nor a listener call.
+
+    Thresholds are given per field: `accelerometer`, `gyroscope` and `position` (the hub's yaw, pitch and
+    roll); a raw value of a device kind, whatever port it is on, e.g. `motor_position`, `motor_speed` or
+    `force_force`; a port letter, for every raw value of that port; or a device kind (`motor`, `color`,
+    `distance`, `force`), for every raw value of its devices. The most specific one given applies. Fields
+    without one emit on any change; a device being plugged or unplugged always counts as one.
+    """
+
+    __slots__ = ['thresholds', 'frames', 'changes', '_last', '_port_thresholds', '_hub_thresholds']
+
+    def __init__(self, thresholds: Optional[Dict[str, float]] = None, **fields: float):
+        self.thresholds: Dict[str, float] = dict(thresholds or {}, **fields)
+        for field, threshold in self.thresholds.items():
+            assert field in _FIELDS, f'no sensor field named {field}'
+            assert threshold >= 0, f'deadband of {field} must not be negative'
+        self.frames = 0
+        self.changes = 0
+        # Raw value last emitted for each field, by position in the frame's parameters
+        self._last: List[any] = [None] * 9
+        # Thresholds of each raw value of a port, for the device last seen on it
+        self._port_thresholds: List[Optional[Tuple[float, ...]]] = [None] * 6
+        self._hub_thresholds = tuple(_thresholds(*(self.thresholds.get(field, 0),) * 3) for _, field in _HUB_FIELDS)
+
+    def _port_threshold(self, index: int, device_type: int) -> Optional[Tuple[float, ...]]:
+        thresholds = self.thresholds
+        kind = _DEVICE_KINDS.get(device_type)
+        fallback = thresholds.get(_PORTS[index])
+        if fallback is None:
+            fallback = thresholds.get(kind, 0)
+        names = _DEVICE_FIELDS.get(kind, ())
+        return _thresholds(*(thresholds.get(f'{kind}_{names[i]}', fallback) if i < len(names) else fallback
+                             for i in range(_MAX_VALUES)))
+
+    def feed(self, parameters: list, timestamp: float, emit: Callable[[SensorChange], None]):
+        """
+        Calls `emit` for each field of the sensor frame with `parameters` that moved past its deadband.
+        """
+        self.frames += 1
+        last = self._last
+        port_thresholds = self._port_thresholds
+        time = parameters[10]
+        for index in range(6):
+            port = parameters[index]
+            before = last[index]
+            if before is not None and before == port:
+                continue
+            if before is not None and before[0] == port[0]:
+                if not _moved(before[1], port[1], port_thresholds[index]):
+                    continue
+            else:
+                port_thresholds[index] = self._port_threshold(index, port[0])
+            last[index] = port
+            self.changes += 1
+            emit(SensorChange(_PORTS[index], decode_external_sensor(port), time, timestamp))
+        for (index, field), threshold in zip(_HUB_FIELDS, self._hub_thresholds):
+            values = parameters[index]
+            before = last[index]
+            if before is not None and (before == values or not _moved(before, values, threshold)):
+                continue
+            last[index] = values
+            self.changes += 1
+            emit(SensorChange(field, values, time, timestamp))
+
+    def reset(self):
+        """
+        Forgets the values emitted so far; the next frame emits every field.
+        """
+        self._last = [None] * 9
+
+
+__all__ = [
+    'SensorChange',
+    'SensorDeadband'
+]
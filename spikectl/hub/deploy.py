@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+from base64 import urlsafe_b64encode
+from enum import Enum
+from hashlib import blake2b
+import os
+from typing import Dict, List, Optional, Tuple
+
+from spikectl.model import MoveProjectRequest, StorageInformationNotification
+
+from .fleet import HubFleet
+from .pending import PendingRequest, SpikeHubException
+from .spike import SpikeHub
+from .upload import ProgramUpload, _POLL_INTERVAL
+
+
+# How long to wait for a hub to report its slots when none are cached
+_SLOTS_TIMEOUT = 3.0
+
+_MOVE_TIMEOUT = 5.0
+
+
+class DeployError(SpikeHubException): pass
+
+
+def content_id(data: bytes, name: str, project_type: str = 'python') -> str:
+    """
+    Project id derived from a program's name, type and content.
+
+    Uploads use it as the project id, so the slot table the hub reports tells which slots already hold a
+    program without reading anything back.
+    """
+    digest = blake2b(digest_size=9)
+    digest.update(f'{project_type}\0{name}\0'.encode('utf-8'))
+    digest.update(data)
+    return urlsafe_b64encode(digest.digest()).decode('ascii')
+
+
+class Program(object):
+
+    __slots__ = ['name', 'data', 'project_type', 'project_id']
+
+    def __init__(self, name: str, data: bytes, project_type: str = 'python'):
+        self.name = name
+        self.data = data
+        self.project_type = project_type
+        self.project_id = content_id(data, name, project_type)
+
+    @classmethod
+    def from_file(cls, path: str, name: Optional[str] = None, project_type: str = 'python') -> Program:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        return cls(name, data, project_type)
+
+    def __str__(self):
+        return f'Program [name: {self.name}, size: {len(self.data)}, project_id: {self.project_id}]'
+
+
+class DeployAction(Enum):
+    Keep = 'keep'
+    Move = 'move'
+    Upload = 'upload'
+
+
+class DeployStep(object):
+
+    __slots__ = ['action', 'slot', 'program', 'source']
+
+    def __init__(self, action: DeployAction, slot: int, program: Program, source: Optional[int] = None):
+        self.action = action
+        self.slot = slot
+        self.program = program
+        self.source = source
+
+    def __str__(self):
+        source = f' from {self.source}' if self.source is not None else ''
+        return f'{self.action.value} {self.program.name} to slot {self.slot}{source}'
+
+
+class DeployPlan(object):
+    """
+    Steps turning a hub's slots into the requested layout, in the order they must run.
+
+    Moves come first, ordered so no slot is overwritten before the program in it has been moved out, then
+    the uploads. Slots already holding the right program are kept.
+    """
+
+    __slots__ = ['steps']
+
+    def __init__(self, steps: List[DeployStep]):
+        self.steps = steps
+
+    def _with(self, action: DeployAction) -> List[DeployStep]:
+        return [step for step in self.steps if step.action is action]
+
+    @property
+    def kept(self) -> List[DeployStep]:
+        return self._with(DeployAction.Keep)
+
+    @property
+    def moves(self) -> List[DeployStep]:
+        return self._with(DeployAction.Move)
+
+    @property
+    def uploads(self) -> List[DeployStep]:
+        return self._with(DeployAction.Upload)
+
+    @property
+    def changed(self) -> bool:
+        return any(step.action is not DeployAction.Keep for step in self.steps)
+
+    @property
+    def upload_size(self) -> int:
+        return sum(len(step.program.data) for step in self.uploads)
+
+    def __str__(self):
+        return 'DeployPlan [{}]'.format(', '.join(str(step) for step in self.steps))
+
+
+def _slot_table(slots: Optional[Dict]) -> Dict[int, Tuple[str, Optional[int]]]:
+    """
+    `(project_id, size)` of every occupied slot in a `StorageInformationNotification.slots` table.
+    """
+    table = {}
+    for slot, entry in (slots or {}).items():
+        if isinstance(entry, dict) and entry.get('project_id'):
+            table[int(slot)] = (entry['project_id'], entry.get('size'))
+    return table
+
+
+def plan_deploy(programs: Dict[int, Program], slots: Optional[Dict]) -> DeployPlan:
+    """
+    Compares the programs wanted in each slot with the slot table reported by the hub.
+    """
+    table = _slot_table(slots)
+
+    def holds(slot: int, program: Program) -> bool:
+        entry = table.get(slot)
+        return entry is not None and entry[0] == program.project_id and entry[1] in (None, len(program.data))
+
+    kept = {slot for slot, program in programs.items() if holds(slot, program)}
+
+    # Programs that can be moved instead of uploaded, from slots that are not kept as they are
+    sources: Dict[str, List[int]] = {}
+    for slot in sorted(table):
+        if slot not in kept:
+            sources.setdefault(table[slot][0], []).append(slot)
+
+    moves: Dict[int, int] = {}
+    uploads: List[int] = []
+    for slot in sorted(programs):
+        if slot in kept:
+            continue
+        program = programs[slot]
+        candidates = [source for source in sources.get(program.project_id, ()) if holds(source, program)]
+        if candidates:
+            source = candidates[0]
+            sources[program.project_id].remove(source)
+            moves[slot] = source
+        else:
+            uploads.append(slot)
+
+    # A move may only overwrite a slot once the program in it has been moved out
+    ordered: List[Tuple[int, int]] = []
+    needed = {source: slot for slot, source in moves.items()}
+    while moves:
+        ready = sorted(slot for slot in moves if slot not in needed)
+        if not ready:
+            # The remaining moves form cycles; breaking one with an upload frees the others
+            slot = min(moves)
+            del needed[moves.pop(slot)]
+            uploads.append(slot)
+            continue
+        for slot in ready:
+            source = moves.pop(slot)
+            del needed[source]
+            ordered.append((source, slot))
+
+    steps = [DeployStep(DeployAction.Keep, slot, programs[slot]) for slot in sorted(kept)]
+    steps += [DeployStep(DeployAction.Move, slot, programs[slot], source) for source, slot in ordered]
+    steps += [DeployStep(DeployAction.Upload, slot, programs[slot]) for slot in sorted(uploads)]
+    return DeployPlan(steps)
+
+
+class Deployment(object):
+    """
+    Runs a `DeployPlan` on a hub: the moves are sent back to back, then the programs are uploaded one
+    at a time. Like `ProgramUpload`, it advances whenever something reads from the hub.
+    """
+
+    __slots__ = ['hub', 'plan', 'options', 'uploads', 'error', 'finished', '_moves_pending', '_uploads_left']
+
+    def __init__(self, hub: SpikeHub, plan: DeployPlan, **options):
+        self.hub = hub
+        self.plan = plan
+        self.options = options
+        self.uploads: List[ProgramUpload] = []
+        self.error: Optional[SpikeHubException] = None
+        self.finished = False
+        self._moves_pending = 0
+        self._uploads_left: List[DeployStep] = []
+
+    @property
+    def done(self) -> bool:
+        return self.finished
+
+    def result(self) -> DeployPlan:
+        if not self.finished:
+            raise DeployError('deployment is still running')
+        if self.error is not None:
+            raise self.error
+        return self.plan
+
+    def start(self):
+        self._uploads_left = list(reversed(self.plan.uploads))
+        moves = self.plan.moves
+        if not moves:
+            self._next_upload()
+            return
+        self._moves_pending = len(moves)
+        timeout = self.options.get('timeout', _MOVE_TIMEOUT)
+        for step in moves:
+            task = self.hub._invoke(MoveProjectRequest(step.source, step.slot), timeout)
+            task.add_done_callback(lambda t, s=step: self._on_moved(t, s))
+
+    def _finish(self, error: Optional[SpikeHubException] = None):
+        if self.finished:
+            return
+        self.error = error
+        self.finished = True
+        if self.plan.changed and self.hub.state is not None:
+            # The cached slot table no longer describes the hub
+            self.hub.state.discard(StorageInformationNotification)
+
+    def _on_moved(self, task: PendingRequest, step: DeployStep):
+        self._moves_pending -= 1
+        if task.error is not None:
+            self._finish(DeployError(f'could not move slot {step.source} to {step.slot}: {task.error}'))
+        elif self._moves_pending == 0 and not self.finished:
+            self._next_upload()
+
+    def _next_upload(self):
+        if not self._uploads_left:
+            self._finish()
+            return
+        step = self._uploads_left.pop()
+        program = step.program
+        upload = ProgramUpload(self.hub, step.slot, program.data, program.name, program.project_id,
+                               program.project_type, **self.options)
+        self.uploads.append(upload)
+        upload.on_done = self._on_uploaded
+        upload.start()
+
+    def _on_uploaded(self, upload: ProgramUpload):
+        if upload.error is not None:
+            self._finish(upload.error)
+        else:
+            self._next_upload()
+
+
+def _programs(programs: Dict[int, Program]) -> Dict[int, Program]:
+    for slot in programs:
+        assert 0 <= slot <= 19, 'slots must be between 0 and 19'
+    return programs
+
+
+def deploy(hub: SpikeHub, programs: Dict[int, Program], slots_timeout: float = _SLOTS_TIMEOUT, **options) -> Deployment:
+    """
+    Makes `hub` hold `programs` (by slot), uploading only the programs its slots do not already hold.
+
+    The slot table comes from the hub's cached state when there is one. `options` are passed on to
+    `ProgramUpload`; raises `DeployError` or `UploadError` if the deployment failed.
+    """
+    programs = _programs(programs)
+    state = hub.state if hub.state is not None else hub.track_state()
+    if state.storage is None:
+        hub.trigger_current_state()
+    snapshot = hub.read_state(StorageInformationNotification, timeout=slots_timeout)
+    if snapshot is None:
+        raise DeployError(f'hub did not report its slots within {slots_timeout}s')
+
+    deployment = Deployment(hub, plan_deploy(programs, snapshot.value.slots), **options)
+    deployment.start()
+    if not deployment.done:
+        hub.listen(lambda _: not deployment.done, methods=())
+    deployment.result()
+    return deployment
+
+
+def deploy_to_fleet(fleet: HubFleet, programs: Dict[int, Program], slots_timeout: float = _SLOTS_TIMEOUT,
+                    **options) -> Dict[str, Deployment]:
+    """
+    Deploys `programs` to every hub of `fleet` at once. Returns the deployments by hub name; check each
+    one's `error`, as a failing hub does not stop the others.
+    """
+    programs = _programs(programs)
+    missing = set()
+    for name, hub in fleet.hubs.items():
+        state = hub.state if hub.state is not None else hub.track_state()
+        if state.storage is None:
+            hub.trigger_current_state()
+            missing.add(name)
+
+    if missing:
+        def slots_reported(name: str, _: StorageInformationNotification) -> bool:
+            missing.discard(name)
+            return bool(missing)
+
+        fleet.listen(slots_reported, StorageInformationNotification, slots_timeout)
+
+    deployments = {}
+    for name, hub in fleet.hubs.items():
+        snapshot = hub.state.storage
+        if snapshot is None:
+            deployment = Deployment(hub, DeployPlan([]), **options)
+            deployment._finish(DeployError(f'hub {name} did not report its slots within {slots_timeout}s'))
+        else:
+            deployment = Deployment(hub, plan_deploy(programs, snapshot.value.slots), **options)
+            deployment.start()
+        deployments[name] = deployment
+
+    running = [deployment for deployment in deployments.values() if not deployment.done]
+    while running:
+        fleet.poll(_POLL_INTERVAL)
+        running = [deployment for deployment in running if not deployment.done]
+    return deployments
+
+
+__all__ = [
+    'DeployError',
+    'content_id',
+    'Program',
+    'DeployAction',
+    'DeployStep',
+    'DeployPlan',
+    'plan_deploy',
+    'Deployment',
+    'deploy',
+    'deploy_to_fleet'
+]
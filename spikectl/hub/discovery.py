@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import json
+import os
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from serial import Serial
+from serial.serialutil import SerialException as PortException
+from serial.tools.list_ports import comports
+from serial.tools.list_ports_common import ListPortInfo
+
+from spikectl.model import InfoStatusNotification
+
+from .serial import SerialException
+from .spike import SpikeHub, _DEFAULT_BAUDRATE
+
+
+_PRODUCT = 'LEGO Technic Large Hub'
+
+# How long a port gets to answer trigger_current_state with its name
+_PROBE_TIMEOUT = 3.0
+
+
+def _default_cache_path() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'spikectl', 'hubs.json')
+
+
+class HubCache(object):
+    """
+    Remembers which USB device each hub name was last seen on, so reconnecting skips probing.
+
+    Entries are keyed by hub name and hold the device path and USB serial number; the serial number wins
+    when the device path changed between connections.
+    """
+
+    __slots__ = ['path', '_entries', '_lock']
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._entries: Dict[str, Dict[str, Optional[str]]] = {}
+        self._lock = Lock()
+        if path is not None:
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+                if isinstance(entries, dict):
+                    self._entries = entries
+            except (OSError, ValueError):
+                # A missing or corrupt cache only costs a probe
+                pass
+
+    @classmethod
+    def default(cls) -> HubCache:
+        return cls(os.environ.get('SPIKECTL_HUB_CACHE') or _default_cache_path())
+
+    def get(self, name: str) -> Optional[Dict[str, Optional[str]]]:
+        return self._entries.get(name)
+
+    def put(self, name: str, port: ListPortInfo):
+        entry = {'device': port.device, 'serial_number': port.serial_number}
+        with self._lock:
+            if self._entries.get(name) == entry:
+                return
+            self._entries[name] = entry
+        self.save()
+
+    def remove(self, name: str):
+        with self._lock:
+            if self._entries.pop(name, None) is None:
+                return
+        self.save()
+
+    def find_port(self, name: str, ports: List[ListPortInfo]) -> Optional[ListPortInfo]:
+        entry = self.get(name)
+        if entry is None:
+            return None
+        serial_number = entry.get('serial_number')
+        if serial_number:
+            for port in ports:
+                if port.serial_number == serial_number:
+                    return port
+        for port in ports:
+            if port.device == entry.get('device'):
+                return port
+        return None
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            try:
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                temporary = f'{self.path}.{os.getpid()}.tmp'
+                with open(temporary, 'w') as f:
+                    json.dump(self._entries, f, indent=2)
+                os.replace(temporary, self.path)
+            except OSError:
+                # Not being able to persist the cache only costs a probe next time
+                pass
+
+
+def hub_ports() -> List[ListPortInfo]:
+    """
+    USB ports of SPIKE hubs, and the devices listed in `SPIKECTL_PORTS` (separated by `os.pathsep`), e.g.
+    emulated hubs on pseudo-terminals.
+    """
+    ports = [port for port in comports() if port.product and _PRODUCT in port.product]
+    extra = os.environ.get('SPIKECTL_PORTS')
+    if extra:
+        known = {port.device for port in ports}
+        ports += [ListPortInfo(device) for device in extra.split(os.pathsep)
+                  if device and device not in known]
+    return ports
+
+
+def probe(device: str, timeout: float = _PROBE_TIMEOUT) -> Optional[SpikeHub]:
+    """
+    Opens `device` and asks for the hub's name. Returns the connected hub, with `name` set, or `None`.
+    """
+    try:
+        hub = SpikeHub(Serial(device, baudrate=_DEFAULT_BAUDRATE, timeout=1))
+    except (PortException, OSError):
+        return None
+
+    try:
+        hub.trigger_current_state()
+        notification = hub.listen_notification(InfoStatusNotification, timeout)
+    except (PortException, SerialException, OSError):
+        notification = None
+
+    if notification is None:
+        hub.close()
+        return None
+
+    hub.name = notification.name
+    return hub
+
+
+def _probe_all(ports: List[ListPortInfo], timeout: float) -> Tuple[ThreadPoolExecutor, Dict[Future, ListPortInfo]]:
+    executor = ThreadPoolExecutor(max_workers=len(ports), thread_name_prefix='spikectl-probe')
+    futures = {executor.submit(probe, port.device, timeout): port for port in ports}
+    return executor, futures
+
+
+def find_hub(name: str, cache: Optional[HubCache] = None, timeout: float = _PROBE_TIMEOUT) -> Optional[SpikeHub]:
+    """
+    Connects to the hub called `name`.
+
+    A hub found in the cache is verified with a single handshake. Otherwise every candidate port is probed
+    at once, and the first hub answering with `name` is returned while the others are closed in the
+    background. Every name learned on the way goes into the cache.
+    """
+    cache = cache if cache is not None else HubCache.default()
+    ports = hub_ports()
+
+    cached_port = cache.find_port(name, ports)
+    if cached_port is not None:
+        hub = probe(cached_port.device, timeout)
+        if hub is not None:
+            cache.put(hub.name, cached_port)
+            if hub.name == name:
+                return hub
+            hub.close()
+        cache.remove(name)
+        ports = [port for port in ports if port.device != cached_port.device]
+
+    if not ports:
+        return None
+
+    executor, futures = _probe_all(ports, timeout)
+    winner: Optional[SpikeHub] = None
+
+    def close_late_probe(future: Future):
+        hub = future.result()
+        if hub is not None:
+            cache.put(hub.name, futures[future])
+            hub.close()
+
+    try:
+        pending = set(futures)
+        for future in as_completed(futures):
+            pending.discard(future)
+            hub = future.result()
+            if hub is None:
+                continue
+            cache.put(hub.name, futures[future])
+            if hub.name == name:
+                winner = hub
+                break
+            hub.close()
+        for future in pending:
+            future.add_done_callback(close_late_probe)
+    finally:
+        executor.shutdown(wait=False)
+
+    return winner
+
+
+def discover_hubs(cache: Optional[HubCache] = None, timeout: float = _PROBE_TIMEOUT) -> Dict[str, str]:
+    """
+    Probes every candidate port at once and returns the device path of each hub by name.
+    """
+    cache = cache if cache is not None else HubCache.default()
+    ports = hub_ports()
+    if not ports:
+        return {}
+
+    found = {}
+    executor, futures = _probe_all(ports, timeout)
+    try:
+        for future in as_completed(futures):
+            hub = future.result()
+            if hub is None:
+                continue
+            port = futures[future]
+            found[hub.name] = port.device
+            cache.put(hub.name, port)
+            hub.close()
+    finally:
+        executor.shutdown(wait=False)
+    return found
+
+
+__all__ = [
+    'HubCache',
+    'hub_ports',
+    'probe',
+    'find_hub',
+    'discover_hubs'
+]
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import json
+import os
+import selectors
+from time import monotonic
+from typing import Callable, Collection, Dict, Optional, Type
+
+from spikectl import ujsonrpc
+from spikectl.model import *
+
+from .pending import PendingRequest
+from .serial import EmptyBuffer
+from .spike import SpikeHub
+
+
+_READ_CHUNK_SIZE = 64 * 1024
+
+FleetListener = Callable[[str, BaseNotification], bool]
+
+
+class HubFleet(object):
+    """
+    Drives many hubs from a single thread, multiplexing their serial ports with `selectors`.
+
+    Frames are split per hub, responses resolve that hub's pending requests and notifications reach the
+    listener together with the name of the hub that sent them.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self.hubs: Dict[str, SpikeHub] = {}
+        # Hubs with frames already read off the port but not dispatched yet
+        self._backlog: Dict[str, SpikeHub] = {}
+
+    def add(self, hub: SpikeHub, name: Optional[str] = None) -> str:
+        assert hub._reader_thread is None, 'hubs in a fleet are read by the fleet, stop their reader first'
+        name = name if name is not None else getattr(hub, 'name', None)
+        assert name, 'hub has no name, initialise it or pass one'
+        assert name not in self.hubs, f'hub {name} already in the fleet'
+        self._selector.register(hub.connection.fileno(), selectors.EVENT_READ, (name, hub))
+        self.hubs[name] = hub
+        return name
+
+    def remove(self, name: str) -> SpikeHub:
+        hub = self.hubs.pop(name)
+        self._backlog.pop(name, None)
+        self._selector.unregister(hub.connection.fileno())
+        return hub
+
+    def __len__(self) -> int:
+        return len(self.hubs)
+
+    def __getitem__(self, name: str) -> SpikeHub:
+        return self.hubs[name]
+
+    def poll(self, timeout: Optional[float] = None, listener: Optional[FleetListener] = None,
+             methods: Optional[Collection] = None) -> bool:
+        """
+        Reads whatever the hubs have sent, waiting up to `timeout` seconds for something to arrive.
+
+        Notifications with `methods` (all when `None`) are decoded and handed to `listener`. Returns
+        `False` as soon as the listener does, `True` otherwise.
+        """
+        backlog = self._backlog
+        for key, _ in self._selector.select(0 if backlog else timeout):
+            name, hub = key.data
+            try:
+                chunk = os.read(key.fd, _READ_CHUNK_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError:
+                chunk = b''
+            if not chunk:
+                # End of file or a read error: the hub hung up, and its port would stay readable forever
+                self.remove(name)
+                hub.pending.cancel_all()
+                continue
+            if hub.reader.feed(chunk):
+                backlog[name] = hub
+
+        keep_going = True
+        for name, hub in list(backlog.items()):
+            reader = hub.reader
+            frame = reader.pop()
+            while frame is not None:
+                if not self._dispatch(name, hub, frame, listener, methods):
+                    keep_going = False
+                    break
+                frame = reader.pop()
+            if not len(reader):
+                del backlog[name]
+            if not keep_going:
+                # Frames left behind are delivered by the next poll
+                break
+
+        for hub in self.hubs.values():
+            hub.pending.expire()
+        return keep_going
+
+    def _dispatch(self, name: str, hub: SpikeHub, frame: bytes, listener: Optional[FleetListener],
+                  methods: Optional[Collection]) -> bool:
+        msg = hub._run_frame_hooks(frame)
+        if msg is None:
+            method = ujsonrpc.peek_method(frame)
+            if method is None:
+                if not len(hub.pending):
+                    hub.skipped_frames += 1
+                    return True
+            elif method is not ujsonrpc.UNKNOWN_METHOD and (listener is None or
+                                                            (methods is not None and method not in methods)):
+                hub.skipped_frames += 1
+                return True
+
+            hub.parsed_frames += 1
+            try:
+                msg = ujsonrpc.decode(json.loads(frame))
+            except (ValueError, TypeError):
+                hub.decode_failures += 1
+                return True
+        elif listener is None or (methods is not None and msg.method not in methods):
+            # Parsed by the hub's notification hooks
+            hub.skipped_frames += 1
+            return True
+        if msg is None:
+            return True
+        if msg.is_response() or msg.is_error():
+            hub.pending.resolve(msg)
+            return True
+        if msg.is_notification() and listener is not None:
+            return listener(name, decode_notification(msg))
+        return True
+
+    def listen(self, listener: FleetListener, notification_type: Type = BaseNotification,
+               timeout: Optional[float] = None):
+        """
+        Calls `listener` with the hub name and every notification of `notification_type` until it
+        returns `False` or `timeout` seconds have passed.
+        """
+        methods = notification_methods(notification_type)
+
+        def typed_listener(name: str, notification: BaseNotification) -> bool:
+            if isinstance(notification, notification_type):
+                return listener(name, notification)
+            return True
+
+        deadline = monotonic() + timeout if timeout is not None else None
+        while True:
+            remaining = deadline - monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return
+            if not self.poll(remaining, typed_listener, methods):
+                return
+
+    def wait(self, *tasks: PendingRequest, timeout: Optional[float] = None):
+        """
+        Reads from every hub until all `tasks`, which may belong to different hubs, are done.
+
+        Raises `EmptyBuffer` if that takes longer than `timeout` seconds.
+        """
+        outstanding = 0
+
+        def task_done(_: PendingRequest):
+            nonlocal outstanding
+            outstanding -= 1
+
+        for task in tasks:
+            if not task.done:
+                outstanding += 1
+                task.add_done_callback(task_done)
+
+        deadline = monotonic() + timeout if timeout is not None else None
+        while outstanding > 0:
+            remaining = deadline - monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                raise EmptyBuffer()
+            self.poll(remaining)
+
+    def close(self):
+        for name in list(self.hubs):
+            self.remove(name).close()
+        self._selector.close()
+
+
+__all__ = [
+    'HubFleet'
+]
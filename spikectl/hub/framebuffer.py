@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+from time import monotonic, sleep
+from typing import Iterable, List, Optional, Union
+
+from spikectl import ujsonrpc
+from spikectl.model import ScratchDisplayClearRequest, ScratchDisplayImageRequest, ScratchDisplaySetPixelRequest
+
+from .pending import PendingRequest
+from .spike import Display, SpikeHub
+
+
+_SIZE = 5
+
+# Brightness levels of the image format, 0 to 9, as the percentages `display_set_pixel` expects
+_PERCENT = tuple(round(level * 100 / 9) for level in range(10))
+
+# Bytes each answer costs on the way back, on top of the request itself
+_RESPONSE_SIZE = len('{"i":"abcd","r":null}\r')
+
+
+def _wire_size(request: ujsonrpc.RPCRequest) -> int:
+    return len(ujsonrpc.encode(request)) + 1 + _RESPONSE_SIZE
+
+
+_CLEAR_COST = _wire_size(ScratchDisplayClearRequest('abcd'))
+_IMAGE_COST = _wire_size(ScratchDisplayImageRequest('99999\n99999\n99999\n99999\n99999', 'abcd'))
+_PIXEL_COST = _wire_size(ScratchDisplaySetPixelRequest(4, 4, 100, 'abcd'))
+
+
+class FrameBuffer(object):
+    """
+    The 5x5 display drawn locally and sent to the hub on `flush`.
+
+    The buffer remembers what the hub shows and sends whichever is cheapest on the serial link: nothing for
+    an unchanged frame, `display_clear` for a blank one, a `display_set_pixel` per changed pixel for small
+    changes or a single `display_image`. Pixels hold the image format's brightness levels, 0 to 9.
+
+    With `max_fps` set, a flush arriving sooner than `1 / max_fps` seconds after the last one sends nothing
+    and leaves the frame pending, so the next flush sends the latest frame; `flush(wait=True)` sleeps
+    until the frame can be sent instead.
+    """
+
+    __slots__ = ['display', 'max_fps', 'frames', 'skipped', 'requests', '_pixels', '_shown', '_next_frame']
+
+    def __init__(self, display: Union[Display, SpikeHub], max_fps: Optional[float] = 30.0):
+        assert max_fps is None or max_fps > 0, 'max_fps must be positive'
+        self.display = display if isinstance(display, Display) else display.display
+        self.max_fps = max_fps
+        # Frames sent, flushes held back by the frame rate cap and requests sent
+        self.frames = 0
+        self.skipped = 0
+        self.requests = 0
+        self._pixels = bytearray(_SIZE * _SIZE)
+        # What the hub shows, or None when unknown
+        self._shown: Optional[bytearray] = None
+        self._next_frame = 0.0
+
+    def set_pixel(self, x: int, y: int, level: int):
+        assert 0 <= x <= 4 and 0 <= y <= 4, 'x and y must be between 0 and 4'
+        assert 0 <= level <= 9, 'level must be between 0 and 9'
+        self._pixels[y * _SIZE + x] = level
+
+    def get_pixel(self, x: int, y: int) -> int:
+        assert 0 <= x <= 4 and 0 <= y <= 4, 'x and y must be between 0 and 4'
+        return self._pixels[y * _SIZE + x]
+
+    def fill(self, level: int = 0):
+        assert 0 <= level <= 9, 'level must be between 0 and 9'
+        self._pixels[:] = bytes((level,)) * (_SIZE * _SIZE)
+
+    def clear(self):
+        self.fill(0)
+
+    def set_image(self, image: Union[str, Iterable[Iterable[int]]]):
+        """
+        Draws an image given in the hub's format (`'09090\\n...'`) or as five rows of five levels.
+        """
+        if isinstance(image, str):
+            rows = [[int(c) for c in row] for row in image.replace(':', '\n').split('\n')]
+        else:
+            rows = [list(row) for row in image]
+        assert len(rows) == _SIZE and all(len(row) == _SIZE for row in rows), 'image must be 5x5'
+        self._pixels[:] = bytes(level for row in rows for level in row)
+
+    @property
+    def image(self) -> str:
+        pixels = self._pixels
+        return '\n'.join(''.join(str(level) for level in pixels[y * _SIZE:(y + 1) * _SIZE]) for y in range(_SIZE))
+
+    @property
+    def dirty(self) -> bool:
+        return self._shown != self._pixels
+
+    def invalidate(self):
+        """
+        Forgets what the hub shows, e.g. after text or an image was sent without the buffer.
+        """
+        self._shown = None
+
+    def flush(self, wait: bool = False) -> List[PendingRequest]:
+        """
+        Sends the frame if it differs from what the hub shows. Returns the requests sent, none when the
+        frame is unchanged or the frame rate cap held it back.
+        """
+        pixels = self._pixels
+        shown = self._shown
+        if shown == pixels:
+            return []
+
+        if self.max_fps is not None:
+            now = monotonic()
+            if now < self._next_frame:
+                if not wait:
+                    self.skipped += 1
+                    return []
+                sleep(self._next_frame - now)
+                now = self._next_frame
+            self._next_frame = now + 1.0 / self.max_fps
+
+        changed = [i for i in range(_SIZE * _SIZE) if shown[i] != pixels[i]] if shown is not None else None
+        blank = not any(pixels)
+        costs = [(_IMAGE_COST, 'image')]
+        if blank:
+            costs.append((_CLEAR_COST, 'clear'))
+        if changed is not None:
+            costs.append((len(changed) * _PIXEL_COST, 'pixels'))
+        _, strategy = min(costs)
+
+        display = self.display
+        if strategy == 'clear':
+            tasks = [display.clear()]
+        elif strategy == 'image':
+            tasks = [display.display_image(self.image, None)]
+        else:
+            tasks = [display.set_pixel(i % _SIZE, i // _SIZE, _PERCENT[pixels[i]]) for i in changed]
+
+        self._shown = bytearray(pixels)
+        self.frames += 1
+        self.requests += len(tasks)
+        for task in tasks:
+            task.add_done_callback(self._on_done)
+        return tasks
+
+    def _on_done(self, task: PendingRequest):
+        if task.error is not None:
+            # The hub may show anything now; the next flush repaints the whole frame
+            self._shown = None
+
+
+__all__ = [
+    'FrameBuffer'
+]
@@ -0,0 +1,91 @@
+from collections import deque
+from typing import Deque, Optional
+
+from serial import Serial
+
+
+_CR = b'\r'
+_MAX_CHUNK_SIZE = 64 * 1024
+
+
+class FrameReader(object):
+    """
+    Splits the hub's CR-terminated messages out of whatever the serial port has buffered.
+
+    Each read pulls everything pending in one call instead of one byte at a time, the way `read_until` does.
+    Partial messages are kept in a reusable `bytearray` until the rest of the line arrives, and complete
+    frames are returned as `bytes`, ready for `json.loads`.
+    """
+
+    __slots__ = ['connection', '_partial', '_frames']
+
+    def __init__(self, connection: Optional[Serial] = None):
+        self.connection = connection
+        self._partial = bytearray()
+        self._frames: Deque[bytes] = deque()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def feed(self, chunk: bytes) -> int:
+        """
+        Adds raw bytes to the reader, returning how many complete frames became available.
+        """
+        partial = self._partial
+        if partial:
+            partial += chunk
+            end = partial.rfind(_CR)
+            if end < 0:
+                return 0
+            with memoryview(partial) as view:
+                complete = bytes(view[:end])
+            del partial[:end + 1]
+        else:
+            end = chunk.rfind(_CR)
+            if end < 0:
+                partial += chunk
+                return 0
+            complete = chunk[:end]
+            if end + 1 < len(chunk):
+                with memoryview(chunk) as view:
+                    partial += view[end + 1:]
+
+        frames = self._frames
+        before = len(frames)
+        # Back to back terminators yield empty frames, which would read as a timeout
+        frames.extend(frame for frame in complete.split(_CR) if frame)
+        return len(frames) - before
+
+    def pop(self) -> Optional[bytes]:
+        return self._frames.popleft() if self._frames else None
+
+    def read_frame(self) -> bytes:
+        """
+        Returns the next frame, reading from the connection when none is buffered.
+
+        Like `Serial.read_until`, an empty result means the connection timed out.
+        """
+        frames = self._frames
+        connection = self.connection
+        while not frames:
+            waiting = connection.in_waiting
+            chunk = connection.read(min(waiting, _MAX_CHUNK_SIZE) if waiting > 0 else 1)
+            if not chunk:
+                return b''
+            if waiting == 0:
+                # Blocked for the first byte; take the rest of the burst along with it
+                waiting = connection.in_waiting
+                if waiting > 0:
+                    chunk += connection.read(min(waiting, _MAX_CHUNK_SIZE))
+            self.feed(chunk)
+
+        return frames.popleft()
+
+    def clear(self):
+        self._partial.clear()
+        self._frames.clear()
+
+
+__all__ = [
+    'FrameReader'
+]
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import os
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+
+from spikectl import ujsonrpc
+from spikectl.model import NotificationType
+
+from .pending import PendingRequest, RequestError, RequestTimeout
+from .serial import RawSerialHub
+
+
+# Each power of two of microseconds is split in 16 buckets, so a recorded latency is off by less than 1/16
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_HALF = _SUB_BUCKETS >> 1
+
+# Latencies above about 67 s land in the last bucket
+_MAX_MICROSECONDS = (1 << 26) - 1
+
+# Bucket bounds of the Prometheus histograms, in seconds
+PROMETHEUS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _bucket_index(microseconds: int) -> int:
+    if microseconds < _SUB_BUCKETS:
+        return microseconds
+    shift = microseconds.bit_length() - _SUB_BUCKET_BITS
+    return shift * _HALF + (microseconds >> shift)
+
+
+def _bucket_upper(index: int) -> int:
+    """
+    First microsecond past the bucket at `index`.
+    """
+    if index < _SUB_BUCKETS:
+        return index + 1
+    shift = index // _HALF - 1
+    return (index - shift * _HALF + 1) << shift
+
+
+_BUCKETS = _bucket_index(_MAX_MICROSECONDS) + 1
+
+
+class LatencyHistogram(object):
+    """
+    Latencies with a fixed relative precision, HDR histogram style: buckets are one microsecond wide up to
+    32 us, then each power of two is split in 16. Recording is an index computation and an increment.
+    """
+
+    __slots__ = ['counts', 'count', 'total', 'min', 'max']
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        # Seconds
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        microseconds = int(seconds * 1e6)
+        if microseconds > _MAX_MICROSECONDS:
+            microseconds = _MAX_MICROSECONDS
+        elif microseconds < 0:
+            microseconds = 0
+        self.counts[_bucket_index(microseconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Latency in seconds that `fraction` of the recorded ones do not exceed, up to the bucket precision.
+        """
+        if not self.count:
+            return float('nan')
+        rank = max(1, round(fraction * self.count))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.max, max(self.min, (_bucket_upper(index) - 1) / 1e6))
+        return self.max
+
+    def cumulative(self, bounds: tuple = PROMETHEUS_BUCKETS) -> List[int]:
+        """
+        Latencies at or under each bound, in seconds, counting a bucket once all of it is under the bound.
+        """
+        counts = self.counts
+        result = []
+        index = seen = 0
+        for bound in bounds:
+            limit = int(bound * 1e6)
+            while index < _BUCKETS and _bucket_upper(index) <= limit:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_s': self.mean,
+            'min_s': self.min if self.count else None,
+            'max_s': self.max if self.count else None,
+            'p50_s': self.percentile(0.5) if self.count else None,
+            'p90_s': self.percentile(0.9) if self.count else None,
+            'p99_s': self.percentile(0.99) if self.count else None
+        }
+
+
+class MethodMetrics(object):
+    """
+    Round trips of one request method: answers go in the histogram, failures in the counters.
+    """
+
+    __slots__ = ['sent', 'errors', 'timeouts', 'cancelled', 'latency']
+
+    def __init__(self):
+        self.sent = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.latency = LatencyHistogram()
+
+    def as_dict(self) -> dict:
+        return {
+            'sent': self.sent,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled,
+            'latency': self.latency.as_dict()
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class HubMetrics(object):
+    """
+    Request round trips per method and traffic counters of one hub.
+
+    A request is timed from when it is handed to the port, or to the writer thread when one runs, until its
+    answer is read; hub errors count as answers. Frames and bytes read are counted as they come off the port,
+    and so are notifications whose method no `NotificationType` knows.
+    """
+
+    __slots__ = ['hub', 'methods', 'read_frames', 'read_bytes', 'unknown_notifications', 'started',
+                 '_lock', '_remove_hook']
+
+    def __init__(self, hub: RawSerialHub):
+        self.hub = hub
+        self.methods: Dict[str, MethodMetrics] = {}
+        self.read_frames = 0
+        self.read_bytes = 0
+        self.unknown_notifications = 0
+        self.started = monotonic()
+        self._lock = Lock()
+        self._remove_hook: Optional[Callable[[], None]] = hub.add_frame_hook(self._on_frame)
+
+    def _on_frame(self, frame: bytes):
+        self.read_frames += 1
+        # Frames come without their terminator
+        self.read_bytes += len(frame) + 1
+        method = ujsonrpc.peek_method(frame)
+        if method is not None and method is not ujsonrpc.UNKNOWN_METHOD and NotificationType.value_of(method) is None:
+            self.unknown_notifications += 1
+
+    def track(self, task: PendingRequest):
+        """
+        Times `task` from now until it is answered.
+        """
+        method = task.request.method
+        metrics = self.methods.get(method)
+        if metrics is None:
+            with self._lock:
+                metrics = self.methods.setdefault(method, MethodMetrics())
+        metrics.sent += 1
+        sent = monotonic()
+
+        def done(finished: PendingRequest):
+            error = finished.error
+            if error is None or isinstance(error, RequestError):
+                metrics.latency.record(monotonic() - sent)
+                if error is not None:
+                    metrics.errors += 1
+            elif isinstance(error, RequestTimeout):
+                metrics.timeouts += 1
+            else:
+                metrics.cancelled += 1
+
+        task.add_done_callback(done)
+
+    def snapshot(self) -> dict:
+        hub = self.hub
+        elapsed = monotonic() - self.started
+        with self._lock:
+            methods = {method: metrics.as_dict() for method, metrics in self.methods.items()}
+        return {
+            'uptime_s': elapsed,
+            'written_bytes': hub.written_bytes,
+            'read_bytes': self.read_bytes,
+            'read_frames': self.read_frames,
+            'frames_per_second': self.read_frames / elapsed if elapsed > 0 else 0.0,
+            'decode_failures': hub.decode_failures,
+            'hook_failures': hub.hook_failures,
+            'unknown_notifications': self.unknown_notifications,
+            'methods': methods
+        }
+
+    def prometheus(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format, labelled with the hub's port.
+        """
+        hub = self.hub
+        port = f'port="{_escape(str(hub.connection.port))}"'
+        elapsed = monotonic() - self.started
+        with self._lock:
+            methods = sorted(self.methods.items())
+
+        lines = []
+
+        def metric(name: str, kind: str, text: str, samples: List[str]):
+            lines.append(f'# HELP spikectl_{name} {text}')
+            lines.append(f'# TYPE spikectl_{name} {kind}')
+            lines.extend(samples)
+
+        metric('written_bytes_total', 'counter', 'Bytes written to the hub.',
+               [f'spikectl_written_bytes_total{{{port}}} {hub.written_bytes}'])
+        metric('read_bytes_total', 'counter', 'Bytes read from the hub.',
+               [f'spikectl_read_bytes_total{{{port}}} {self.read_bytes}'])
+        metric('read_frames_total', 'counter', 'Frames read from the hub.',
+               [f'spikectl_read_frames_total{{{port}}} {self.read_frames}'])
+        metric('frames_per_second', 'gauge', 'Frames read per second since the metrics started.',
+               [f'spikectl_frames_per_second{{{port}}} {self.read_frames / elapsed if elapsed > 0 else 0.0}'])
+        metric('decode_failures_total', 'counter', 'Frames that were not valid JSON.',
+               [f'spikectl_decode_failures_total{{{port}}} {hub.decode_failures}'])
+        metric('hook_failures_total', 'counter', 'Hook calls that raised an exception.',
+               [f'spikectl_hook_failures_total{{{port}}} {hub.hook_failures}'])
+        metric('unknown_notifications_total', 'counter', 'Notifications of an unknown method.',
+               [f'spikectl_unknown_notifications_total{{{port}}} {self.unknown_notifications}'])
+
+        for name, attribute, text in (('requests_total', 'sent', 'Requests sent.'),
+                                      ('request_errors_total', 'errors', 'Requests the hub answered with an error.'),
+                                      ('request_timeouts_total', 'timeouts', 'Requests that timed out.'),
+                                      ('requests_cancelled_total', 'cancelled', 'Requests cancelled.')):
+            metric(name, 'counter', text, [
+                f'spikectl_{name}{{{port},method="{_escape(method)}"}} {getattr(metrics, attribute)}'
+                for method, metrics in methods
+            ])
+
+        samples = []
+        for method, metrics in methods:
+            labels = f'{port},method="{_escape(method)}"'
+            latency = metrics.latency
+            for bound, count in zip(PROMETHEUS_BUCKETS, latency.cumulative()):
+                samples.append(f'spikectl_request_latency_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            samples.append(f'spikectl_request_latency_seconds_bucket{{{labels},le="+Inf"}} {latency.count}')
+            samples.append(f'spikectl_request_latency_seconds_sum{{{labels}}} {latency.total}')
+            samples.append(f'spikectl_request_latency_seconds_count{{{labels}}} {latency.count}')
+        metric('request_latency_seconds', 'histogram', 'Time until the hub answered a request.', samples)
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """
+        Writes `prometheus()` to `path`, replacing the file at once so a collector never reads half of it.
+        """
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(self.prometheus())
+        os.replace(temporary, path)
+
+    def close(self):
+        remove_hook = self._remove_hook
+        self._remove_hook = None
+        if remove_hook is not None:
+            remove_hook()
+
+
+__all__ = [
+    'PROMETHEUS_BUCKETS',
+    'LatencyHistogram',
+    'MethodMetrics',
+    'HubMetrics'
+]
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+from heapq import heappop, heappush
+from itertools import count
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from spikectl import ujsonrpc
+
+
+class SpikeHubException(Exception): pass
+
+
+class RequestError(SpikeHubException):
+
+    def __init__(self, error: ujsonrpc.RPCError):
+        super().__init__(f'request {error.id} failed: {error.exception}')
+        self.error = error
+
+
+class RequestTimeout(SpikeHubException):
+
+    def __init__(self, request: ujsonrpc.RPCRequest):
+        super().__init__(f'request {request.id} ({request.method}) timed out')
+        self.request = request
+
+
+class RequestCancelled(SpikeHubException): pass
+
+
+_PENDING = 0
+_RESOLVED = 1
+_FAILED = 2
+_CANCELLED = 3
+
+
+class PendingRequest(object):
+    """
+    Handle for a request sent to the hub and not yet answered.
+    """
+
+    __slots__ = ['request', 'deadline', 'response', 'error', '_state', '_callbacks', '_registry']
+
+    def __init__(self, request: ujsonrpc.RPCRequest, deadline: Optional[float], registry: PendingRequests):
+        self.request = request
+        self.deadline = deadline
+        self.response: Optional[ujsonrpc.RPCResponse] = None
+        self.error: Optional[SpikeHubException] = None
+        self._state = _PENDING
+        self._callbacks: Optional[List[Callable[[PendingRequest], None]]] = None
+        self._registry = registry
+
+    @property
+    def id(self) -> str:
+        return self.request.id
+
+    @property
+    def done(self) -> bool:
+        return self._state != _PENDING
+
+    @property
+    def cancelled(self) -> bool:
+        return self._state == _CANCELLED
+
+    def result(self) -> any:
+        if self._state == _PENDING:
+            raise SpikeHubException(f'request {self.request.id} is still pending')
+        if self.error is not None:
+            raise self.error
+        return self.response.result
+
+    def add_done_callback(self, callback: Callable[[PendingRequest], None]):
+        if self._state != _PENDING:
+            callback(self)
+        elif self._callbacks is None:
+            self._callbacks = [callback]
+        else:
+            self._callbacks.append(callback)
+
+    def cancel(self) -> bool:
+        return self._registry.cancel(self)
+
+    def _complete(self, state: int):
+        self._state = state
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        callbacks = self._callbacks
+        if callbacks is not None:
+            self._callbacks = None
+            for callback in callbacks:
+                callback(self)
+
+    def __str__(self):
+        state = ('pending', 'resolved', 'failed', 'cancelled')[self._state]
+        return f'PendingRequest [id: {self.request.id}, method: {self.request.method}, state: {state}]'
+
+
+class PendingRequests(object):
+    """
+    Requests awaiting a response, keyed by request id.
+
+    Responses and errors are matched with a single dictionary lookup, and deadlines are kept in a heap so
+    checking for timeouts costs nothing while none has expired. A request registered with the id of one
+    still pending is given a new id, as ids are short random strings.
+    """
+
+    __slots__ = ['_pending', '_deadlines', '_sequence', '_lock']
+
+    def __init__(self):
+        self._pending: Dict[str, PendingRequest] = {}
+        self._deadlines: List[Tuple[float, int, PendingRequest]] = []
+        self._sequence = count()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, idx: str) -> bool:
+        return idx in self._pending
+
+    def register(self, request: ujsonrpc.RPCRequest, timeout: Optional[float] = None) -> PendingRequest:
+        deadline = monotonic() + timeout if timeout is not None else None
+        pending = PendingRequest(request, deadline, self)
+        with self._lock:
+            while request.id in self._pending:
+                request.id = ujsonrpc.gen_idx()
+            self._pending[request.id] = pending
+            if deadline is not None:
+                heappush(self._deadlines, (deadline, next(self._sequence), pending))
+        return pending
+
+    def resolve(self, msg: ujsonrpc.RPCBaseMessage) -> Optional[PendingRequest]:
+        with self._lock:
+            pending = self._pending.pop(msg.id, None)
+        if pending is None:
+            return None
+        if msg.is_error():
+            pending.error = RequestError(msg)
+            pending._complete(_FAILED)
+        else:
+            pending.response = msg
+            pending._complete(_RESOLVED)
+        return pending
+
+    def _remove(self, pending: PendingRequest) -> bool:
+        # An answered request's id may have been given to a newer one since
+        idx = pending.request.id
+        if self._pending.get(idx) is not pending:
+            return False
+        del self._pending[idx]
+        return True
+
+    def cancel(self, pending: PendingRequest) -> bool:
+        with self._lock:
+            if not self._remove(pending):
+                return False
+        pending.error = RequestCancelled(f'request {pending.request.id} was cancelled')
+        pending._complete(_CANCELLED)
+        return True
+
+    def expire(self, now: Optional[float] = None) -> List[PendingRequest]:
+        deadlines = self._deadlines
+        if not deadlines:
+            return []
+        if now is None:
+            now = monotonic()
+        if deadlines[0][0] > now:
+            return []
+
+        expired = []
+        with self._lock:
+            while deadlines and deadlines[0][0] <= now:
+                _, _, pending = heappop(deadlines)
+                if self._remove(pending):
+                    expired.append(pending)
+        for pending in expired:
+            pending.error = RequestTimeout(pending.request)
+            pending._complete(_FAILED)
+        return expired
+
+    def cancel_many(self, tasks: Iterable[PendingRequest]):
+        """
+        Cancels `tasks` together: all of them are done before any callback runs, so a callback, e.g. the
+        request window's, cannot send one of the others.
+        """
+        with self._lock:
+            cancelled = [task for task in tasks if self._remove(task)]
+        self._cancel(cancelled)
+
+    def cancel_all(self):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._deadlines.clear()
+        self._cancel(pending)
+
+    @staticmethod
+    def _cancel(cancelled: List[PendingRequest]):
+        for p in cancelled:
+            p.error = RequestCancelled(f'request {p.request.id} was cancelled')
+            p._state = _CANCELLED
+        for p in cancelled:
+            p._run_callbacks()
+
+
+__all__ = [
+    'SpikeHubException',
+    'RequestError',
+    'RequestTimeout',
+    'RequestCancelled',
+    'PendingRequest',
+    'PendingRequests'
+]
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from enum import IntEnum
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Condition
+from time import monotonic
+from typing import Any, Collection, Dict, FrozenSet, List, Optional, Tuple
+
+from spikectl import ujsonrpc
+
+
+class Priority(IntEnum):
+    Urgent = 0
+    Normal = 1
+    Background = 2
+
+
+# Requests that must reach the hub before anything else waiting to be written
+URGENT_METHODS = frozenset([
+    'scratch.motor_stop',
+    'program_terminate'
+])
+
+# Requests that only change what the hub shows or reports, and can wait behind motion commands
+BACKGROUND_METHODS = frozenset([
+    'scratch.display_set_pixel',
+    'scratch.display_image',
+    'scratch.display_image_for',
+    'scratch.display_text',
+    'scratch.display_clear',
+    'scratch.center_button_lights',
+    'trigger_current_state'
+])
+
+
+_ALL_PORTS = frozenset('ABCDEF')
+
+# Requests that stop the motors on every port
+_ALL_PORT_METHODS = frozenset([
+    'program_terminate'
+])
+
+
+def ports_of(request: ujsonrpc.RPCRequest) -> FrozenSet[str]:
+    """
+    Ports whose motor or sensor `request` drives.
+    """
+    if request.method in _ALL_PORT_METHODS:
+        return _ALL_PORTS
+    parameters = request.parameters
+    port = parameters.get('port') if isinstance(parameters, dict) else None
+    return frozenset((port,)) if port is not None else frozenset()
+
+
+def priority_of(request: ujsonrpc.RPCRequest) -> Priority:
+    method = request.method
+    if method in URGENT_METHODS:
+        return Priority.Urgent
+    if method in BACKGROUND_METHODS:
+        return Priority.Background
+    return Priority.Normal
+
+
+class QueueStats(object):
+    """
+    How long writes of one priority waited before reaching the port, in seconds.
+    """
+
+    __slots__ = ['count', 'total', 'max']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, waited: float):
+        self.count += 1
+        self.total += waited
+        if waited > self.max:
+            self.max = waited
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self) -> dict:
+        return {'count': self.count, 'mean_s': self.mean, 'max_s': self.max}
+
+    def __str__(self):
+        return f'QueueStats [count: {self.count}, mean: {self.mean * 1e6:.0f}us, max: {self.max * 1e6:.0f}us]'
+
+
+class SendQueue(object):
+    """
+    Outbound writes ordered by priority, then by the order they were queued in.
+
+    An urgent write first promotes the writes queued for any of its ports to urgent, so it overtakes
+    everything but the requests for those ports, which keep their order: a stop queued after a start for the
+    same motor is still written after it.
+    """
+
+    __slots__ = ['_heap', '_sequence', '_condition', '_closed', 'high_watermark', 'stats']
+
+    def __init__(self):
+        self._heap: List[Tuple[int, int, float, bytes, FrozenSet[str], Any]] = []
+        self._sequence = count()
+        self._condition = Condition()
+        self._closed = False
+        self.high_watermark = 0
+        self.stats: Dict[Priority, QueueStats] = {priority: QueueStats() for priority in Priority}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def put(self, data: bytes, priority: Priority = Priority.Normal, ports: Collection[str] = (),
+            tag: Any = None) -> bool:
+        """
+        Queues `data`, the requests for `ports`; returns `False` once closed. `tag` marks the write for
+        `discard`.
+        """
+        ports = frozenset(ports)
+        with self._condition:
+            if self._closed:
+                return False
+            if priority == Priority.Urgent and ports:
+                self._promote(ports)
+            heappush(self._heap, (priority, next(self._sequence), monotonic(), data, ports, tag))
+            if len(self._heap) > self.high_watermark:
+                self.high_watermark = len(self._heap)
+            self._condition.notify()
+        return True
+
+    def _promote(self, ports: FrozenSet[str]):
+        heap = self._heap
+        promoted = False
+        for i, entry in enumerate(heap):
+            if entry[0] != Priority.Urgent and not ports.isdisjoint(entry[4]):
+                heap[i] = (Priority.Urgent,) + entry[1:]
+                promoted = True
+        if promoted:
+            heapify(heap)
+
+    def get(self, not_before: float = 0.0) -> Optional[Tuple[Priority, bytes]]:
+        """
+        Takes the most urgent write, waiting for one; returns `None` once closed and empty.
+
+        Writes other than urgent ones are held until the monotonic time `not_before`, and an urgent write
+        queued in the meantime is returned first.
+        """
+        with self._condition:
+            while True:
+                if not self._heap:
+                    if self._closed:
+                        return None
+                    self._condition.wait()
+                    continue
+                delay = not_before - monotonic()
+                if self._heap[0][0] == Priority.Urgent or delay <= 0:
+                    break
+                self._condition.wait(delay)
+            priority, _, queued, data, _, _ = heappop(self._heap)
+            self.stats[priority].add(monotonic() - queued)
+        return Priority(priority), data
+
+    def discard(self, tag: Any) -> int:
+        """
+        Drops the queued writes marked with `tag`, returning how many there were.
+        """
+        with self._condition:
+            heap = self._heap
+            kept = [entry for entry in heap if entry[5] is not tag]
+            discarded = len(heap) - len(kept)
+            if discarded:
+                heapify(kept)
+                self._heap = kept
+        return discarded
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+__all__ = [
+    'Priority',
+    'URGENT_METHODS',
+    'BACKGROUND_METHODS',
+    'ports_of',
+    'priority_of',
+    'QueueStats',
+    'SendQueue'
+]
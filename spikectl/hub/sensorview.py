@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+from spikectl.model import SensorType
+
+
+_PORT_INDEX = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4, 'F': 5}
+
+
+def _port_index(port: str) -> int:
+    assert port in _PORT_INDEX, 'port must be a letter between A and F'
+    return _PORT_INDEX[port]
+
+
+class SensorRecord(object):
+    """
+    The latest sensor frame, overwritten in place by every frame instead of building a `SensorNotification`
+    and its port objects.
+
+    Fields refer to the values the frame was parsed into; nothing is copied, converted or counted, so writing
+    a frame allocates nothing. Those lists are never changed afterwards, so a record can be copied by reference.
+    """
+
+    __slots__ = ['ports', 'accelerometer', 'gyroscope', 'position', 'leds', 'time', 'timestamp']
+
+    def __init__(self):
+        # [device type, raw values] of each port, A to F
+        self.ports: List[Optional[list]] = [None] * 6
+        self.accelerometer: Optional[list] = None
+        self.gyroscope: Optional[list] = None
+        self.position: Optional[list] = None
+        self.leds: Optional[str] = None
+        self.time = 0
+        # Monotonic host time the frame was read at
+        self.timestamp = 0.0
+
+    def write(self, parameters: list, timestamp: float):
+        """
+        Overwrites the record with the raw parameters of a sensor notification.
+        """
+        ports = self.ports
+        if len(parameters) != 11:
+            # Fields a newer firmware may append are ignored; only then is the frame copied
+            parameters = parameters[:11]
+        # Unpacked in SensorDataIndex order
+        ports[0], ports[1], ports[2], ports[3], ports[4], ports[5], self.accelerometer, self.gyroscope, \
+            self.position, self.leds, self.time = parameters
+        self.timestamp = timestamp
+
+    def copy(self) -> SensorRecord:
+        record = SensorRecord()
+        record.ports[:] = self.ports
+        record.accelerometer = self.accelerometer
+        record.gyroscope = self.gyroscope
+        record.position = self.position
+        record.leds = self.leds
+        record.time = self.time
+        record.timestamp = self.timestamp
+        return record
+
+
+class SensorView(object):
+    """
+    Read-only view of the frame in a `SensorRecord`.
+
+    The record is overwritten by the next frame, so a view handed to a listener is only valid during the
+    call; `copy()` it to keep it. Accessors return single values taken from the record, so reading a frame
+    allocates nothing. Values are the raw ones, e.g. a motor's speed, position, absolute position and power,
+    in the order of `TelemetryRecorder`'s `MOTOR_*` indices.
+    """
+
+    __slots__ = ['_record']
+
+    def __init__(self, record: SensorRecord):
+        self._record = record
+
+    @property
+    def time(self) -> int:
+        return self._record.time
+
+    @property
+    def timestamp(self) -> float:
+        return self._record.timestamp
+
+    def accelerometer(self, axis: int) -> int:
+        return self._record.accelerometer[axis]
+
+    def gyroscope(self, axis: int) -> int:
+        return self._record.gyroscope[axis]
+
+    def position(self, axis: int) -> int:
+        """
+        Yaw (0), pitch (1) or roll (2) of the hub.
+        """
+        return self._record.position[axis]
+
+    @property
+    def leds(self) -> Optional[str]:
+        return self._record.leds
+
+    def port_type(self, port: str) -> int:
+        """
+        Device type id of what is connected to `port`, 0 when nothing is.
+        """
+        return self._record.ports[_port_index(port)][0]
+
+    def sensor_type(self, port: str) -> Optional[SensorType]:
+        return SensorType.value_of(self.port_type(port))
+
+    def connected(self, port: str) -> bool:
+        return self._record.ports[_port_index(port)][0] != 0
+
+    def value_count(self, port: str) -> int:
+        """
+        How many raw values the device on `port` reports.
+        """
+        return len(self._record.ports[_port_index(port)][1])
+
+    def port_value(self, port: str, index: int) -> any:
+        """
+        Raw value `index` of `port`, e.g. `MOTOR_POSITION`, or `None` when the device does not report it.
+        """
+        values = self._record.ports[_port_index(port)][1]
+        return values[index] if index < len(values) else None
+
+    def copy(self) -> SensorView:
+        """
+        A view of its own copy of the frame, which later frames leave alone.
+        """
+        return SensorView(self._record.copy())
+
+    def __str__(self):
+        record = self._record
+        ports = ', '.join(f'{port}: {record.ports[i][0]} {record.ports[i][1]}' for port, i in _PORT_INDEX.items())
+        return f'SensorView [time: {record.time}, accelerometer: {record.accelerometer}, ' \
+               f'gyroscope: {record.gyroscope}, position: {record.position}, {ports}]'
+
+
+__all__ = [
+    'SensorRecord',
+    'SensorView'
+]
@@ -1,12 +1,21 @@
-from typing import Callable, Optional
+from __future__ import annotations
+
+from typing import Callable, Collection, FrozenSet, List, Optional, Tuple
 import json
-from time import time
+import logging
+from threading import Lock, Thread, get_ident
+from time import monotonic, time
 
 from serial import Serial
-from serial.serialutil import CR
+from serial.serialutil import SerialException as PortException
 
 from spikectl import ujsonrpc
 
+from .buffer import FrameRing, OverflowPolicy
+from .framing import FrameReader
+from .sendqueue import Priority, SendQueue, ports_of, priority_of
+from .trace import Tracer
+
 
 class SerialException(Exception): pass
 
@@ -14,37 +23,398 @@ class SerialException(Exception): pass
 class EmptyBuffer(SerialException): pass
 
 
+# Initial size of the buffer batched requests are encoded into; it grows if a batch needs more
+_BATCH_BUFFER_SIZE = 4096
+
+# Returned by `_parse_frame` for frames that are dropped
+_SKIPPED = object()
+
+_log = logging.getLogger(__name__)
+
+
+class WriteBatch(object):
+    """
+    Collects the requests sent by the thread that opened the batch and writes them to the port in a
+    single write when the batch closes, so they reach the hub back to back.
+
+    `tasks` holds the pending handles of the requests sent through a `SpikeHub`. If the block raises,
+    nothing is written and those requests are cancelled.
+    """
+
+    __slots__ = ['hub', 'requests', 'tasks', 'size', 'priority', 'ports', '_owner']
+
+    def __init__(self, hub: RawSerialHub):
+        self.hub = hub
+        self.requests: List[ujsonrpc.RPCRequest] = []
+        self.tasks = []
+        # Bytes encoded so far
+        self.size = 0
+        # The batch is written with the priority of its most urgent request
+        self.priority = Priority.Background
+        # Ports driven by the requests in the batch
+        self.ports = set()
+        self._owner: Optional[int] = None
+
+    def __enter__(self) -> WriteBatch:
+        hub = self.hub
+        assert hub._batch is None, 'a batch is already open on this hub'
+        self._owner = get_ident()
+        hub._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        hub = self.hub
+        hub._batch = None
+        if exc_type is not None:
+            if self.tasks:
+                # Together, so a window freed by one cannot send another
+                hub.pending.cancel_many(self.tasks)
+            return
+        if self.size:
+            hub._write(bytes(memoryview(hub._batch_buffer)[:self.size]), self.priority, self.ports)
+
+    def _add(self, message: ujsonrpc.RPCRequest, encoded: bytes, priority: Priority, ports: FrozenSet[str]):
+        # The buffer is allocated once per hub and reused by every batch
+        buffer = self.hub._batch_buffer
+        start = self.size
+        end = start + len(encoded)
+        if end > len(buffer):
+            buffer.extend(bytes(max(end - len(buffer), len(buffer))))
+        buffer[start:end] = encoded
+        self.size = end
+        self.requests.append(message)
+        self.ports.update(ports)
+        if priority < self.priority:
+            self.priority = priority
+
+    def __iter__(self):
+        return iter(self.tasks)
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def _collects(self) -> bool:
+        return self._owner == get_ident()
+
+
 class RawSerialHub(object):
 
-    __slots__ = ['connection']
+    __slots__ = ['connection', 'reader', 'ring', 'frame_hooks', 'parsed_frames', 'skipped_frames',
+                 'decode_failures', 'hook_failures', 'written_bytes', 'tracer', 'send_queue', '_reader_thread', '_reader_error', '_batch', '_batch_buffer', '_writer_thread',
+                 '_writer_error', '_write_lock']
 
     def __init__(self, connection: Serial):
         self.connection = connection
+        self.reader = FrameReader(connection)
+        self.ring: Optional[FrameRing] = None
+        # See every frame as it comes off the port, on the thread reading it
+        self.frame_hooks: Tuple[Callable[[bytes], None], ...] = ()
+        self.parsed_frames = 0
+        self.skipped_frames = 0
+        # Frames that were not valid JSON, hook calls that raised, and bytes handed to the port or the writer
+        self.decode_failures = 0
+        self.hook_failures = 0
+        self.written_bytes = 0
+        self.tracer: Optional[Tracer] = None
+        self._reader_thread: Optional[Thread] = None
+        self._reader_error: Optional[Exception] = None
+        self._batch: Optional[WriteBatch] = None
+        self._batch_buffer = bytearray(_BATCH_BUFFER_SIZE)
+        self.send_queue: Optional[SendQueue] = None
+        self._writer_thread: Optional[Thread] = None
+        self._writer_error: Optional[Exception] = None
+        self._write_lock = Lock()
         connection.flushInput()
         # Discard first message
-        connection.read_until(expected=CR)
+        self.reader.read_frame()
+
+    def start_reader(self, capacity: int = 256, overflow: OverflowPolicy = OverflowPolicy.DropOldest):
+        """
+        Drains the serial port on a dedicated thread into a bounded ring of frames.
+
+        While the reader is running, `listen` consumes frames from the ring, so slow listeners
+        no longer stall the port; what happens when they fall too far behind is decided by `overflow`.
+        """
+        assert self._reader_thread is None, 'reader already started'
+        self.ring = FrameRing(capacity, overflow)
+        self._reader_error = None
+        self._reader_thread = Thread(target=self._read_loop, name=f'spikectl-reader-{self.connection.port}', daemon=True)
+        self._reader_thread.start()
+
+    def stop_reader(self):
+        """
+        Stops the reader thread. Frames already in the ring are still delivered before `listen` goes
+        back to reading the port directly.
+        """
+        reader = self._reader_thread
+        if reader is None:
+            return
+        self._reader_thread = None
+        # Wakes the reader if it waits for room in a full ring, which only a consumer would make
+        self.ring.stop()
+        cancel_read = getattr(self.connection, 'cancel_read', None)
+        if cancel_read is not None:
+            cancel_read()
+        reader.join()
+
+    def start_writer(self, max_rate: Optional[float] = None):
+        """
+        Writes to the serial port from a dedicated thread, taking requests from a priority queue.
+
+        Requests are written by priority and then in the order they were sent (see `sendqueue.priority_of`),
+        so stops and `program_terminate` overtake everything still queued except earlier requests for the
+        ports they stop, which go out just before them. `max_rate` paces writes to that many bytes per second,
+        which keeps the backlog in the queue, where urgent requests can overtake it, rather than in operating
+        system buffers, where they cannot; urgent requests are never held back by it. `send_queue` reports the
+        queue depth and how long writes of each priority waited.
+        """
+        assert self._writer_thread is None, 'writer already started'
+        assert max_rate is None or max_rate > 0, 'max_rate must be a positive number of bytes per second'
+        self.send_queue = SendQueue()
+        self._writer_error = None
+        self._writer_thread = Thread(target=self._write_loop, args=(max_rate,),
+                                     name=f'spikectl-writer-{self.connection.port}', daemon=True)
+        self._writer_thread.start()
 
-    def listen(self, listener: Callable[[ujsonrpc.RPCBaseMessage], bool], timeout: Optional[float] = None):
+    def stop_writer(self):
+        """
+        Stops the writer thread once everything already queued is written.
+        """
+        writer = self._writer_thread
+        if writer is None:
+            return
+        self.send_queue.close()
+        writer.join()
+        self._writer_thread = None
+
+    def _write_loop(self, max_rate: Optional[float]):
+        queue = self.send_queue
+        # When the link will have taken everything written so far, at `max_rate`
+        link_free = 0.0
+        try:
+            while True:
+                item = queue.get(link_free)
+                if item is None:
+                    return
+                _, data = item
+                with self._write_lock:
+                    self.connection.write(data)
+                if max_rate is not None:
+                    link_free = max(link_free, monotonic()) + len(data) / max_rate
+        except (PortException, OSError, TypeError) as err:
+            self._writer_error = err
+            queue.close()
+
+    def enable_tracing(self, capacity: int = 65536) -> Tracer:
+        """
+        Starts recording sends, requests until answered, waits, listener calls and notifications; see `Tracer`.
+        """
+        if self.tracer is None:
+            self.tracer = Tracer(capacity)
+            self.add_frame_hook(self.tracer.on_frame)
+        return self.tracer
+
+    def disable_tracing(self) -> Optional[Tracer]:
+        """
+        Stops recording and returns the tracer, to export what it recorded.
+        """
+        tracer = self.tracer
+        self.tracer = None
+        if tracer is not None:
+            self.frame_hooks = tuple(hook for hook in self.frame_hooks if hook != tracer.on_frame)
+        return tracer
+
+    def add_frame_hook(self, hook: Callable[[bytes], None]) -> Callable[[], None]:
+        """
+        Calls `hook` with every raw frame as soon as it is read, before any listener sees it.
+
+        An exception raised by a hook is logged and counted in `hook_failures`; the frame still reaches the
+        other hooks and the listeners.
+        """
+        # Replaced rather than mutated, so the reader thread can iterate without locking
+        self.frame_hooks = self.frame_hooks + (hook,)
+
+        def remove_hook():
+            self.frame_hooks = tuple(h for h in self.frame_hooks if h is not hook)
+
+        return remove_hook
+
+    def _run_frame_hooks(self, buffer: bytes) -> Optional[ujsonrpc.RPCBaseMessage]:
+        """
+        Runs the frame hooks on `buffer`; returns the message it was parsed into on the way, if any, so that
+        listeners need not parse it again.
+        """
+        for hook in self.frame_hooks:
+            try:
+                hook(buffer)
+            except Exception:
+                # Hooks run on the reader thread, which must outlive a bug in one of them
+                self._hook_failed(hook)
+        return None
+
+    def _hook_failed(self, hook: Callable):
+        self.hook_failures += 1
+        _log.exception('hook %r failed on %s', hook, self.connection.port)
+
+    @property
+    def dropped_frames(self) -> int:
+        return self.ring.dropped if self.ring is not None else 0
+
+    def _read_loop(self):
+        ring = self.ring
+        try:
+            while self._reader_thread is not None:
+                started = monotonic()
+                buffer = self.reader.read_frame()
+                if not buffer:
+                    if self._hung_up(started) and self._reader_thread is not None:
+                        raise SerialException('serial port hung up')
+                    continue
+                msg = self._run_frame_hooks(buffer)
+                # The ring holds the message instead when the hooks parsed it already
+                if not ring.put(buffer if msg is None else msg):
+                    return
+        except (PortException, OSError, TypeError, SerialException) as err:
+            # Closing the port under a blocked read surfaces as any of these
+            if self._reader_thread is not None:
+                self._reader_error = err
+        finally:
+            ring.close()
+
+    def _hung_up(self, started: float) -> bool:
+        """
+        Whether a read of the port started at `started` that returned nothing found the end of the stream,
+        e.g. the hub was unplugged or a replay ended, rather than the port's timeout.
+        """
+        timeout = self.connection.timeout
+        if timeout == 0:
+            # A non-blocking read cannot tell
+            return False
+        return timeout is None or monotonic() - started < timeout / 2
+
+    def _read_frame(self, fail_at_eof: bool = False) -> any:
+        """
+        The next frame, or the message the frame hooks parsed it into; empty when none was read in time.
+
+        When `fail_at_eof`, raises `SerialException` once the port has hung up rather than returning empty
+        straight away, over and over.
+        """
+        if self.ring is None or (self._reader_thread is None and not self.ring):
+            started = monotonic()
+            buffer = self.reader.read_frame()
+            if buffer:
+                msg = self._run_frame_hooks(buffer)
+                if msg is not None:
+                    return msg
+            elif fail_at_eof and self._hung_up(started):
+                raise SerialException('serial port hung up')
+            return buffer
+
+        buffer = self.ring.get(self.connection.timeout)
+        if buffer is None and self._reader_error is not None:
+            raise SerialException(f'reader stopped: {self._reader_error}') from self._reader_error
+        return buffer
+
+    def listen(self, listener: Callable[[ujsonrpc.RPCBaseMessage], bool], timeout: Optional[float] = None,
+               accept: Optional[Callable[[any], bool]] = None):
+        """
+        Calls `listener` with every message until it returns `False`.
+
+        When `accept` is given, it is called with the method peeked from each raw frame (`None` for responses
+        and errors), and frames it rejects are dropped without being parsed.
+        """
 
         deadline = time() + timeout if timeout is not None else float('inf')
 
         while time() < deadline:
-            buffer = self.connection.read_until(expected=CR)
+            buffer = self._read_frame()
             if not buffer:
                 raise EmptyBuffer()
-            json_str = str(buffer, 'utf-8')
-            try:                        
-                json_obj = json.loads(json_str)
-            except json.decoder.JSONDecodeError:
+            msg = self._parse_frame(buffer, accept)
+            if msg is _SKIPPED:
                 continue
-            msg = ujsonrpc.decode(json_obj)            
             if not listener(msg):
                 return
 
-    def send(self, message: ujsonrpc.RPCRequest):        
+    def _parse_frame(self, buffer: any, accept: Optional[Callable[[any], bool]] = None) -> any:
+        """
+        The message in `buffer`, or `_SKIPPED` when `accept` rejects it or it is not JSON. `buffer` may be a
+        message `_read_frame` got already parsed.
+        """
+        if isinstance(buffer, ujsonrpc.RPCBaseMessage):
+            if accept is not None and not accept(getattr(buffer, 'method', None)):
+                self.skipped_frames += 1
+                return _SKIPPED
+            return buffer
+        if accept is not None:
+            method = ujsonrpc.peek_method(buffer)
+            if method is not ujsonrpc.UNKNOWN_METHOD and not accept(method):
+                self.skipped_frames += 1
+                return _SKIPPED
+        self.parsed_frames += 1
+        try:
+            return ujsonrpc.decode(json.loads(buffer))
+        except (ValueError, TypeError):
+            # Malformed JSON, a line that is not UTF-8, or JSON that is not an object
+            self.decode_failures += 1
+            return _SKIPPED
+
+    def batch(self) -> WriteBatch:
+        """
+        Context manager sending the requests made inside it with a single write:
+
+            with hub.batch() as batch:
+                for motor in motors:
+                    motor.rotate(100, 90)
+            hub.wait(*batch)
+        """
+        return WriteBatch(self)
+
+    def send(self, message: ujsonrpc.RPCRequest, priority: Optional[Priority] = None, tag: any = None):
+        """
+        Writes `message`, through the writer's queue when it runs; `tag` marks it for `SendQueue.discard`
+        while it waits there.
+        """
+        tracer = self.tracer
+        if tracer is not None:
+            start = monotonic()
+            self._send(message, priority, tag)
+            tracer.span('send', 'serial', start, monotonic(), {'method': message.method, 'id': message.id})
+        else:
+            self._send(message, priority, tag)
+
+    def _send(self, message: ujsonrpc.RPCRequest, priority: Optional[Priority], tag: any = None):
         json_str = ujsonrpc.encode(message)
-        buffer = json_str.encode('utf-8')        
-        self.connection.write(buffer)
+        buffer = json_str.encode('utf-8')
+        if priority is None:
+            priority = priority_of(message)
+        ports = ports_of(message)
+        batch = self._batch
+        if batch is not None and batch._collects():
+            batch._add(message, buffer, priority, ports)
+        else:
+            self._write(buffer, priority, ports, tag)
+
+    def _write(self, buffer: bytes, priority: Priority = Priority.Normal, ports: Collection[str] = (),
+               tag: any = None):
+        self.written_bytes += len(buffer)
+        queue = self.send_queue
+        if queue is None:
+            self.connection.write(buffer)
+            return
+        if self._writer_error is not None:
+            raise SerialException(f'writer stopped: {self._writer_error}') from self._writer_error
+        if not queue.put(buffer, priority, ports, tag):
+            # The writer is stopping
+            with self._write_lock:
+                self.connection.write(buffer)
 
     def close(self):
+        self.stop_writer()
+        reader = self._reader_thread
+        self._reader_thread = None
+        if reader is not None:
+            self.ring.close()
         self.connection.close()
+        if reader is not None:
+            reader.join()
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+from threading import Condition, Lock, Thread
+from time import monotonic
+
+from serial.serialutil import SerialException as PortException
+from typing import Dict, Optional
+
+from spikectl import ujsonrpc
+from spikectl.model import MotorPowerRequest, MotorStartRequest, MotorStopRequest
+
+from .pending import RequestError
+from .serial import SerialException
+from .spike import HubTask, SpikeHub
+
+
+_PORTS = ('A', 'B', 'C', 'D', 'E', 'F')
+
+
+class SetpointChannel(object):
+    """
+    Speed or power setpoints for one motor port. A setpoint replaces the previous one if that was not
+    written yet, whether it waits for the port's rate or in the hub's send queue, and the port is sent at
+    most `Setpoints.max_rate` setpoints per second. `errors` counts the setpoints the hub answered with an
+    error, the last of which is `last_error`.
+    """
+
+    __slots__ = ['setpoints', 'port', 'sent', 'merged', 'errors', 'last_error', '_pending', '_next_send',
+                 '_queued']
+
+    def __init__(self, setpoints: Setpoints, port: str):
+        self.setpoints = setpoints
+        self.port = port
+        self.sent = 0
+        # Setpoints replaced by a newer one before being written
+        self.merged = 0
+        self.errors = 0
+        self.last_error: Optional[RequestError] = None
+        self._pending: Optional[ujsonrpc.RPCRequest] = None
+        self._next_send = 0.0
+        # The setpoint last handed to the hub, which may still wait in its send queue
+        self._queued: Optional[HubTask] = None
+
+    def start(self, speed: int, stall: bool = True) -> ujsonrpc.RPCRequest:
+        assert -100 <= speed <= 100, f'speed must be between -100 and 100 per cent: {speed}'
+        return self.setpoints._put(self, MotorStartRequest(self.port, speed, stall))
+
+    def power(self, power: int, stall: bool = True) -> ujsonrpc.RPCRequest:
+        assert -100 <= power <= 100, f'power must be between -100 and 100 per cent: {power}'
+        return self.setpoints._put(self, MotorPowerRequest(self.port, power, stall))
+
+    def stop(self, stop: int = 1) -> HubTask:
+        """
+        Drops the setpoints not written yet, whether waiting for the port's rate or in the hub's send queue,
+        and stops the motor right away.
+        """
+        return self.setpoints._stop(self, MotorStopRequest(self.port, stop))
+
+    def _answered(self, task: HubTask):
+        if isinstance(task.error, RequestError):
+            self.errors += 1
+            self.last_error = task.error
+
+
+class Setpoints(object):
+    """
+    Last-write-wins channels for continuous motor setpoints, e.g. teleoperation at a high control rate.
+
+    A thread sends each port's latest setpoint as soon as the port's rate allows, without waiting for
+    the answer. Setpoints are still registered with the hub for `answer_timeout` seconds, so the hub's
+    metrics count them and errors it answers with are counted in each channel's `errors` as the hub is
+    read; they bypass its request window, as the rate already bounds them. A setpoint still waiting in the
+    hub's send queue when the writer runs is replaced by the next one. Stopping through the channel drops
+    whatever setpoints are still waiting, here or in the send queue; one the writer already took is written
+    before the stop.
+    """
+
+    __slots__ = ['hub', 'max_rate', 'answer_timeout', '_channels', '_condition', '_send_lock', '_thread',
+                 '_error', '_closed']
+
+    def __init__(self, hub: SpikeHub, max_rate: float = 20.0, answer_timeout: float = 5.0):
+        assert max_rate > 0, 'max_rate must be a positive number of setpoints per second'
+        assert answer_timeout > 0, 'answer_timeout must be a positive number of seconds'
+        self.hub = hub
+        self.max_rate = max_rate
+        self.answer_timeout = answer_timeout
+        self._channels: Dict[str, SetpointChannel] = {}
+        self._condition = Condition()
+        # Held while setpoints are handed to the hub, so a stop comes after a setpoint taken for sending
+        self._send_lock = Lock()
+        self._thread: Optional[Thread] = None
+        self._error: Optional[Exception] = None
+        self._closed = False
+
+    def motor(self, port: str) -> SetpointChannel:
+        assert port in _PORTS, 'port must be a letter between A and F'
+        with self._condition:
+            channel = self._channels.get(port)
+            if channel is None:
+                channel = self._channels[port] = SetpointChannel(self, port)
+        return channel
+
+    @property
+    def sent(self) -> int:
+        return sum(channel.sent for channel in self._channels.values())
+
+    @property
+    def merged(self) -> int:
+        return sum(channel.merged for channel in self._channels.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(channel.errors for channel in self._channels.values())
+
+    def _put(self, channel: SetpointChannel, request: ujsonrpc.RPCRequest) -> ujsonrpc.RPCRequest:
+        with self._condition:
+            assert not self._closed, 'setpoints are closed'
+            if self._error is not None:
+                raise SerialException(f'setpoints stopped: {self._error}') from self._error
+            if channel._pending is not None:
+                channel.merged += 1
+            channel._pending = request
+            if self._thread is None:
+                self._thread = Thread(target=self._send_loop, name='spikectl-setpoints', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return request
+
+    def _stop(self, channel: SetpointChannel, request: ujsonrpc.RPCRequest) -> HubTask:
+        with self._send_lock:
+            with self._condition:
+                channel._pending = None
+            self._discard(channel)
+            return self.hub._invoke(request)
+
+    def _discard(self, channel: SetpointChannel) -> bool:
+        """
+        Takes the channel's setpoint out of the hub's send queue if it is still there.
+        """
+        queued = channel._queued
+        channel._queued = None
+        queue = self.hub.send_queue
+        if queued is None or queue is None or not queue.discard(channel):
+            return False
+        self.hub.pending.cancel(queued)
+        return True
+
+    def _send(self, channel: SetpointChannel, request: ujsonrpc.RPCRequest):
+        hub = self.hub
+        if self._discard(channel):
+            channel.merged += 1
+        task = hub.pending.register(request, self.answer_timeout)
+        task.add_done_callback(channel._answered)
+        hub._track(task)
+        try:
+            hub.send(request, tag=channel)
+        except BaseException:
+            hub.pending.cancel(task)
+            raise
+        channel._queued = task
+        channel.sent += 1
+
+    def _due(self) -> Optional[float]:
+        """
+        When the next pending setpoint may be sent, `None` when there is none.
+        """
+        due = None
+        for channel in self._channels.values():
+            if channel._pending is not None and (due is None or channel._next_send < due):
+                due = channel._next_send
+        return due
+
+    def _send_loop(self):
+        interval = 1.0 / self.max_rate
+        condition = self._condition
+        while True:
+            with condition:
+                while True:
+                    if self._closed:
+                        return
+                    now = monotonic()
+                    due = self._due()
+                    if due is not None and due <= now:
+                        break
+                    condition.wait(due - now if due is not None else None)
+
+            # New setpoints keep coming in while these are written
+            with self._send_lock:
+                with condition:
+                    now = monotonic()
+                    ready = []
+                    for channel in self._channels.values():
+                        if channel._pending is not None and channel._next_send <= now:
+                            ready.append((channel, channel._pending))
+                            channel._pending = None
+                            channel._next_send = now + interval
+                try:
+                    for channel, request in ready:
+                        self._send(channel, request)
+                except (SerialException, PortException, OSError) as err:
+                    self._error = err
+                    return
+
+    def close(self):
+        """
+        Stops the sending thread; setpoints not sent yet are dropped.
+        """
+        with self._condition:
+            self._closed = True
+            for channel in self._channels.values():
+                channel._pending = None
+            self._condition.notify_all()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+__all__ = [
+    'SetpointChannel',
+    'Setpoints'
+]
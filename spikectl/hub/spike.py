@@ -1,28 +1,238 @@
 from __future__ import annotations
-from typing import Type, Optional, Union, Callable, List
+from typing import Type, Optional, Union, Callable, Collection, Dict, Iterator, List
+import json
+from time import monotonic
 
 from serial import Serial
-from serial.tools.list_ports import comports
 
 from spikectl import ujsonrpc
 
-from .serial import RawSerialHub, EmptyBuffer
+from .serial import RawSerialHub, EmptyBuffer, _SKIPPED
+from .pending import SpikeHubException, RequestError, RequestTimeout, PendingRequest, PendingRequests
+from .sendqueue import Priority, priority_of
+from .deadband import SensorChange, SensorDeadband
+from .metrics import HubMetrics
+from .sensorview import SensorRecord, SensorView
+from .state import DEFAULT_STATE_TYPES, HubState, Snapshot
+from .stream import NotificationStream
+from .window import RequestWindow
 from spikectl.model import *
 
 
 _DEFAULT_BAUDRATE = 115200
 
 
-class SpikeHubException(Exception): pass
-
-HubTask = Callable[[ujsonrpc.RPCBaseMessage], bool]
+HubTask = PendingRequest
 
 class SpikeHub(RawSerialHub):
 
-    def __init__(self, connection: Serial):
+    def __init__(self, connection: Serial, request_timeout: Optional[float] = None,
+                 window: Optional[RequestWindow] = None):
         super().__init__(connection)
+        self.pending = PendingRequests()
+        self.request_timeout = request_timeout
+        # Limit on requests in flight; held requests are only sent as answers are read
+        self.window = window
+        self.metrics: Optional[HubMetrics] = None
+        self.state: Optional[HubState] = None
+        self._notification_hooks = ()
+        self._remove_state_hook = None
+        # Frame every sensor listener is handed a view of, overwritten in place
+        self.sensor_record: Optional[SensorRecord] = None
+        self._sensor_view: Optional[SensorView] = None
+        self._sensor_listeners = ()
+        self._remove_sensor_hook = None
+
+    def add_notification_hook(self, hook: Callable[[ujsonrpc.RPCNotification, float], None],
+                              methods: Optional[Collection] = None) -> Callable[[], None]:
+        """
+        Calls `hook` with every notification whose method is in `methods` (all when `None`) and the
+        monotonic time it was read at.
+
+        Hooks run as frames are read, on the background reader thread when it runs, whether or not anything
+        is listening. Each frame is parsed at most once, for all hooks and the listeners reading it after them.
+        An exception raised by a hook is logged and counted in `hook_failures`, and the frame still reaches
+        the other hooks.
+        """
+        entry = (hook, frozenset(methods) if methods is not None else None)
+        self._notification_hooks = self._notification_hooks + (entry,)
+
+        def remove_hook():
+            self._notification_hooks = tuple(e for e in self._notification_hooks if e is not entry)
+
+        return remove_hook
+
+    def _run_frame_hooks(self, frame: bytes) -> Optional[ujsonrpc.RPCBaseMessage]:
+        super()._run_frame_hooks(frame)
+        if not self._notification_hooks:
+            return None
+        return self._run_notification_hooks(frame)
 
-    def listen_notifications(self, listener: Callable[[ujsonrpc.RPCNotification], bool], notification_type: Type = BaseNotification):
+    def _run_notification_hooks(self, frame: bytes) -> Optional[ujsonrpc.RPCNotification]:
+        method = ujsonrpc.peek_method(frame)
+        if method is None:
+            return None
+        msg = None
+        timestamp = 0.0
+        if method is ujsonrpc.UNKNOWN_METHOD:
+            # Only parsing tells what the frame is
+            msg = self._parse_notification(frame)
+            if msg is None:
+                return None
+            method = msg.method
+            timestamp = monotonic()
+        for hook, methods in self._notification_hooks:
+            if methods is not None and method not in methods:
+                continue
+            if msg is None:
+                msg = self._parse_notification(frame)
+                if msg is None:
+                    return None
+                timestamp = monotonic()
+            try:
+                hook(msg, timestamp)
+            except Exception:
+                self._hook_failed(hook)
+        return msg
+
+    def _parse_notification(self, frame: bytes) -> Optional[ujsonrpc.RPCNotification]:
+        self.parsed_frames += 1
+        try:
+            msg = ujsonrpc.decode(json.loads(frame))
+        except (ValueError, TypeError):
+            self.decode_failures += 1
+            return None
+        return msg if msg is not None and msg.is_notification() else None
+
+    def subscribe_changes(self, listener: Callable[[SensorChange], None],
+                          thresholds: Optional[Dict[str, float]] = None, **fields: float) -> Callable[[], None]:
+        """
+        Calls `listener` with each sensor frame field that moved past its deadband, e.g.
+        `hub.subscribe_changes(print, motor_position=2, accelerometer=5, force_force=1)`; see `SensorDeadband`.
+
+        Frames are compared raw as they are read, and only the ports that changed are decoded. An exception
+        raised by `listener` is logged and counted in `hook_failures`; the frame's other changes are still
+        handed to it. Returns a function removing the subscription.
+        """
+        deadband = SensorDeadband(thresholds, **fields)
+
+        def emit(change: SensorChange):
+            try:
+                listener(change)
+            except Exception:
+                self._hook_failed(listener)
+
+        def deadband_hook(msg: ujsonrpc.RPCNotification, timestamp: float):
+            deadband.feed(msg.parameters, timestamp, emit)
+
+        return self.add_notification_hook(deadband_hook, (NotificationType.Sensor.value,))
+
+    def add_sensor_listener(self, listener: Callable[[SensorView], None]) -> Callable[[], None]:
+        """
+        Calls `listener` with every sensor frame, decoded into the hub's `sensor_record` rather than into new
+        objects. Every listener gets the same `SensorView`, valid only during the call; `copy()` it to keep
+        the frame. An exception raised by a listener is logged and counted in `hook_failures`, and the other
+        listeners still get the frame. Returns a function removing the listener.
+        """
+        if self.sensor_record is None:
+            self.sensor_record = SensorRecord()
+            self._sensor_view = SensorView(self.sensor_record)
+        entry = (listener,)
+        self._sensor_listeners = self._sensor_listeners + (entry,)
+        if self._remove_sensor_hook is None:
+            self._remove_sensor_hook = self.add_notification_hook(self._run_sensor_listeners,
+                                                                  (NotificationType.Sensor.value,))
+
+        def remove_listener():
+            self._sensor_listeners = tuple(e for e in self._sensor_listeners if e is not entry)
+            if not self._sensor_listeners and self._remove_sensor_hook is not None:
+                self._remove_sensor_hook()
+                self._remove_sensor_hook = None
+
+        return remove_listener
+
+    def _run_sensor_listeners(self, msg: ujsonrpc.RPCNotification, timestamp: float):
+        self.sensor_record.write(msg.parameters, timestamp)
+        view = self._sensor_view
+        for listener, in self._sensor_listeners:
+            try:
+                listener(view)
+            except Exception:
+                self._hook_failed(listener)
+
+    def track_state(self, types: tuple = DEFAULT_STATE_TYPES) -> HubState:
+        """
+        Keeps `state` up to date with every notification of `types` read from the port.
+        """
+        if self._remove_state_hook is not None:
+            self._remove_state_hook()
+        state = HubState(types)
+
+        def state_hook(msg: ujsonrpc.RPCNotification, timestamp: float):
+            state.update(decode_notification(msg), timestamp)
+
+        self.state = state
+        self._remove_state_hook = self.add_notification_hook(state_hook, state.methods)
+        return state
+
+    def read_state(self, notification_type: Type = SensorNotification, max_age: Optional[float] = None,
+                   timeout: Optional[float] = None) -> Optional[Snapshot]:
+        """
+        Returns the cached notification of `notification_type`, if younger than `max_age` seconds.
+
+        When the cache is older, waits for the background reader to refresh it, or reads the port
+        itself when no reader is running. Returns `None` on timeout.
+        """
+        state = self.state if self.state is not None else self.track_state()
+        snapshot = state.fresh(notification_type, max_age)
+        if snapshot is not None:
+            return snapshot
+        if self._reader_thread is not None:
+            return state.wait(notification_type, max_age, timeout)
+
+        try:
+            self.listen(lambda _: state.fresh(notification_type, max_age) is None, timeout,
+                        methods=notification_methods(notification_type))
+        except EmptyBuffer:
+            pass
+        return state.fresh(notification_type, max_age)
+
+    def listen(self, listener: Callable[[ujsonrpc.RPCBaseMessage], bool], timeout: Optional[float] = None,
+               methods: Optional[Collection] = None):
+        """
+        Like `RawSerialHub.listen`, resolving pending requests on the way.
+
+        When `methods` is given, only notifications with those methods reach `listener`; other frames are
+        discarded before being parsed, and so are responses while no request is pending.
+        """
+        pending = self.pending
+        tracer = self.tracer
+
+        def dispatch_listener(msg: ujsonrpc.RPCBaseMessage) -> bool:
+            if msg.is_response() or msg.is_error():
+                pending.resolve(msg)
+            pending.expire()
+            if tracer is None:
+                return listener(msg)
+            start = monotonic()
+            keep_going = listener(msg)
+            tracer.span('listener', 'listener', start, monotonic())
+            return keep_going
+
+        accept = None
+        if methods is not None:
+            def accept(method: any) -> bool:
+                if pending.expire():
+                    # Let the listener see that a request has timed out
+                    return True
+                if method is None:
+                    return len(pending) > 0
+                return method in methods
+
+        super().listen(dispatch_listener, timeout, accept)
+
+    def listen_notifications(self, listener: Callable[[ujsonrpc.RPCNotification], bool], notification_type: Type = BaseNotification,
+                             timeout: Optional[float] = None):
 
         def notification_listener(msg: ujsonrpc.RPCBaseMessage) -> bool:
             if msg.is_notification():
@@ -32,11 +242,12 @@ class SpikeHub(RawSerialHub):
             return True
         
         try:
-            self.listen(notification_listener)
+            self.listen(notification_listener, timeout, methods=notification_methods(notification_type))
         except EmptyBuffer:
             return None
     
-    def listen_notification(self, notification_type: Type = BaseNotification) -> Optional[BaseNotification]:
+    def listen_notification(self, notification_type: Type = BaseNotification,
+                            timeout: Optional[float] = None) -> Optional[BaseNotification]:
 
         match: BaseNotification = None
 
@@ -46,31 +257,134 @@ class SpikeHub(RawSerialHub):
             return False
         
         try:
-            self.listen_notifications(notification_listener, notification_type)
+            self.listen_notifications(notification_listener, notification_type, timeout)
             return match
         except EmptyBuffer:
             return None
     
-    def wait(self, *tasks: List[HubTask]):
-
-        def task_wait_listener(msg: ujsonrpc.RPCBaseMessage) -> bool:
-            nonlocal tasks
-            tasks = [task for task in tasks if not task(msg)]            
-            return len(tasks) > 0
-    
-        self.listen(task_wait_listener)
-
-    def _invoke(self, request: ujsonrpc.RPCRequest) -> HubTask:
-        self.send(request)
+    def stream(self, types: Union[Type, tuple] = BaseNotification, timeout: Optional[float] = None) -> NotificationStream:
+        """
+        Notifications of `types` read over the next `timeout` seconds (until closed when `None`), resolving
+        pending requests on the way:
+
+            for data in hub.stream(SensorNotification, timeout=10).port('A').sample(0.1):
+                print(data.data)
+
+        Frames are read as the stream is iterated, from the background reader's ring when it runs. Its
+        capacity bounds how far the stream may fall behind; with `OverflowPolicy.Block` a slow consumer holds
+        the reader back instead of losing frames. Iterating raises `SerialException` once the port hangs up,
+        e.g. when the hub is unplugged.
+        """
+        return NotificationStream(self._notifications(types, timeout))
+
+    def _notifications(self, types: Union[Type, tuple], timeout: Optional[float]) -> Iterator[BaseNotification]:
+        if not isinstance(types, tuple):
+            types = (types,)
+        methods = frozenset()
+        for notification_type in types:
+            type_methods = notification_methods(notification_type)
+            if type_methods is None:
+                methods = None
+                break
+            methods = methods | type_methods
+        pending = self.pending
+
+        accept = None
+        if methods is not None:
+            def accept(method: any) -> bool:
+                if pending.expire():
+                    return True
+                if method is None:
+                    return len(pending) > 0
+                return method in methods
+
+        deadline = monotonic() + timeout if timeout is not None else float('inf')
+        while monotonic() < deadline:
+            # At the end of the port's data a read returns at once, so the stream must end there
+            buffer = self._read_frame(fail_at_eof=True)
+            if not buffer:
+                # Nothing within the port's read timeout
+                continue
+            msg = self._parse_frame(buffer, accept)
+            if msg is _SKIPPED or msg is None:
+                continue
+            if msg.is_response() or msg.is_error():
+                pending.resolve(msg)
+            pending.expire()
+            if msg.is_notification():
+                notification = decode_notification(msg)
+                if isinstance(notification, types):
+                    yield notification
 
-        def response_listener(msg: ujsonrpc.RPCBaseMessage) -> bool:
-            nonlocal request
-            if msg.is_response() or msg.is_error():                
-                return msg.id == request.id
-            return False
-            
+    def wait(self, *tasks: List[HubTask]):
 
-        return response_listener
+        outstanding = 0
+
+        def task_done(_: PendingRequest):
+            nonlocal outstanding
+            outstanding -= 1
+
+        for task in tasks:
+            if not task.done:
+                outstanding += 1
+                task.add_done_callback(task_done)
+
+        if outstanding > 0:
+            tracer = self.tracer
+            start = monotonic()
+            self.listen(lambda _: outstanding > 0, methods=())
+            if tracer is not None:
+                tracer.span('wait', 'wait', start, monotonic(), {'tasks': len(tasks)})
+
+    def _invoke(self, request: ujsonrpc.RPCRequest, timeout: Optional[float] = None) -> HubTask:
+        task = self.pending.register(request, timeout if timeout is not None else self.request_timeout)
+        batch = self._batch
+        if batch is not None and batch._collects():
+            batch.tasks.append(task)
+        window = self.window
+        if window is None:
+            self._track(task)
+            self.send(request)
+            return task
+        priority = priority_of(request)
+        if window.admit(task, priority):
+            self._send_in_window(task, priority)
+        return task
+
+    def _send_in_window(self, task: HubTask, priority: Priority):
+        sent = monotonic()
+
+        def done(finished: HubTask):
+            error = finished.error
+            answered = error is None or isinstance(error, RequestError)
+            released = self.window.complete(monotonic() - sent if answered else None,
+                                            isinstance(error, RequestTimeout))
+            for held, held_priority in released:
+                self._send_in_window(held, held_priority)
+
+        task.add_done_callback(done)
+        self._track(task)
+        self.send(task.request, priority)
+
+    def _track(self, task: HubTask):
+        if self.metrics is not None:
+            self.metrics.track(task)
+        if self.tracer is not None:
+            self.tracer.track(task)
+
+    def enable_metrics(self) -> HubMetrics:
+        """
+        Starts timing requests and counting traffic; see `HubMetrics`.
+        """
+        if self.metrics is None:
+            self.metrics = HubMetrics(self)
+        return self.metrics
+
+    def disable_metrics(self):
+        metrics = self.metrics
+        self.metrics = None
+        if metrics is not None:
+            metrics.close()
     
     def trigger_current_state(self):
         request = TriggerCurrentStateRequest()
@@ -89,6 +403,10 @@ class SpikeHub(RawSerialHub):
         assert port in ['A', 'B', 'C', 'D', 'E', 'F'], 'port must be a letter between A and F'
         return Motor(self, port)
 
+    def close(self):
+        self.pending.cancel_all()
+        super().close()
+
 class Display:
 
     __slots__ = ['hub']
@@ -96,9 +414,9 @@ class Display:
     def __init__(self, hub: SpikeHub):
         self.hub = hub
     
-    def clear(self):
+    def clear(self) -> HubTask:
         request = ScratchDisplayClearRequest()
-        self.hub._invoke(request)
+        return self.hub._invoke(request)
 
     def set_pixel(self, x: int, y: int, brightness: int) -> HubTask:
         assert 0 <= x <= 4 and 0 <= y <= 4 , 'x and y must be between 0 and 4'
@@ -107,7 +425,7 @@ class Display:
 
     def display_image(self, image: str, duration: int = 0) -> HubTask:
         assert image is not None, 'image must be present'
-        assert len(image) is 29, 'image must be present'
+        assert len(image) == 29, 'image must be 5 rows of 5 levels'
         if duration is None:
             request = ScratchDisplayImageRequest(image)
         else:
@@ -171,23 +489,3 @@ class Motor:
         assert -100 <= speed <= 100, f'speed must be between -100 and 100 per cent: {speed}'
         request = MotorGoDirectionToPositionRequest(self.port, speed, position, direction, stall, stop)
         return self.hub._invoke(request)
-
-
-def find_hub(name: str) -> SpikeHub:
-    
-    lego_hub_ports = [port for port in comports()
-        if port.product and 'LEGO Technic Large Hub' in port.product]
-    
-    for port in lego_hub_ports:
-
-        hub = SpikeHub(Serial(port.device, baudrate=_DEFAULT_BAUDRATE, timeout=1))
-        hub.trigger_current_state()
-        notification = hub.listen_notification(InfoStatusNotification)        
-
-        if notification.name == name:
-            hub._init()
-            return hub
-        else:
-            hub.close()
-    
-    return None
\ No newline at end of file
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from threading import Condition
+from time import monotonic
+from typing import Dict, Generic, Optional, Type, TypeVar
+
+from spikectl.model import *
+
+
+T = TypeVar('T')
+
+_PORTS = ('A', 'B', 'C', 'D', 'E', 'F')
+
+# Notifications worth caching by default: the ones describing what the hub is, has and measures
+DEFAULT_STATE_TYPES = (
+    SensorNotification,
+    BatteryStatusNotification,
+    StorageInformationNotification,
+    ProgramRunningNotification,
+    FirmwareNotification,
+    InfoStatusNotification
+)
+
+
+class Snapshot(Generic[T]):
+
+    __slots__ = ['value', 'timestamp']
+
+    def __init__(self, value: T, timestamp: float):
+        self.value = value
+        self.timestamp = timestamp
+
+    @property
+    def age(self) -> float:
+        """
+        Seconds since the value was received.
+        """
+        return monotonic() - self.timestamp
+
+    def __str__(self):
+        return f'Snapshot [value: {self.value}, age: {self.age:.3f}]'
+
+
+class HubState(object):
+    """
+    Latest notification of each type received from a hub, plus the latest reading of every port.
+
+    Values are updated by whoever reads the serial port and can be read from any thread at no cost;
+    `wait` blocks until a value fresher than `max_age` seconds shows up.
+    """
+
+    __slots__ = ['types', 'methods', '_latest', '_ports', '_condition']
+
+    def __init__(self, types: tuple = DEFAULT_STATE_TYPES):
+        self.types = tuple(types)
+        methods = set()
+        for notification_type in self.types:
+            type_methods = notification_methods(notification_type)
+            if type_methods is None:
+                methods = None
+                break
+            methods.update(type_methods)
+        self.methods = frozenset(methods) if methods is not None else None
+        self._latest: Dict[Type, Snapshot] = {}
+        self._ports: Dict[str, Snapshot[Optional[ExternalSensorData]]] = {}
+        self._condition = Condition()
+
+    def wants(self, method: any) -> bool:
+        return self.methods is None or method in self.methods
+
+    def update(self, notification: BaseNotification, timestamp: Optional[float] = None):
+        if not isinstance(notification, self.types):
+            return
+        if timestamp is None:
+            timestamp = monotonic()
+        notification_class = type(notification)
+        with self._condition:
+            self._latest[notification_class] = Snapshot(notification, timestamp)
+            if notification_class is SensorNotification:
+                ports = self._ports
+                ports['A'] = Snapshot(notification.A, timestamp)
+                ports['B'] = Snapshot(notification.B, timestamp)
+                ports['C'] = Snapshot(notification.C, timestamp)
+                ports['D'] = Snapshot(notification.D, timestamp)
+                ports['E'] = Snapshot(notification.E, timestamp)
+                ports['F'] = Snapshot(notification.F, timestamp)
+            self._condition.notify_all()
+
+    def get(self, notification_type: Type[T]) -> Optional[Snapshot[T]]:
+        return self._latest.get(notification_type)
+
+    def port(self, port: str) -> Optional[Snapshot[Optional[ExternalSensorData]]]:
+        assert port in _PORTS, 'port must be a letter between A and F'
+        return self._ports.get(port)
+
+    @property
+    def sensor(self) -> Optional[Snapshot[SensorNotification]]:
+        return self._latest.get(SensorNotification)
+
+    @property
+    def battery(self) -> Optional[Snapshot[BatteryStatusNotification]]:
+        return self._latest.get(BatteryStatusNotification)
+
+    @property
+    def storage(self) -> Optional[Snapshot[StorageInformationNotification]]:
+        return self._latest.get(StorageInformationNotification)
+
+    @property
+    def firmware(self) -> Optional[Snapshot[FirmwareNotification]]:
+        return self._latest.get(FirmwareNotification)
+
+    @property
+    def program_running(self) -> Optional[Snapshot[ProgramRunningNotification]]:
+        return self._latest.get(ProgramRunningNotification)
+
+    def fresh(self, notification_type: Type[T], max_age: Optional[float] = None) -> Optional[Snapshot[T]]:
+        """
+        Returns the cached value when it is younger than `max_age` seconds (or at all when `max_age` is `None`).
+        """
+        snapshot = self._latest.get(notification_type)
+        if snapshot is None or (max_age is not None and monotonic() - snapshot.timestamp > max_age):
+            return None
+        return snapshot
+
+    def wait(self, notification_type: Type[T], max_age: Optional[float] = None,
+             timeout: Optional[float] = None) -> Optional[Snapshot[T]]:
+        """
+        Blocks until a value younger than `max_age` seconds is cached, returning `None` on timeout.
+
+        Only useful while another thread reads the port, e.g. the hub's background reader.
+        """
+        deadline = monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                snapshot = self.fresh(notification_type, max_age)
+                if snapshot is not None:
+                    return snapshot
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+    def discard(self, notification_type: Type):
+        """
+        Forgets the cached value of `notification_type`, e.g. after changing what it describes.
+        """
+        with self._condition:
+            self._latest.pop(notification_type, None)
+
+    def clear(self):
+        with self._condition:
+            self._latest.clear()
+            self._ports.clear()
+
+
+__all__ = [
+    'DEFAULT_STATE_TYPES',
+    'Snapshot',
+    'HubState'
+]
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from time import monotonic
+from typing import Any, Callable, Optional, Tuple, Type
+
+from spikectl.model import SensorNotification
+
+
+# Returned by a stage for an item that goes no further
+_SKIP = object()
+# Returned by `next` on a drained sync source read from the event loop
+_END = object()
+
+
+class _Stage(object):
+    """
+    One operator of a stream. `push` returns the item to pass on, or `_SKIP`; once `stopped` is set no more
+    items are pushed. `flush` returns what the stage still holds when its input ends.
+    """
+
+    __slots__ = ['stopped']
+
+    def __init__(self):
+        self.stopped = False
+
+    def push(self, item: Any) -> Any:
+        return item
+
+    def flush(self) -> Any:
+        return _SKIP
+
+
+class _Filter(_Stage):
+
+    __slots__ = ['predicate']
+
+    def __init__(self, predicate: Callable[[Any], bool]):
+        super().__init__()
+        self.predicate = predicate
+
+    def push(self, item: Any) -> Any:
+        return item if self.predicate(item) else _SKIP
+
+
+class _Map(_Stage):
+
+    __slots__ = ['function']
+
+    def __init__(self, function: Callable[[Any], Any]):
+        super().__init__()
+        self.function = function
+
+    def push(self, item: Any) -> Any:
+        return self.function(item)
+
+
+class _Port(_Stage):
+
+    __slots__ = ['port']
+
+    def __init__(self, port: str):
+        super().__init__()
+        self.port = port
+
+    def push(self, item: Any) -> Any:
+        if not isinstance(item, SensorNotification):
+            return _SKIP
+        data = getattr(item, self.port)
+        return data if data is not None else _SKIP
+
+
+class _Take(_Stage):
+
+    __slots__ = ['remaining']
+
+    def __init__(self, count: int):
+        super().__init__()
+        self.remaining = count
+        self.stopped = count == 0
+
+    def push(self, item: Any) -> Any:
+        self.remaining -= 1
+        self.stopped = self.remaining <= 0
+        return item
+
+
+class _Until(_Stage):
+
+    __slots__ = ['predicate']
+
+    def __init__(self, predicate: Callable[[Any], bool]):
+        super().__init__()
+        self.predicate = predicate
+
+    def push(self, item: Any) -> Any:
+        if self.predicate(item):
+            self.stopped = True
+            return _SKIP
+        return item
+
+
+class _Sample(_Stage):
+
+    __slots__ = ['interval', 'next_at']
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self.next_at = float('-inf')
+
+    def push(self, item: Any) -> Any:
+        now = monotonic()
+        if now < self.next_at:
+            return _SKIP
+        self.next_at = now + self.interval
+        return item
+
+
+class _Batch(_Stage):
+
+    __slots__ = ['seconds', 'max_size', 'items', 'ends_at']
+
+    def __init__(self, seconds: float, max_size: Optional[int]):
+        super().__init__()
+        self.seconds = seconds
+        self.max_size = max_size
+        self.items = []
+        self.ends_at = 0.0
+
+    def push(self, item: Any) -> Any:
+        now = monotonic()
+        batch = _SKIP
+        if self.items and now >= self.ends_at:
+            batch = self.items
+            self.items = []
+        if not self.items:
+            self.ends_at = now + self.seconds
+        self.items.append(item)
+        if batch is _SKIP and self.max_size is not None and len(self.items) >= self.max_size:
+            batch = self.items
+            self.items = []
+        return batch
+
+    def flush(self) -> Any:
+        batch = self.items
+        self.items = []
+        return batch if batch else _SKIP
+
+
+class NotificationStream(object):
+    """
+    Notifications from a hub as an iterator, or an async iterator, with lazy operators.
+
+    Each operator returns a new stream reading from the same source, so only the last one should be
+    iterated. Items go through the operators one at a time as they are read; nothing is collected except
+    the batches `batch` hands out. The stream ends when its source does, e.g. at its timeout, or when
+    `take` or `until` says so, without reading another frame; its source is closed then.
+    """
+
+    __slots__ = ['_source', '_stages', '_ready', '_done']
+
+    def __init__(self, source: Any, stages: Tuple[_Stage, ...] = ()):
+        self._source = source
+        self._stages = stages
+        # Items through every stage, not yet handed out; more than one only when stages are flushed
+        self._ready = deque()
+        self._done = any(stage.stopped for stage in stages)
+
+    def _then(self, stage: _Stage) -> NotificationStream:
+        return NotificationStream(self._source, self._stages + (stage,))
+
+    def filter(self, predicate: Callable[[Any], bool]) -> NotificationStream:
+        return self._then(_Filter(predicate))
+
+    def of_type(self, *types: Type) -> NotificationStream:
+        return self._then(_Filter(lambda item: isinstance(item, types)))
+
+    def port(self, port: str) -> NotificationStream:
+        """
+        The `ExternalSensorData` of `port` from each sensor notification, skipping those where nothing is
+        connected to it.
+        """
+        assert port in ['A', 'B', 'C', 'D', 'E', 'F'], 'port must be a letter between A and F'
+        return self._then(_Port(port))
+
+    def map(self, function: Callable[[Any], Any]) -> NotificationStream:
+        return self._then(_Map(function))
+
+    def take(self, count: int) -> NotificationStream:
+        assert count >= 0, 'count must not be negative'
+        return self._then(_Take(count))
+
+    def until(self, predicate: Callable[[Any], bool]) -> NotificationStream:
+        """
+        Items up to, and not including, the first one `predicate` is true for.
+        """
+        return self._then(_Until(predicate))
+
+    def sample(self, interval: float) -> NotificationStream:
+        """
+        At most one item every `interval` seconds: the first to arrive once the interval is over.
+        """
+        assert interval >= 0, 'interval must not be negative'
+        return self._then(_Sample(interval))
+
+    def batch(self, seconds: float, max_size: Optional[int] = None) -> NotificationStream:
+        """
+        Lists of the items read within `seconds` of the first one in the list, or `max_size` items.
+
+        A list is handed out when an item arrives past its window, when it is full or when the stream ends.
+        """
+        assert seconds > 0, 'seconds must be positive'
+        assert max_size is None or max_size > 0, 'max_size must be positive'
+        return self._then(_Batch(seconds, max_size))
+
+    def _through(self, item: Any, start: int):
+        stages = self._stages
+        for index in range(start, len(stages)):
+            stage = stages[index]
+            item = stage.push(item)
+            if stage.stopped:
+                if item is not _SKIP:
+                    self._through(item, index + 1)
+                self._flush(index + 1)
+                self._done = True
+                return
+            if item is _SKIP:
+                return
+        self._ready.append(item)
+
+    def _flush(self, start: int):
+        stages = self._stages
+        for index in range(start, len(stages)):
+            item = stages[index].flush()
+            if item is not _SKIP:
+                self._through(item, index + 1)
+
+    def _end(self):
+        self._done = True
+        self._flush(0)
+
+    def __iter__(self) -> NotificationStream:
+        return self
+
+    def __next__(self) -> Any:
+        assert not hasattr(self._source, '__anext__'), 'iterate this stream with async for'
+        ready = self._ready
+        while True:
+            if ready:
+                return ready.popleft()
+            if self._done:
+                self.close()
+                raise StopIteration
+            try:
+                item = next(self._source)
+            except StopIteration:
+                self._end()
+                continue
+            self._through(item, 0)
+
+    def __aiter__(self) -> NotificationStream:
+        return self
+
+    async def __anext__(self) -> Any:
+        source = self._source
+        ready = self._ready
+        while True:
+            if ready:
+                return ready.popleft()
+            if self._done:
+                self.close()
+                raise StopAsyncIteration
+            if hasattr(source, '__anext__'):
+                try:
+                    item = await source.__anext__()
+                except StopAsyncIteration:
+                    self._end()
+                    continue
+            else:
+                # A blocking source is read on the loop's executor
+                item = await asyncio.get_running_loop().run_in_executor(None, next, source, _END)
+                if item is _END:
+                    self._end()
+                    continue
+            self._through(item, 0)
+
+    @property
+    def dropped(self) -> int:
+        """
+        Notifications the source dropped because the stream was not read fast enough, where it counts them.
+        """
+        return getattr(self._source, 'dropped', 0)
+
+    def close(self):
+        """
+        Stops the source, e.g. removes the listener an `AsyncSpikeHub` stream is fed by.
+        """
+        self._done = True
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self) -> NotificationStream:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+__all__ = [
+    'NotificationStream'
+]
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+from time import monotonic
+from typing import Callable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from spikectl import ujsonrpc
+from spikectl.model import NotificationType
+
+
+_PORTS = ('A', 'B', 'C', 'D', 'E', 'F')
+
+# Raw values kept per port; motors report four (speed, position, absolute position, power)
+VALUES_PER_PORT = 4
+
+# Stored in place of values a sensor did not report, e.g. the distance sensor seeing nothing
+MISSING = -2 ** 31
+
+# Column layout of the integer block
+_HUB_TIME = 0
+_ACCELEROMETER = slice(1, 4)
+_GYROSCOPE = slice(4, 7)
+_ORIENTATION = slice(7, 10)
+_PORT_TYPE = slice(10, 16)
+_PORT_VALUES = slice(16, 16 + 6 * VALUES_PER_PORT)
+_COLUMNS = 16 + 6 * VALUES_PER_PORT
+
+MOTOR_SPEED = 0
+MOTOR_POSITION = 1
+MOTOR_ABSOLUTE_POSITION = 2
+MOTOR_POWER = 3
+
+
+def _port_index(port: str) -> int:
+    assert port in _PORTS, 'port must be a letter between A and F'
+    return _PORTS.index(port)
+
+
+class TelemetryWindow(object):
+    """
+    Consecutive sensor frames as NumPy views into the recorder's columns; nothing is copied.
+
+    Views stay valid until the recorder wraps around and overwrites them, so copy what must outlive that.
+    """
+
+    __slots__ = ['host_time', 'hub_time', 'accelerometer', 'gyroscope', 'orientation', 'port_type', 'port_values']
+
+    def __init__(self, host_time, block):
+        self.host_time = host_time
+        self.hub_time = block[:, _HUB_TIME]
+        self.accelerometer = block[:, _ACCELEROMETER]
+        self.gyroscope = block[:, _GYROSCOPE]
+        self.orientation = block[:, _ORIENTATION]
+        self.port_type = block[:, _PORT_TYPE]
+        self.port_values = block[:, _PORT_VALUES].reshape(len(block), 6, VALUES_PER_PORT)
+
+    def __len__(self) -> int:
+        return len(self.host_time)
+
+    def port(self, port: str, index: Optional[int] = None):
+        """
+        Raw values of `port`, one row per frame, or a single column of them when `index` is given.
+        """
+        values = self.port_values[:, _port_index(port)]
+        return values if index is None else values[:, index]
+
+    def position(self, port: str):
+        return self.port(port, MOTOR_POSITION)
+
+    def absolute_position(self, port: str):
+        return self.port(port, MOTOR_ABSOLUTE_POSITION)
+
+    def speed(self, port: str):
+        return self.port(port, MOTOR_SPEED)
+
+    def connected(self, port: str, device_type: Optional[int] = None):
+        """
+        Boolean mask of the frames where `port` had a device (of `device_type`, when given) attached.
+        """
+        types = self.port_type[:, _port_index(port)]
+        return types != 0 if device_type is None else types == device_type
+
+    def between(self, start: float, end: float) -> TelemetryWindow:
+        """
+        Frames read between the `start` and `end` host monotonic times.
+        """
+        first, last = np.searchsorted(self.host_time, (start, end), side='left')
+        window = TelemetryWindow.__new__(TelemetryWindow)
+        for name in TelemetryWindow.__slots__:
+            setattr(window, name, getattr(self, name)[first:last])
+        return window
+
+    @property
+    def duration(self) -> float:
+        return float(self.host_time[-1] - self.host_time[0]) if len(self.host_time) else 0.0
+
+
+class TelemetryRecorder(object):
+    """
+    Fixed-capacity ring of `SensorNotification` frames stored column by column in preallocated NumPy arrays.
+
+    Every frame is written twice, `capacity` rows apart, so the most recent frames are always contiguous and
+    any window over them is a view rather than a copy.
+    """
+
+    __slots__ = ['capacity', 'recorded', '_host_time', '_block', '_next', '_row']
+
+    def __init__(self, capacity: int = 30000):
+        if np is None:
+            raise ImportError('TelemetryRecorder requires numpy')
+        assert capacity > 0, 'capacity must be a positive number of frames'
+        self.capacity = capacity
+        self.recorded = 0
+        self._host_time = np.zeros(2 * capacity, dtype=np.float64)
+        self._block = np.zeros((2 * capacity, _COLUMNS), dtype=np.int32)
+        self._next = 0
+        self._row: List[int] = [0] * _COLUMNS
+
+    def __len__(self) -> int:
+        return min(self.recorded, self.capacity)
+
+    def append(self, parameters: list, host_time: Optional[float] = None):
+        """
+        Records the raw parameters of a sensor notification.
+        """
+        # Fields a newer firmware may append are ignored
+        a, b, c, d, e, f, accelerometer, gyroscope, orientation, _, hub_time = parameters[:11]
+        row = self._row
+        row[_HUB_TIME] = hub_time
+        row[1], row[2], row[3] = accelerometer
+        row[4], row[5], row[6] = gyroscope
+        row[7], row[8], row[9] = orientation
+        values_start = _PORT_VALUES.start
+        for p, (device_type, values) in enumerate((a, b, c, d, e, f)):
+            row[_PORT_TYPE.start + p] = device_type
+            start = values_start + p * VALUES_PER_PORT
+            for v in range(VALUES_PER_PORT):
+                value = values[v] if v < len(values) else None
+                row[start + v] = value if value is not None else MISSING
+
+        i = self._next
+        mirror = i + self.capacity
+        if host_time is None:
+            host_time = monotonic()
+        self._block[i] = row
+        self._block[mirror] = row
+        self._host_time[i] = host_time
+        self._host_time[mirror] = host_time
+        self._next = (i + 1) % self.capacity
+        self.recorded += 1
+
+    def append_message(self, msg: ujsonrpc.RPCNotification, host_time: Optional[float] = None):
+        if msg.method == NotificationType.Sensor.value:
+            self.append(msg.parameters, host_time)
+
+    def attach(self, hub) -> Callable[[], None]:
+        """
+        Records every sensor frame `hub` reads from now on. Returns a function that stops recording.
+        """
+        return hub.add_notification_hook(self.append_message, (NotificationType.Sensor.value,))
+
+    def _span(self, count: int) -> slice:
+        start = (self._next - count) % self.capacity
+        return slice(start, start + count)
+
+    def last(self, count: Optional[int] = None) -> TelemetryWindow:
+        """
+        The `count` most recent frames (all retained frames by default), oldest first.
+        """
+        available = len(self)
+        count = available if count is None else min(count, available)
+        span = self._span(count)
+        return TelemetryWindow(self._host_time[span], self._block[span])
+
+    def window(self, seconds: float, now: Optional[float] = None) -> TelemetryWindow:
+        """
+        Frames read during the last `seconds`, measured on the host's monotonic clock.
+        """
+        span = self._span(len(self))
+        host_time = self._host_time[span]
+        now = monotonic() if now is None else now
+        first = int(np.searchsorted(host_time, now - seconds, side='left'))
+        return TelemetryWindow(host_time[first:], self._block[span][first:])
+
+    def clear(self):
+        self.recorded = 0
+        self._next = 0
+
+
+__all__ = [
+    'MISSING',
+    'MOTOR_SPEED',
+    'MOTOR_POSITION',
+    'MOTOR_ABSOLUTE_POSITION',
+    'MOTOR_POWER',
+    'TelemetryWindow',
+    'TelemetryRecorder'
+]
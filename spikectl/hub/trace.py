@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+from array import array
+from itertools import count
+import json
+import os
+from threading import current_thread, get_ident
+from time import monotonic
+from typing import Dict, Optional
+
+from spikectl import ujsonrpc
+
+from .pending import PendingRequest
+
+
+_COMPLETE = 0
+_ASYNC = 1
+_INSTANT = 2
+
+
+class Tracer(object):
+    """
+    Timeline of what a hub spends its time on, exported as Chrome Trace Event JSON for Perfetto or
+    chrome://tracing.
+
+    Events go in arrays allocated up front, one slot per event; once `capacity` events are recorded, further
+    ones are counted as dropped. Recording is safe from any thread: each event takes its own slot, and its
+    name is written last so a slot only shows up in the export once complete.
+    """
+
+    __slots__ = ['capacity', 'started', 'dropped', '_sequence', '_kind', '_start', '_duration', '_thread', '_name',
+                 '_category', '_id', '_args', '_thread_names']
+
+    def __init__(self, capacity: int = 65536):
+        assert capacity > 0, 'capacity must be positive'
+        self.capacity = capacity
+        self.started = monotonic()
+        self.dropped = 0
+        self._sequence = count()
+        self._kind = bytearray(capacity)
+        self._start = array('d', bytes(8 * capacity))
+        self._duration = array('d', bytes(8 * capacity))
+        self._thread = array('Q', bytes(8 * capacity))
+        self._name = [None] * capacity
+        self._category = [None] * capacity
+        self._id = [None] * capacity
+        self._args = [None] * capacity
+        self._thread_names: Dict[int, str] = {}
+
+    def _slot(self) -> int:
+        slot = next(self._sequence)
+        if slot >= self.capacity:
+            self.dropped += 1
+            return -1
+        thread = get_ident()
+        if thread not in self._thread_names:
+            self._thread_names[thread] = current_thread().name
+        self._thread[slot] = thread
+        return slot
+
+    def span(self, name: str, category: str, start: float, end: float, args: Optional[dict] = None):
+        """
+        Something the current thread did from `start` to `end`, in monotonic seconds.
+        """
+        slot = self._slot()
+        if slot < 0:
+            return
+        self._kind[slot] = _COMPLETE
+        self._start[slot] = start
+        self._duration[slot] = end - start
+        self._category[slot] = category
+        self._args[slot] = args
+        self._name[slot] = name
+
+    def async_span(self, name: str, category: str, idx: str, start: float, end: float,
+                   args: Optional[dict] = None):
+        """
+        Something in flight from `start` to `end` that may overlap others, e.g. a request awaiting its answer.
+        """
+        slot = self._slot()
+        if slot < 0:
+            return
+        self._kind[slot] = _ASYNC
+        self._start[slot] = start
+        self._duration[slot] = end - start
+        self._category[slot] = category
+        self._id[slot] = idx
+        self._args[slot] = args
+        self._name[slot] = name
+
+    def instant(self, name: str, category: str, timestamp: Optional[float] = None, args: Optional[dict] = None):
+        slot = self._slot()
+        if slot < 0:
+            return
+        self._kind[slot] = _INSTANT
+        self._start[slot] = timestamp if timestamp is not None else monotonic()
+        self._category[slot] = category
+        self._args[slot] = args
+        self._name[slot] = name
+
+    def track(self, task: PendingRequest):
+        """
+        Records `task` from now until it is answered, fails or is cancelled.
+        """
+        sent = monotonic()
+
+        def done(finished: PendingRequest):
+            error = finished.error
+            self.async_span(finished.request.method, 'request', finished.request.id, sent, monotonic(),
+                            {'error': str(error)} if error is not None else None)
+
+        task.add_done_callback(done)
+
+    def on_frame(self, frame: bytes):
+        """
+        Frame hook recording an instant event for each notification.
+        """
+        method = ujsonrpc.peek_method(frame)
+        if method is not None and method is not ujsonrpc.UNKNOWN_METHOD:
+            self.instant(f'notification {method}', 'notification')
+
+    def events(self) -> list:
+        """
+        The recorded events as Chrome Trace Event dicts, with timestamps in microseconds since the tracer
+        was created.
+        """
+        pid = os.getpid()
+        started = self.started
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread, 'args': {'name': name}}
+            for thread, name in list(self._thread_names.items())
+        ]
+        for slot, name in enumerate(self._name):
+            if name is None:
+                # Not taken, or taken but not filled in yet
+                continue
+            kind = self._kind[slot]
+            event = {
+                'name': name,
+                'cat': self._category[slot],
+                'pid': pid,
+                'tid': self._thread[slot],
+                'ts': (self._start[slot] - started) * 1e6
+            }
+            args = self._args[slot]
+            if args is not None:
+                event['args'] = args
+            if kind == _COMPLETE:
+                event['ph'] = 'X'
+                event['dur'] = self._duration[slot] * 1e6
+                events.append(event)
+            elif kind == _ASYNC:
+                event['ph'] = 'b'
+                event['id'] = self._id[slot]
+                events.append(event)
+                events.append({'name': name, 'cat': event['cat'], 'ph': 'e', 'id': event['id'], 'pid': pid,
+                               'tid': event['tid'], 'ts': event['ts'] + self._duration[slot] * 1e6})
+            else:
+                event['ph'] = 'i'
+                event['s'] = 't'
+                events.append(event)
+        return events
+
+    def export(self, path: str):
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped': self.dropped}}, file)
+
+    def clear(self):
+        self.dropped = 0
+        self._sequence = count()
+        self._name = [None] * self.capacity
+        self._args = [None] * self.capacity
+        self._id = [None] * self.capacity
+        self.started = monotonic()
+
+
+__all__ = [
+    'Tracer'
+]
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+from base64 import b64encode
+import random
+import string
+from time import monotonic, time
+from typing import Callable, Dict, Optional
+
+from spikectl.model import StartWriteProgramRequest, WritePackageRequest
+
+from .fleet import HubFleet
+from .pending import PendingRequest, SpikeHubException
+from .spike import SpikeHub
+
+
+# Used when the hub does not say how large a package may be
+_DEFAULT_BLOCK_SIZE = 512
+
+# How often a fleet upload wakes up to notice requests that timed out
+_POLL_INTERVAL = 0.1
+
+
+class UploadError(SpikeHubException): pass
+
+
+def _project_id() -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+
+
+class ProgramUpload(object):
+    """
+    Writes a program into a hub slot, keeping up to `window` `write_package` requests in flight.
+
+    The upload advances from the callbacks of its own requests, so it makes progress whenever something
+    reads from the hub: `SpikeHub.listen`, a `HubFleet` poll or `upload_program`.
+
+    `write_package` carries no offset and the hub appends packages as they arrive, so once later packages
+    are in flight a failed one cannot be sent again on its own. A failure instead lets the packages in
+    flight drain and retries the transfer under a new transfer id; more than `retries` failed transfers
+    fail the upload.
+    """
+
+    __slots__ = ['hub', 'slot', 'data', 'name', 'project_id', 'project_type', 'created', 'modified', 'window',
+                 'retries', 'timeout', 'transfer_id', 'block_size', 'acknowledged', 'attempts', 'error',
+                 'started', 'finished', 'on_done', '_chunks', '_next', '_in_flight', '_generation']
+
+    def __init__(self, hub: SpikeHub, slot: int, data: bytes, name: str, project_id: Optional[str] = None,
+                 project_type: str = 'python', created: Optional[int] = None, modified: Optional[int] = None,
+                 window: int = 4, retries: int = 3, timeout: float = 5.0):
+        assert 0 <= slot <= 19, 'slot must be between 0 and 19'
+        assert window > 0, 'window must allow at least one package in flight'
+        now_ms = int(time() * 1000)
+        self.hub = hub
+        self.slot = slot
+        self.data = memoryview(data)
+        self.name = name
+        self.project_id = project_id if project_id is not None else _project_id()
+        self.project_type = project_type
+        self.created = created if created is not None else now_ms
+        self.modified = modified if modified is not None else now_ms
+        self.window = window
+        self.retries = retries
+        self.timeout = timeout
+        self.transfer_id = None
+        self.block_size = _DEFAULT_BLOCK_SIZE
+        # Packages of the current transfer the hub confirmed, in order
+        self.acknowledged = 0
+        # Transfers started so far
+        self.attempts = 0
+        self.error: Optional[SpikeHubException] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        # Called with the upload once it succeeded or failed
+        self.on_done: Optional[Callable[[ProgramUpload], None]] = None
+        self._chunks = 0
+        self._next = 0
+        self._in_flight = 0
+        self._generation = 0
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    @property
+    def bytes_sent(self) -> int:
+        return min(self.acknowledged * self.block_size, len(self.data))
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished if self.finished is not None else monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """
+        Program bytes confirmed per second.
+        """
+        elapsed = self.elapsed
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def result(self) -> int:
+        if not self.done:
+            raise UploadError(f'upload of {self.name} to slot {self.slot} is still running')
+        if self.error is not None:
+            raise self.error
+        return len(self.data)
+
+    def start(self):
+        self.started = monotonic()
+        self._start_transfer()
+
+    def _start_transfer(self):
+        self.attempts += 1
+        self.acknowledged = 0
+        self._next = 0
+        self._in_flight += 1
+        generation = self._generation
+        request = StartWriteProgramRequest(self.project_id, self.slot, self.name, self.project_type, len(self.data),
+                                           self.created, self.modified)
+        task = self.hub._invoke(request, self.timeout)
+        task.add_done_callback(lambda t: self._on_started(t, generation))
+
+    def _finish(self, error: Optional[SpikeHubException] = None):
+        if self.finished is None:
+            self.error = error
+            self.finished = monotonic()
+            if self.on_done is not None:
+                self.on_done(self)
+
+    def _on_started(self, task: PendingRequest, generation: int):
+        if not self._settle(task, generation):
+            return
+        result = task.response.result or {}
+        self.transfer_id = result.get('transferid')
+        self.block_size = result.get('blocksize') or _DEFAULT_BLOCK_SIZE
+        self._chunks = (len(self.data) + self.block_size - 1) // self.block_size
+        if self._chunks == 0:
+            self._finish()
+        else:
+            self._send_window()
+
+    def _send_window(self):
+        hub = self.hub
+        data = self.data
+        block_size = self.block_size
+        generation = self._generation
+        while self._in_flight < self.window and self._next < self._chunks:
+            index = self._next
+            self._next += 1
+            self._in_flight += 1
+            chunk = b64encode(data[index * block_size:(index + 1) * block_size]).decode('ascii')
+            task = hub._invoke(WritePackageRequest(chunk, self.transfer_id), self.timeout)
+            task.add_done_callback(lambda t, i=index: self._on_package(t, i, generation))
+
+    def _on_package(self, task: PendingRequest, index: int, generation: int):
+        if not self._settle(task, generation):
+            return
+        self.acknowledged = max(self.acknowledged, index + 1)
+        if self.acknowledged == self._chunks:
+            self._finish()
+        else:
+            self._send_window()
+
+    def _settle(self, task: PendingRequest, generation: int) -> bool:
+        """
+        Accounts for a finished request; returns whether the transfer it belongs to carries on.
+        """
+        self._in_flight -= 1
+        if self.finished is not None:
+            return False
+
+        if generation == self._generation:
+            if task.error is None:
+                return True
+            if self.attempts > self.retries:
+                self._finish(UploadError(f'writing {self.name} to slot {self.slot} failed {self.attempts} times: '
+                                         f'{task.error}'))
+                return False
+            self._generation += 1
+
+        # A retry is due; it starts once nothing from the failed transfer is in flight anymore
+        if self._in_flight == 0:
+            self._start_transfer()
+        return False
+
+    def __str__(self):
+        return f'ProgramUpload [name: {self.name}, slot: {self.slot}, sent: {self.bytes_sent}/{len(self.data)}]'
+
+
+def upload_program(hub: SpikeHub, slot: int, data: bytes, name: str, **options) -> ProgramUpload:
+    """
+    Writes `data` into `slot` of `hub` and returns the finished upload; raises `UploadError` if it failed.
+
+    `options` are passed on to `ProgramUpload`.
+    """
+    upload = ProgramUpload(hub, slot, data, name, **options)
+    upload.start()
+    hub.listen(lambda _: not upload.done, methods=())
+    upload.result()
+    return upload
+
+
+def upload_to_fleet(fleet: HubFleet, slot: int, data: bytes, name: str, **options) -> Dict[str, ProgramUpload]:
+    """
+    Writes `data` into `slot` of every hub in `fleet` at the same time. Returns the uploads by hub name;
+    check each one's `error`, as a failing hub does not stop the others.
+    """
+    uploads = {hub_name: ProgramUpload(hub, slot, data, name, **options) for hub_name, hub in fleet.hubs.items()}
+    for upload in uploads.values():
+        upload.start()
+    running = list(uploads.values())
+    while running:
+        fleet.poll(_POLL_INTERVAL)
+        running = [upload for upload in running if not upload.done]
+    return uploads
+
+
+__all__ = [
+    'UploadError',
+    'ProgramUpload',
+    'upload_program',
+    'upload_to_fleet'
+]
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from collections import deque
+from threading import Lock
+from time import monotonic
+from typing import Deque, List, Optional, Tuple
+
+from .pending import PendingRequest
+from .sendqueue import Priority, QueueStats
+
+
+# Same limit as the JavaScript client's MAX_PARALLEL_REQUESTS
+DEFAULT_WINDOW_SIZE = 12
+
+# Weight of each new round trip in the smoothed round-trip time
+_RTT_GAIN = 0.125
+
+# The adaptive window grows while the smoothed round trip stays under this many times the fastest one seen,
+# and shrinks once it goes over the second
+_GROW_BELOW = 2.0
+_SHRINK_ABOVE = 4.0
+
+
+class RequestWindow(object):
+    """
+    Limit on the requests a hub has in flight. Requests beyond it are held host-side, in the order they were
+    made, and sent as answers, errors or timeouts free the window. Urgent requests, e.g. stops, are never held
+    but still count as in flight.
+
+    With `adaptive` set the size follows the round-trip time: it grows by one request after each window's worth
+    of answers while the hub answers about as fast as it ever did, shrinks by one when answers slow down as the
+    hub's input backs up, and halves when a request times out.
+    """
+
+    __slots__ = ['size', 'min_size', 'max_size', 'adaptive', 'in_flight', 'high_watermark', 'waits', 'timeouts',
+                 'rtt', 'min_rtt', '_held', '_answers', '_lock']
+
+    def __init__(self, size: int = DEFAULT_WINDOW_SIZE, adaptive: bool = False, min_size: int = 1,
+                 max_size: int = 64):
+        assert 1 <= min_size <= size <= max_size, 'window size must be between min_size and max_size'
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.adaptive = adaptive
+        self.in_flight = 0
+        # Most requests held at once, and how long held requests waited
+        self.high_watermark = 0
+        self.waits = QueueStats()
+        self.timeouts = 0
+        # Smoothed and fastest round-trip times, in seconds
+        self.rtt: Optional[float] = None
+        self.min_rtt: Optional[float] = None
+        self._held: Deque[Tuple[PendingRequest, Priority, float]] = deque()
+        self._answers = 0
+        self._lock = Lock()
+
+    @property
+    def held(self) -> int:
+        return len(self._held)
+
+    @property
+    def stalls(self) -> int:
+        return self.waits.count
+
+    def admit(self, task: PendingRequest, priority: Priority) -> bool:
+        """
+        Takes a place in the window for `task`; returns `False` when the request is held instead.
+        """
+        with self._lock:
+            if self.in_flight < self.size or priority == Priority.Urgent:
+                self.in_flight += 1
+                return True
+            self._held.append((task, priority, monotonic()))
+            if len(self._held) > self.high_watermark:
+                self.high_watermark = len(self._held)
+        return False
+
+    def complete(self, rtt: Optional[float], timed_out: bool = False) -> List[Tuple[PendingRequest, Priority]]:
+        """
+        Frees the place of a request that was answered after `rtt` seconds, or failed without an answer
+        (`rtt` is `None`). Returns the held requests to send now, each already holding its place.
+        """
+        released = []
+        with self._lock:
+            self.in_flight -= 1
+            if timed_out:
+                self.timeouts += 1
+            if rtt is not None:
+                if self.min_rtt is None or rtt < self.min_rtt:
+                    self.min_rtt = rtt
+                self.rtt = rtt if self.rtt is None else self.rtt + _RTT_GAIN * (rtt - self.rtt)
+            if self.adaptive:
+                self._adapt(rtt, timed_out)
+
+            held = self._held
+            now = monotonic()
+            while held and self.in_flight < self.size:
+                task, priority, queued = held.popleft()
+                if task.done:
+                    # Cancelled or timed out while held
+                    continue
+                self.waits.add(now - queued)
+                self.in_flight += 1
+                released.append((task, priority))
+        return released
+
+    def _adapt(self, rtt: Optional[float], timed_out: bool):
+        if timed_out:
+            self.size = max(self.min_size, self.size // 2)
+            self._answers = 0
+            return
+        if rtt is None:
+            return
+        self._answers += 1
+        if self._answers < self.size:
+            return
+        self._answers = 0
+        if self.rtt < self.min_rtt * _GROW_BELOW:
+            self.size = min(self.max_size, self.size + 1)
+        elif self.rtt > self.min_rtt * _SHRINK_ABOVE:
+            self.size = max(self.min_size, self.size - 1)
+
+    def as_dict(self) -> dict:
+        return {
+            'size': self.size,
+            'in_flight': self.in_flight,
+            'held': len(self._held),
+            'high_watermark': self.high_watermark,
+            'stalls': self.waits.count,
+            'stall_mean_s': self.waits.mean,
+            'stall_max_s': self.waits.max,
+            'timeouts': self.timeouts,
+            'rtt_s': self.rtt,
+            'min_rtt_s': self.min_rtt
+        }
+
+    def __str__(self):
+        return (f'RequestWindow [size: {self.size}, in flight: {self.in_flight}, held: {len(self._held)}, '
+                f'stalls: {self.waits.count}]')
+
+
+__all__ = [
+    'DEFAULT_WINDOW_SIZE',
+    'RequestWindow'
+]
@@ -61,5 +61,7 @@ __all__ = [
     'DisplayStatusNotification',
     'UserProgramPrintNotification',
     'UnknownNotification',
-    'decode_notification'
+    'decode_notification',
+    'decode_external_sensor',
+    'notification_methods'
 ]
\ No newline at end of file
@@ -2,12 +2,12 @@ from __future__ import annotations
 
 from base64 import b64decode
 from enum import Enum
-from typing import List, Optional, Callable, Dict
+from typing import List, Optional, Callable, Dict, FrozenSet, Tuple, Type
 
 from spikectl.ujsonrpc import RPCNotification
 
 
-def _identity(arg): arg
+def _identity(arg): return arg
 
 
 class ExternalSensorData:
@@ -81,11 +81,13 @@ class SensorType(Enum):
 
     @classmethod
     def value_of(cls, idx: int) -> Optional[SensorType]:
-        for st in cls:
-            if st.value == idx:
-                return st
+        return _SENSOR_TYPES.get(idx)
 
-        return None
+
+_SENSOR_TYPES: Dict[int, SensorType] = {st.value: st for st in SensorType}
+
+# Device type id to sensor type and its data decoder, resolved once for the sensor frame decoder
+_SENSOR_DECODERS: Dict[int, Tuple[SensorType, Callable]] = {st.value: (st, st.decoder) for st in SensorType}
 
 
 def _decode_battery_status(notification: RPCNotification) -> BatteryStatusNotification:
@@ -108,43 +110,37 @@ def _decode_storage_information(notification: RPCNotification) -> StorageInforma
     )
 
 
-def __format_external_sensor(data: any, idx: int):
-    type_idx, values = data[idx]
-    sensor_type = SensorType.value_of(type_idx)
-    if sensor_type is None:
-        return None    
+def decode_external_sensor(port: any) -> Optional[ExternalSensorData]:
+    """
+    Decodes one port of a sensor frame, `[device type, raw values]`; `None` when nothing known is connected.
+    """
+    type_idx, values = port
+    entry = _SENSOR_DECODERS.get(type_idx)
+    if entry is None:
+        return None
 
+    sensor_type, decoder = entry
     return ExternalSensorData(
         sensor_type,
-        sensor_type.decode(values)
+        decoder(values)
     )
 
 
 def _decode_sensor_notification(notification: RPCNotification) -> SensorNotification:
-    data = notification.parameters
-    accelerometer = data[SensorDataIndex.Accelerometer.value]
-    gyroscope = data[SensorDataIndex.Gyroscope.value]
-    position = data[SensorDataIndex.Position.value]
-    time = data[SensorDataIndex.Time.value]
-    leds = data[SensorDataIndex.Display.value]
-    a = __format_external_sensor(data, SensorDataIndex.PortA.value)
-    b = __format_external_sensor(data, SensorDataIndex.PortB.value)
-    c = __format_external_sensor(data, SensorDataIndex.PortC.value)
-    d = __format_external_sensor(data, SensorDataIndex.PortD.value)
-    e = __format_external_sensor(data, SensorDataIndex.PortE.value)
-    f = __format_external_sensor(data, SensorDataIndex.PortF.value)
+    # Unpacked in SensorDataIndex order; fields a newer firmware may append are ignored
+    a, b, c, d, e, f, accelerometer, gyroscope, position, leds, time = notification.parameters[:11]
     return SensorNotification(
         accelerometer,
         gyroscope,
         position,
         time,
         leds,
-        a,
-        b,
-        c,
-        d,
-        e,
-        f
+        decode_external_sensor(a),
+        decode_external_sensor(b),
+        decode_external_sensor(c),
+        decode_external_sensor(d),
+        decode_external_sensor(e),
+        decode_external_sensor(f)
     )
 
 
@@ -241,7 +237,7 @@ class NotificationType(Enum):
     Error = 10, _decode_error
     VMState = 11, _decode_vm_state
     ProgramRunning = 12, _decode_program_running
-    UserProgramPrint = 'userProgram.print',
+    UserProgramPrint = 'userProgram.print', _decode_user_program_print
 
     def __new__(cls, *args, **kwargs):
         idx = args[0]
@@ -259,11 +255,14 @@ class NotificationType(Enum):
 
     @classmethod
     def value_of(cls, idx: int) -> Optional[NotificationType]:
-        for st in cls:
-            if st.value == idx:
-                return st
+        return _NOTIFICATION_TYPES_BY_METHOD.get(idx)
 
-        return None
+
+_NOTIFICATION_TYPES_BY_METHOD: Dict[any, NotificationType] = {nt.value: nt for nt in NotificationType}
+
+_NOTIFICATION_DECODERS: Dict[any, Callable[[RPCNotification], BaseNotification]] = {
+    nt.value: nt.decoder for nt in NotificationType
+}
 
 
 class BaseNotification:
@@ -448,7 +447,7 @@ class InfoStatusNotification(BaseNotification):
         self.name = name
 
     @property
-    def type(self) -> NotificationType: return NotificationType.ProgramRunning
+    def type(self) -> NotificationType: return NotificationType.Info
 
     def __str__(self) -> str:
         return f'InfoStatusNotification [name: {self.name}]'
@@ -542,9 +541,38 @@ class UnknownNotification(BaseNotification):
 
 
 def decode_notification(notification: RPCNotification) -> Optional[BaseNotification]:
-    notification_type = NotificationType.value_of(notification.method)
-    return notification_type.decoder(notification) if notification_type is not None else UnknownNotification(
-        notification)
+    decoder = _NOTIFICATION_DECODERS.get(notification.method)
+    return decoder(notification) if decoder is not None else UnknownNotification(notification)
+
+_NOTIFICATION_TYPES = {
+    SensorNotification: NotificationType.Sensor,
+    StorageInformationNotification: NotificationType.Storage,
+    BatteryStatusNotification: NotificationType.Battery,
+    ButtonNotification: NotificationType.Button,
+    GestureNotification: NotificationType.Gesture,
+    DisplayStatusNotification: NotificationType.DisplayStatus,
+    FirmwareNotification: NotificationType.Firmware,
+    StackStartNotification: NotificationType.StackStart,
+    StackStopNotification: NotificationType.StackStop,
+    InfoStatusNotification: NotificationType.Info,
+    ErrorNotification: NotificationType.Error,
+    VmStateNotification: NotificationType.VMState,
+    ProgramRunningNotification: NotificationType.ProgramRunning,
+    UserProgramPrintNotification: NotificationType.UserProgramPrint,
+}
+
+
+def notification_methods(notification_type: Type = BaseNotification) -> Optional[FrozenSet]:
+    """
+    RPC methods whose notifications decode to `notification_type` or one of its subclasses.
+
+    Returns `None` when any method may match, which is the case for `BaseNotification` and
+    `UnknownNotification`.
+    """
+    if issubclass(UnknownNotification, notification_type):
+        return None
+    return frozenset(t.value for cls, t in _NOTIFICATION_TYPES.items() if issubclass(cls, notification_type))
+
 
 __all__ = [
     'SensorDataIndex',
@@ -567,5 +595,7 @@ __all__ = [
     'DisplayStatusNotification',
     'UserProgramPrintNotification',
     'UnknownNotification',
-    'decode_notification'
-]
\ No newline at end of file
+    'decode_notification',
+    'decode_external_sensor',
+    'notification_methods'
+]
\ No newline at end of file
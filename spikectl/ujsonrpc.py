@@ -2,6 +2,7 @@ from typing import Dict, Union
 from base64 import b64decode
 import json
 import random
+import re
 import string
 
 RPC_KEY_ID = 'i'
@@ -12,6 +13,14 @@ RPC_KEY_PARAMETERS = 'p'
 
 CR = '\r'
 
+# Only the leading key is looked at, as results may hold an "m" key of their own; the hub's ujson may put a
+# space after the colon
+_METHOD_PATTERN = re.compile(rb'\s*\{\s*"m":\s*(?:(-?\d+)|"([^"]*)")\s*,\s*"p":')
+_ANSWER_PATTERN = re.compile(rb'\s*\{\s*"[ire]":')
+
+# Returned by `peek_method` when a frame does not look like a ujsonrpc message
+UNKNOWN_METHOD = object()
+
 
 class RPCBaseMessage(object):
     def is_error(self): False
@@ -108,6 +117,23 @@ def is_notification(msg) -> bool:
     return RPC_KEY_METHOD in msg and RPC_KEY_PARAMETERS in msg and RPC_KEY_ID not in msg
 
 
+def peek_method(frame: bytes) -> any:
+    """
+    Finds the method of an encoded message without parsing the rest of it.
+
+    Returns the method (an `int` for most notifications), `None` for responses and errors, which carry
+    no method, or `UNKNOWN_METHOD` when the frame cannot be classified without parsing it, e.g. when its
+    keys come in another order.
+    """
+    match = _METHOD_PATTERN.match(frame)
+    if match is None:
+        return None if _ANSWER_PATTERN.match(frame) is not None else UNKNOWN_METHOD
+    number, name = match.groups()
+    if number is not None:
+        return int(number)
+    return str(name, 'utf-8')
+
+
 def _to_json(obj: any) -> str:
     return json.dumps(obj, separators=(',', ':')) + CR
 
@@ -160,9 +186,11 @@ def encode(msg: Union[RPCBaseMessage]) -> str:
 __all__ = [
     'encode',
     'decode',
+    'peek_method',
+    'UNKNOWN_METHOD',
     'RPCBaseMessage',
     'RPCNotification',
     'RPCError',
     'RPCRequest',
     'RPCResponse'
-]
\ No newline at end of file
+]
\ No newline at end of file
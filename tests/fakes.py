@@ -0,0 +1,59 @@
+from typing import Iterable, List
+
+
+class FakeSerial(object):
+    """
+    Serial port stand-in. Reads hand out `frames`, over and over when `repeat` is set, and then time out
+    straight away; writes are collected in `written`.
+    """
+
+    def __init__(self, frames: Iterable[bytes] = (), repeat: bool = False, timeout: float = 0.05):
+        self.port = 'fake'
+        self.timeout = timeout
+        self.written = bytearray()
+        self._frames = [frame + b'\r' for frame in frames]
+        self._repeat = repeat
+        self._next = 0
+
+    def _pending(self) -> bytes:
+        if self._next < len(self._frames):
+            return self._frames[self._next]
+        if self._repeat and self._frames:
+            self._next = 0
+            return self._frames[0]
+        return b''
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._pending())
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._pending()
+        if data:
+            self._next += 1
+        return data
+
+    def feed(self, frame: bytes):
+        """
+        Makes `frame` readable after the frames given so far.
+        """
+        self._frames.append(frame + b'\r')
+
+    def write(self, data: bytes) -> int:
+        self.written += data
+        return len(data)
+
+    def requests(self) -> List[bytes]:
+        """
+        The frames written so far.
+        """
+        return [frame for frame in bytes(self.written).split(b'\r') if frame]
+
+    def flushInput(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,66 @@
+from threading import Thread
+from time import monotonic, sleep
+
+from spikectl.hub import FrameRing, OverflowPolicy, RawSerialHub
+
+from fakes import FakeSerial
+
+
+def _wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(0.001)
+    return True
+
+
+def test_drop_oldest_overwrites_the_oldest_frame():
+    ring = FrameRing(2, OverflowPolicy.DropOldest)
+    for frame in (b'1', b'2', b'3'):
+        assert ring.put(frame)
+    assert ring.dropped == 1
+    assert [ring.get(0), ring.get(0), ring.get(0)] == [b'2', b'3', None]
+
+
+def test_stop_wakes_a_producer_blocked_on_a_full_ring():
+    ring = FrameRing(1, OverflowPolicy.Block)
+    assert ring.put(b'kept')
+    results = []
+    producer = Thread(target=lambda: results.append(ring.put(b'blocked')), daemon=True)
+    producer.start()
+    sleep(0.05)
+    assert producer.is_alive()
+
+    ring.stop()
+    producer.join(1.0)
+    assert not producer.is_alive()
+    assert results == [False]
+    assert ring.get(0) == b'kept'
+    assert not ring.put(b'late')
+
+
+def test_get_wakes_a_producer_blocked_on_a_full_ring():
+    ring = FrameRing(1, OverflowPolicy.Block)
+    ring.put(b'1')
+    producer = Thread(target=ring.put, args=(b'2',), daemon=True)
+    producer.start()
+    assert ring.get(1.0) == b'1'
+    producer.join(1.0)
+    assert not producer.is_alive()
+    assert ring.get(0) == b'2'
+
+
+def test_stop_reader_wakes_a_reader_blocked_on_a_full_ring():
+    hub = RawSerialHub(FakeSerial([b'{"m":2,"p":[8.3,100]}'], repeat=True))
+    hub.start_reader(capacity=2, overflow=OverflowPolicy.Block)
+    assert _wait_for(lambda: len(hub.ring) == 2)
+
+    stopper = Thread(target=hub.stop_reader, daemon=True)
+    stopper.start()
+    stopper.join(2.0)
+    assert not stopper.is_alive()
+
+    # Frames already in the ring are still delivered
+    assert len(hub.ring) == 2
+    assert hub._read_frame() == b'{"m":2,"p":[8.3,100]}'
@@ -0,0 +1,63 @@
+from spikectl.hub.sendqueue import Priority, SendQueue, ports_of
+from spikectl.model import MotorStartRequest, MotorStopRequest, ProgramTerminateRequest
+
+
+def _drain(queue: SendQueue) -> list:
+    queue.close()
+    written = []
+    item = queue.get()
+    while item is not None:
+        written.append(item[1])
+        item = queue.get()
+    return written
+
+
+def test_urgent_overtakes_other_ports():
+    queue = SendQueue()
+    queue.put(b'start B', Priority.Normal, 'B')
+    queue.put(b'display', Priority.Background)
+    queue.put(b'stop A', Priority.Urgent, 'A')
+    assert _drain(queue) == [b'stop A', b'start B', b'display']
+
+
+def test_urgent_keeps_order_for_its_port():
+    queue = SendQueue()
+    queue.put(b'start A', Priority.Normal, 'A')
+    queue.put(b'display', Priority.Background)
+    queue.put(b'start B', Priority.Normal, 'B')
+    queue.put(b'stop A', Priority.Urgent, 'A')
+    assert _drain(queue) == [b'start A', b'stop A', b'start B', b'display']
+
+
+def test_promoted_writes_stay_behind_earlier_urgent_ones():
+    queue = SendQueue()
+    queue.put(b'start A', Priority.Normal, 'A')
+    queue.put(b'stop B', Priority.Urgent, 'B')
+    queue.put(b'stop A', Priority.Urgent, 'A')
+    assert _drain(queue) == [b'start A', b'stop B', b'stop A']
+
+
+def test_terminate_keeps_order_for_every_port():
+    queue = SendQueue()
+    queue.put(b'start A', Priority.Normal, 'A')
+    queue.put(b'display', Priority.Background)
+    queue.put(b'start F', Priority.Normal, 'F')
+    terminate = ProgramTerminateRequest()
+    queue.put(b'terminate', Priority.Urgent, ports_of(terminate))
+    assert _drain(queue) == [b'start A', b'start F', b'terminate', b'display']
+
+
+def test_ports_of_requests():
+    assert ports_of(MotorStartRequest('C', 50, True)) == {'C'}
+    assert ports_of(MotorStopRequest('C', 1)) == {'C'}
+    assert ports_of(ProgramTerminateRequest()) == set('ABCDEF')
+
+
+def test_discard_drops_only_tagged_writes():
+    queue = SendQueue()
+    channel = object()
+    queue.put(b'speed 10', Priority.Normal, 'A', channel)
+    queue.put(b'display', Priority.Background)
+    queue.put(b'speed 20', Priority.Normal, 'A', channel)
+    assert queue.discard(channel) == 2
+    assert _drain(queue) == [b'display']
@@ -0,0 +1,63 @@
+from base64 import b64encode
+import json
+from time import monotonic, sleep
+
+from spikectl.hub import Setpoints, SpikeHub
+from spikectl.hub.pending import RequestError
+
+from fakes import FakeSerial
+
+
+def _wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(0.001)
+    return True
+
+
+def _sent(port: FakeSerial) -> list:
+    return [(message['m'], message['p'].get('speed')) for message in map(json.loads, port.requests())]
+
+
+def test_newer_setpoint_replaces_one_in_the_send_queue():
+    port = FakeSerial()
+    hub = SpikeHub(port)
+    # The first write goes out at once, the next ones wait for a slow link
+    hub.start_writer(max_rate=20)
+    setpoints = Setpoints(hub, max_rate=1000)
+    channel = setpoints.motor('A')
+    try:
+        for speed, sent in ((10, 1), (20, 2), (30, 3)):
+            channel.start(speed)
+            assert _wait_for(lambda: channel.sent == sent)
+        assert channel.merged == 1
+        assert len(hub.send_queue) == 1
+
+        channel.stop()
+        assert _wait_for(lambda: len(port.requests()) == 2)
+        assert _sent(port) == [('scratch.motor_start', 10), ('scratch.motor_stop', None)]
+        assert len(hub.send_queue) == 0
+    finally:
+        setpoints.close()
+        hub.close()
+
+
+def test_errors_are_counted_per_channel():
+    port = FakeSerial()
+    hub = SpikeHub(port)
+    setpoints = Setpoints(hub, max_rate=1000)
+    try:
+        request = setpoints.motor('B').start(50)
+        assert _wait_for(lambda: setpoints.sent == 1)
+        port.feed(json.dumps({'i': request.id, 'e': b64encode(b'motor not found').decode()}).encode())
+        hub.listen(lambda _: False, methods=())
+
+        channel = setpoints.motor('B')
+        assert channel.errors == 1 and setpoints.errors == 1
+        assert isinstance(channel.last_error, RequestError)
+        assert len(hub.pending) == 0
+    finally:
+        setpoints.close()
+        hub.close()
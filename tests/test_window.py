@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from spikectl.hub import RequestWindow, SpikeHub
+
+from fakes import FakeSerial
+
+
+def _hub(size: int = 1):
+    port = FakeSerial()
+    return SpikeHub(port, window=RequestWindow(size)), port
+
+
+def _sent(port: FakeSerial) -> list:
+    return [(message['m'], message['p'].get('port')) for message in map(json.loads, port.requests())]
+
+
+def test_held_requests_wait_for_the_window():
+    hub, port = _hub()
+    first = hub.motor('A').start(50)
+    held = hub.motor('B').start(50)
+    assert _sent(port) == [('scratch.motor_start', 'A')]
+    assert hub.window.held == 1
+
+    hub.pending.cancel(first)
+    assert _sent(port) == [('scratch.motor_start', 'A'), ('scratch.motor_start', 'B')]
+    assert not held.done
+
+
+def test_cancel_many_does_not_send_held_requests():
+    hub, port = _hub()
+    first = hub.motor('A').start(50)
+    held = hub.motor('B').start(50)
+
+    hub.pending.cancel_many([first, held])
+    assert first.cancelled and held.cancelled
+    assert _sent(port) == [('scratch.motor_start', 'A')]
+    assert hub.window.in_flight == 0
+
+
+def test_close_does_not_send_held_requests():
+    hub, port = _hub()
+    first = hub.motor('A').start(50)
+    held = hub.motor('B').start(50)
+
+    hub.close()
+    assert first.cancelled and held.cancelled
+    assert _sent(port) == [('scratch.motor_start', 'A')]
+
+
+def test_failed_batch_sends_nothing():
+    hub, port = _hub()
+    with pytest.raises(RuntimeError):
+        with hub.batch() as batch:
+            hub.motor('A').start(50)
+            hub.motor('B').start(50)
+            raise RuntimeError('abandoned')
+
+    assert all(task.cancelled for task in batch)
+    assert _sent(port) == []
+    assert hub.window.in_flight == 0